@@ -0,0 +1,91 @@
+"""
+Бенчмарк: сколько сканов в секунду выдерживает проверка билета на входе.
+
+Сравниваются:
+  - index: проверка подписи + ответ из CheckinIndex (то, что делает handle_ticket_scan в режиме check-in);
+  - db:    get_ticket_info_by_token на каждый скан (как без режима check-in), только с --db.
+Для index билеты генерируются в памяти, база не нужна. Для --db нужна база из .env с билетами.
+
+Запуск из корня репозитория:
+    python benchmarks/checkin_index.py --tickets 50000 --scans 200000
+    python benchmarks/checkin_index.py --db --scans 5000 --concurrency 10
+"""
+import argparse
+import asyncio
+import random
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "src"))
+
+from database.checkin import CheckinIndex  # noqa: E402
+from database.tokens import new_ticket_token, verify_ticket_token  # noqa: E402
+
+SECRET = "benchmark-secret"
+
+
+def bench_index(tickets: int, scans: int):
+    rows = []
+    for i in range(tickets):
+        owner_id = 100_000_000 + i // 2  # в среднем по два билета на владельца
+        rows.append({
+            "token": new_ticket_token(owner_id, SECRET),
+            "owner_telegram_id": owner_id,
+            "username": f"user{owner_id}",
+            "name": f"Гость {owner_id}",
+        })
+    index = CheckinIndex(db=None)
+    started = time.perf_counter()
+    index.load_rows(rows)
+    print(f"загрузка {tickets} билетов: {(time.perf_counter() - started) * 1000:.0f} мс")
+
+    tokens = [random.choice(rows)["token"] for _ in range(scans)]
+    started = time.perf_counter()
+    for token in tokens:
+        verify_ticket_token(token, SECRET)
+        index.lookup(token)
+    elapsed = time.perf_counter() - started
+    print(f"index: {scans / elapsed:,.0f} сканов/с ({elapsed / scans * 1e6:.1f} мкс на скан)")
+
+
+async def bench_db(scans: int, concurrency: int):
+    from database.database import Database
+
+    db = Database()
+    await db.connect()
+    try:
+        tokens = [row["token"] for row in await db.pool.fetch("SELECT token FROM tickets LIMIT 10000")]
+        if not tokens:
+            print("db: в базе нет билетов")
+            return
+        sem = asyncio.Semaphore(concurrency)
+
+        async def scan(token: str):
+            async with sem:
+                await db.get_ticket_info_by_token(token)
+
+        started = time.perf_counter()
+        await asyncio.gather(*(scan(random.choice(tokens)) for _ in range(scans)))
+        elapsed = time.perf_counter() - started
+        print(f"db:    {scans / elapsed:,.0f} сканов/с при {concurrency} параллельных "
+              f"({elapsed / scans * 1e3:.2f} мс на скан в среднем)")
+    finally:
+        await db.close()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--tickets", type=int, default=50000)
+    parser.add_argument("--scans", type=int, default=200000)
+    parser.add_argument("--db", action="store_true", help="дополнительно замерить сканы через БД")
+    parser.add_argument("--concurrency", type=int, default=10)
+    args = parser.parse_args()
+
+    bench_index(args.tickets, args.scans)
+    if args.db:
+        asyncio.run(bench_db(min(args.scans, 20000), args.concurrency))
+
+
+if __name__ == "__main__":
+    main()
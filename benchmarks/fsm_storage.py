@@ -0,0 +1,106 @@
+"""
+Бенчмарк: хранилища FSM на типичном апдейте покупки.
+
+Каждый апдейт повторяет то, что делает choose_price вместе с FSM-middleware:
+get_state (для фильтров), update_data, get_data, update_data, set_state.
+Сравниваются MemoryStorage, PostgresStorage без scope (каждый вызов — запрос)
+и PostgresStorage внутри update_scope() (одно чтение и одна запись на апдейт).
+
+Нужна база из .env с примененным init.sql. Запуск из корня репозитория:
+    python benchmarks/fsm_storage.py --updates 2000 --users 200 --concurrency 20
+"""
+import argparse
+import asyncio
+import contextlib
+import statistics
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "src"))
+
+from aiogram.fsm.storage.base import StorageKey  # noqa: E402
+from aiogram.fsm.storage.memory import MemoryStorage  # noqa: E402
+
+from database.database import Database  # noqa: E402
+from database.fsm_storage import PostgresStorage  # noqa: E402
+
+BOT_ID = 1
+
+
+class _CountingPool:
+    """Пропускает запросы в настоящий пул и считает их."""
+
+    def __init__(self, pool):
+        self._pool = pool
+        self.queries = 0
+
+    async def fetchrow(self, *args):
+        self.queries += 1
+        return await self._pool.fetchrow(*args)
+
+    async def execute(self, *args):
+        self.queries += 1
+        return await self._pool.execute(*args)
+
+
+class _CountingDb:
+    def __init__(self, db):
+        self.pool = _CountingPool(db.pool)
+
+
+async def _one_update(storage, key: StorageKey, scoped: bool):
+    scope = storage.update_scope() if scoped else contextlib.nullcontext()
+    async with scope:
+        await storage.get_state(key)
+        await storage.update_data(key, {"repost": True})
+        data = await storage.get_data(key)
+        await storage.update_data(key, {"amount": 750 * int(data.get("qty", 1))})
+        await storage.set_state(key, "PurchaseState:waiting_promo_code")
+
+
+async def _run(name: str, storage, args) -> float:
+    latencies: list[float] = []
+    sem = asyncio.Semaphore(args.concurrency)
+
+    async def update(i: int):
+        user_id = 10_000_000 + i % args.users
+        key = StorageKey(bot_id=BOT_ID, chat_id=user_id, user_id=user_id)
+        async with sem:
+            started = time.perf_counter()
+            await _one_update(storage, key, name == "postgres+scope")
+            latencies.append((time.perf_counter() - started) * 1000)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(update(i) for i in range(args.updates)))
+    elapsed = time.perf_counter() - started
+
+    latencies.sort()
+    p99 = latencies[int(len(latencies) * 0.99) - 1]
+    queries = getattr(getattr(storage, "db", None), "pool", None)
+    per_update = f"{queries.queries / args.updates:.1f}" if queries else "0"
+    print(f"{name:16} {args.updates / elapsed:8.0f} upd/s   p50 {statistics.median(latencies):6.2f} мс"
+          f"   p99 {p99:6.2f} мс   запросов на апдейт: {per_update}")
+    return elapsed
+
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--updates", type=int, default=2000)
+    parser.add_argument("--users", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=20)
+    args = parser.parse_args()
+
+    db = Database()
+    await db.connect()
+    try:
+        await _run("memory", MemoryStorage(), args)
+        for name in ("postgres", "postgres+scope"):
+            await _run(name, PostgresStorage(_CountingDb(db)), args)
+        await db.pool.execute("DELETE FROM fsm_states WHERE key LIKE $1", f"fsm:{BOT_ID}:%")
+    finally:
+        await db.close()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,91 @@
+"""
+Бенчмарк: параллельные покупки по одному ходовому промокоду (create_transaction + promo_redemptions).
+
+Для каждого уровня параллельности создается промокод с лимитом --limit, и по нему запускается
+на --oversell процентов больше покупок, чем лимит. Проверяется, что успешных покупок ровно столько,
+сколько лимит (перепродажи нет), и замеряется пропускная способность — она должна расти
+с параллельностью, а не упираться в блокировку одной строки promo_codes.
+
+Нужна база из .env со схемой из init.sql. Все тестовые пользователи, транзакции и промокоды
+создаются с telegram_id от 9 900 000 000 и удаляются в конце.
+
+Запуск из корня репозитория:
+    python benchmarks/promo_redemption.py --limit 500 --concurrency 1 2 4 8 16
+"""
+import argparse
+import asyncio
+import secrets
+import sys
+import time
+from pathlib import Path
+
+import asyncpg
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "src"))
+
+from database.config import DB_HOST, DB_PORT, DB_NAME, DB_USER, DB_PASSWORD  # noqa: E402
+from database.database import Database  # noqa: E402
+
+BASE_ID = 9_900_000_000
+PRICE = 600
+
+
+async def run_level(db: Database, concurrency: int, limit: int, oversell: int) -> tuple[int, int, float]:
+    code = f"BENCH{secrets.token_hex(4).upper()}"
+    await db.create_promo_code(code, admin_telegram_id=BASE_ID, value=PRICE, usage_limit=limit)
+    attempts = limit + limit * oversell // 100
+    sem = asyncio.Semaphore(concurrency)
+    accepted = rejected = 0
+
+    async def buy(i: int):
+        nonlocal accepted, rejected
+        async with sem:
+            try:
+                await db.create_transaction(BASE_ID + i % 1000, quantity=1, amount=PRICE, promo_code=code)
+                accepted += 1
+            except ValueError:
+                rejected += 1
+
+    started = time.perf_counter()
+    await asyncio.gather(*(buy(i) for i in range(attempts)))
+    elapsed = time.perf_counter() - started
+
+    redeemed = await db.pool.fetchval(
+        "SELECT COUNT(*) FROM promo_redemptions r JOIN promo_codes p ON p.id = r.promo_code_id WHERE p.code = $1",
+        code
+    )
+    if accepted != limit or redeemed != limit:
+        print(f"  ПЕРЕПРОДАЖА ИЛИ НЕДОПРОДАЖА: принято {accepted}, слотов занято {redeemed}, лимит {limit}")
+    return accepted, rejected, elapsed
+
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--limit", type=int, default=500)
+    parser.add_argument("--oversell", type=int, default=20, help="на сколько процентов покупок больше лимита")
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 2, 4, 8, 16])
+    args = parser.parse_args()
+
+    db = Database()
+    # пул под самый высокий уровень параллельности, а не боевые 10 соединений
+    db.pool = await asyncpg.create_pool(host=DB_HOST, port=DB_PORT, database=DB_NAME, user=DB_USER,
+                                        password=DB_PASSWORD, min_size=1, max_size=max(args.concurrency))
+    try:
+        await db.add_users_bulk([(BASE_ID + i, f"bench{i}", "bench") for i in range(1000)])
+        print(f"лимит {args.limit}, покупок на {args.oversell}% больше")
+        baseline = None
+        for concurrency in args.concurrency:
+            accepted, rejected, elapsed = await run_level(db, concurrency, args.limit, args.oversell)
+            rate = accepted / elapsed
+            baseline = baseline or rate / concurrency
+            print(f"  параллельно {concurrency:>3}: принято {accepted}, отказано {rejected}, "
+                  f"{rate:,.0f} покупок/с (x{rate / baseline:.1f} к одному потоку)")
+    finally:
+        await db.pool.execute("DELETE FROM transactions WHERE user_telegram_id >= $1", BASE_ID)
+        await db.pool.execute("DELETE FROM promo_codes WHERE code LIKE 'BENCH%' AND admin_telegram_id >= $1", BASE_ID)
+        await db.pool.execute("DELETE FROM users WHERE telegram_id >= $1", BASE_ID)
+        await db.close()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
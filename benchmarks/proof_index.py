@@ -0,0 +1,81 @@
+"""
+Бенчмарк: поиск похожих скринов оплаты в ProofHashIndex (multi-index hashing по расстоянию Хэмминга).
+
+Хэши генерируются в памяти: часть случайные, часть — «пересжатые копии» (несколько перевернутых бит),
+чтобы индекс был похож на настоящий, где скрины одного банка близки друг к другу.
+Дополнительно замеряется dhash на синтетическом скрине. База не нужна.
+
+Запуск из корня репозитория:
+    python benchmarks/proof_index.py --proofs 50000 --lookups 5000
+"""
+import argparse
+import io
+import random
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "src"))
+
+from PIL import Image, ImageDraw  # noqa: E402
+
+from database.proof_index import PROOF_PHASH_DISTANCE, ProofHashIndex, dhash  # noqa: E402
+
+
+def flip_bits(value: int, bits: int) -> int:
+    for bit in random.sample(range(64), bits):
+        value ^= 1 << bit
+    return value
+
+
+def synthetic_screenshot() -> bytes:
+    image = Image.new("RGB", (1080, 2340), "white")
+    draw = ImageDraw.Draw(image)
+    for y in range(200, 2200, 120):
+        draw.rectangle((80, y, random.randint(300, 1000), y + 60), fill=(random.randint(0, 200),) * 3)
+    buffer = io.BytesIO()
+    image.save(buffer, "JPEG", quality=85)
+    return buffer.getvalue()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--proofs", type=int, default=50000)
+    parser.add_argument("--lookups", type=int, default=5000)
+    parser.add_argument("--distance", type=int, default=PROOF_PHASH_DISTANCE)
+    args = parser.parse_args()
+
+    index = ProofHashIndex(db=None, max_distance=args.distance)
+    hashes = []
+    started = time.perf_counter()
+    for transaction_id in range(args.proofs):
+        if hashes and random.random() < 0.3:
+            phash = flip_bits(random.choice(hashes), random.randint(1, 10))
+        else:
+            phash = random.getrandbits(64)
+        hashes.append(phash)
+        index.add(phash, transaction_id)
+    print(f"построение на {args.proofs} хэшах: {(time.perf_counter() - started) * 1000:.0f} мс")
+
+    timings = []
+    found = 0
+    for _ in range(args.lookups):
+        query = flip_bits(random.choice(hashes), random.randint(0, 4))
+        started = time.perf_counter()
+        found += bool(index.find(query))
+        timings.append(time.perf_counter() - started)
+    timings.sort()
+    p50 = timings[len(timings) // 2] * 1000
+    p99 = timings[min(len(timings) - 1, int(len(timings) * 0.99))] * 1000
+    print(f"поиск (расстояние {args.distance}): p50 {p50:.2f} мс, p99 {p99:.2f} мс, "
+          f"найдено похожих в {found / args.lookups:.0%} запросов")
+
+    data = synthetic_screenshot()
+    started = time.perf_counter()
+    for _ in range(20):
+        dhash(data)
+    print(f"dhash скрина 1080x2340 ({len(data) // 1024} КБ): {(time.perf_counter() - started) / 20 * 1000:.1f} мс")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,93 @@
+"""
+Бенчмарк: задержка обработки апдейтов (p50/p99), пока бот рендерит билеты.
+
+Апдейты имитируются короткими корутинами, которые приходят каждые 10 мс;
+задержка — насколько позже запланированного они реально начали выполняться.
+Сравниваются рендер прямо в event loop (как было) и рендер в TicketRenderer.
+
+Запуск из корня репозитория:
+    python benchmarks/ticket_render_latency.py --tickets 40 --workers 2
+"""
+import argparse
+import asyncio
+import statistics
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "src"))
+
+from PIL import Image  # noqa: E402
+
+from bot.tickets.generator import render_ticket  # noqa: E402
+from bot.tickets.renderer import TicketRenderer, QR_SIZE, QR_POSITION  # noqa: E402
+
+UPDATE_INTERVAL = 0.01
+
+
+def _make_template(path: Path):
+    # шаблон того же масштаба, что и боевой
+    Image.new("RGBA", (1080, 1920), (240, 230, 220, 255)).save(path)
+
+
+async def _update_stream(stop: asyncio.Event, latencies: list[float]):
+    loop = asyncio.get_running_loop()
+    while not stop.is_set():
+        scheduled = loop.time()
+        await asyncio.sleep(UPDATE_INTERVAL)
+        latencies.append((loop.time() - scheduled - UPDATE_INTERVAL) * 1000)
+
+
+def _percentile(values: list[float], q: float) -> float:
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * q))]
+
+
+async def _run(mode: str, tickets: int, workers: int, template: Path):
+    stop = asyncio.Event()
+    latencies: list[float] = []
+    renderer = None
+    if mode == "pool":
+        renderer = TicketRenderer(workers=workers, template_path=template)
+        await renderer.start()
+
+    stream = asyncio.create_task(_update_stream(stop, latencies))
+    started = time.perf_counter()
+    if mode == "inline":
+        # старое поведение: синхронный рендер прямо в корутине
+        for i in range(tickets):
+            render_ticket(f"bench{i}", "bench_bot", template, QR_SIZE, QR_POSITION)
+            await asyncio.sleep(0)
+    else:
+        await asyncio.gather(*(renderer.render(f"bench{i}") for i in range(tickets)))
+    elapsed = time.perf_counter() - started
+    stop.set()
+    await stream
+    if renderer:
+        await renderer.close()
+
+    print(
+        f"{mode:>7} | tickets={tickets:<4} | total={elapsed:6.2f}s | "
+        f"p50={_percentile(latencies, 0.50):7.1f}ms | p99={_percentile(latencies, 0.99):7.1f}ms | "
+        f"max={max(latencies, default=0):7.1f}ms | mean={statistics.fmean(latencies) if latencies else 0:6.1f}ms"
+    )
+
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--tickets", type=int, default=20)
+    parser.add_argument("--workers", type=int, default=2)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        template = Path(tmp) / "template.png"
+        _make_template(template)
+        for mode in ("inline", "pool"):
+            await _run(mode, args.tickets, args.workers, template)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
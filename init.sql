@@ -13,6 +13,9 @@ CREATE TABLE IF NOT EXISTS users
 
 ALTER TABLE users
     ADD COLUMN IF NOT EXISTS name VARCHAR(255);
+-- когда пользователь заблокировал бота или удалил аккаунт; такие пропускаются в рассылках
+ALTER TABLE users
+    ADD COLUMN IF NOT EXISTS blocked_at TIMESTAMP WITH TIME ZONE;
 
 CREATE INDEX IF NOT EXISTS idx_users_telegram_id ON users (telegram_id);
 CREATE INDEX IF NOT EXISTS idx_users_username_trgm ON users USING GIN (username gin_trgm_ops);
@@ -24,7 +27,6 @@ CREATE TABLE IF NOT EXISTS promo_codes
     admin_telegram_id BIGINT             REFERENCES users (telegram_id) ON DELETE SET NULL,
     value             NUMERIC(10, 2)     NOT NULL DEFAULT 750,
     usage_limit       INTEGER            NOT NULL DEFAULT 1,
-    used_count        INTEGER            NOT NULL DEFAULT 0,
     created_at        TIMESTAMP WITH TIME ZONE    DEFAULT CURRENT_TIMESTAMP
 );
 CREATE INDEX IF NOT EXISTS idx_promo_codes_admin ON promo_codes (admin_telegram_id);
@@ -44,6 +46,17 @@ CREATE INDEX IF NOT EXISTS idx_transactions_created_at ON transactions (created_
 CREATE INDEX IF NOT EXISTS idx_transactions_promo ON transactions (promo_code_id);
 CREATE INDEX IF NOT EXISTS idx_transactions_user_date ON transactions (user_telegram_id, created_at);
 
+-- Использования промокодов: у промокода usage_limit слотов (0 .. usage_limit - 1), транзакция занимает один.
+-- Первичный ключ не дает занять слот дважды, поэтому лимит соблюдается без блокировки строки promo_codes
+CREATE TABLE IF NOT EXISTS promo_redemptions
+(
+    promo_code_id  INTEGER NOT NULL REFERENCES promo_codes (id) ON DELETE CASCADE,
+    slot           INTEGER NOT NULL,
+    transaction_id INTEGER NOT NULL UNIQUE REFERENCES transactions (id) ON DELETE CASCADE,
+    created_at     TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP,
+    PRIMARY KEY (promo_code_id, slot)
+);
+
 CREATE TABLE IF NOT EXISTS tickets
 (
     id                SERIAL PRIMARY KEY,
@@ -55,28 +68,126 @@ CREATE TABLE IF NOT EXISTS tickets
 );
 CREATE INDEX IF NOT EXISTS idx_tickets_owner ON tickets (owner_telegram_id);
 CREATE INDEX IF NOT EXISTS idx_tickets_transaction ON tickets (transaction_id);
+CREATE INDEX IF NOT EXISTS idx_tickets_created_at ON tickets (created_at);
+-- когда билет погасили на входе (для офлайн-сканов — время самого скана)
+ALTER TABLE tickets
+    ADD COLUMN IF NOT EXISTS used_at TIMESTAMP WITH TIME ZONE;
+
+-- Отметки инкрементальных выгрузок: до какой строки (created_at, id) админ уже получил данные
+CREATE TABLE IF NOT EXISTS export_watermarks
+(
+    admin_telegram_id BIGINT                   NOT NULL,
+    export_type       VARCHAR(32)              NOT NULL,
+    last_created_at   TIMESTAMP WITH TIME ZONE NOT NULL,
+    last_id           INTEGER                  NOT NULL,
+    updated_at        TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP,
+    PRIMARY KEY (admin_telegram_id, export_type)
+);
+
+-- Рассылки: прогресс хранится в БД, чтобы перезапущенный бот продолжил, а не начал заново
+CREATE TABLE IF NOT EXISTS broadcasts
+(
+    id                  SERIAL PRIMARY KEY,
+    kind                VARCHAR(32) NOT NULL,
+    text                TEXT        NOT NULL,
+    reply_markup        JSONB,
+    admin_chat_id       BIGINT      NOT NULL,
+    progress_message_id BIGINT,
+    status              VARCHAR(20) NOT NULL     DEFAULT 'running' CHECK (status IN ('running', 'done')),
+    created_at          TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP
+);
+-- какой экземпляр бота сейчас шлет рассылку и до какого времени; по истечении аренды ее забирает другой
+ALTER TABLE broadcasts
+    ADD COLUMN IF NOT EXISTS owner VARCHAR(128);
+ALTER TABLE broadcasts
+    ADD COLUMN IF NOT EXISTS lease_expires TIMESTAMP WITH TIME ZONE;
+
+CREATE TABLE IF NOT EXISTS broadcast_recipients
+(
+    broadcast_id INTEGER     NOT NULL REFERENCES broadcasts (id) ON DELETE CASCADE,
+    telegram_id  BIGINT      NOT NULL,
+    status       VARCHAR(20) NOT NULL DEFAULT 'pending' CHECK (status IN ('pending', 'sent', 'failed', 'blocked')),
+    PRIMARY KEY (broadcast_id, telegram_id)
+);
+CREATE INDEX IF NOT EXISTS idx_broadcast_recipients_pending ON broadcast_recipients (broadcast_id) WHERE status = 'pending';
+
+-- Состояние FSM (покупка билета), общее для всех экземпляров бота
+CREATE TABLE IF NOT EXISTS fsm_states
+(
+    key        VARCHAR(255) PRIMARY KEY,
+    state      VARCHAR(255),
+    data       JSONB       NOT NULL DEFAULT '{}',
+    updated_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP
+);
 
--- Создаем или заменяем функцию и триггер
-CREATE OR REPLACE FUNCTION update_promo_used() RETURNS TRIGGER AS
+-- Скрины оплаты, скачанные в архив; файл лежит по sha256 содержимого, один скрин может быть у нескольких транзакций
+CREATE TABLE IF NOT EXISTS payment_proofs
+(
+    id             SERIAL PRIMARY KEY,
+    transaction_id INTEGER      NOT NULL REFERENCES transactions (id) ON DELETE CASCADE,
+    file_id        VARCHAR(255) NOT NULL,
+    sha256         CHAR(64)     NOT NULL,
+    path           TEXT         NOT NULL,
+    phash          BIGINT, -- перцептивный dHash, для поиска похожих скринов
+    created_at     TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP,
+    UNIQUE (transaction_id, file_id)
+);
+CREATE INDEX IF NOT EXISTS idx_payment_proofs_sha256 ON payment_proofs (sha256);
+
+-- Изменения статуса билетов рассылаются через NOTIFY, чтобы индекс check-in у всех экземпляров бота
+-- сразу видел погашенные и новые билеты
+CREATE OR REPLACE FUNCTION notify_ticket_status() RETURNS TRIGGER AS
+$$
+BEGIN
+    PERFORM pg_notify('ticket_status', json_build_object(
+            'token', NEW.token,
+            'status', NEW.status,
+            'owner', NEW.owner_telegram_id
+        )::text);
+    RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS trig_notify_ticket_status ON tickets;
+CREATE TRIGGER trig_notify_ticket_status
+    AFTER INSERT OR UPDATE OF status
+    ON tickets
+    FOR EACH ROW
+EXECUTE PROCEDURE notify_ticket_status();
+
+-- Новые перцептивные хэши скринов рассылаются через NOTIFY, чтобы индекс похожих скринов у всех экземпляров бота
+-- видел скрины, скачанные другими экземплярами
+CREATE OR REPLACE FUNCTION notify_proof_hash() RETURNS TRIGGER AS
 $$
 BEGIN
-    IF NEW.promo_code_id IS NOT NULL THEN
-        UPDATE promo_codes
-        SET used_count = used_count + 1
-        WHERE id = NEW.promo_code_id
-          AND used_count < usage_limit;
-
-        IF NOT FOUND THEN
-            RAISE EXCEPTION 'Промокод уже использован максимальное количество раз или не существует';
-        END IF;
+    IF NEW.phash IS NOT NULL THEN
+        PERFORM pg_notify('proof_hash', json_build_object(
+                'phash', NEW.phash,
+                'transaction_id', NEW.transaction_id
+            )::text);
     END IF;
     RETURN NEW;
 END;
 $$ LANGUAGE plpgsql;
 
-DROP TRIGGER IF EXISTS trig_update_promo ON transactions;
-CREATE TRIGGER trig_update_promo
-    BEFORE INSERT
-    ON transactions
+DROP TRIGGER IF EXISTS trig_notify_proof_hash ON payment_proofs;
+CREATE TRIGGER trig_notify_proof_hash
+    AFTER INSERT
+    ON payment_proofs
     FOR EACH ROW
-EXECUTE PROCEDURE update_promo_used();
\ No newline at end of file
+EXECUTE PROCEDURE notify_proof_hash();
+
+-- Раньше использования считались в promo_codes.used_count (и в create_transaction, и триггером — дважды).
+-- Переносим в promo_redemptions все неотклоненные транзакции с промокодом и убираем старый счетчик
+DROP TRIGGER IF EXISTS trig_update_promo ON transactions;
+DROP FUNCTION IF EXISTS update_promo_used();
+
+INSERT INTO promo_redemptions (promo_code_id, slot, transaction_id)
+SELECT promo_code_id, ROW_NUMBER() OVER (PARTITION BY promo_code_id ORDER BY id) - 1, id
+FROM transactions
+WHERE promo_code_id IS NOT NULL
+  AND status <> 'rejected'
+ON CONFLICT DO NOTHING;
+
+ALTER TABLE promo_codes
+    DROP COLUMN IF EXISTS used_count;
@@ -0,0 +1,76 @@
+"""
+Проигрывает записанные апдейты в локальный вебхук бота.
+
+Принимает файл с ответом getUpdates ({"ok": true, "result": [...]}), JSON-массив апдейтов
+или JSONL (один апдейт в строке). Апдейты отправляются POST-запросами с заголовком
+X-Telegram-Bot-Api-Secret-Token, как это делает telegram.
+
+Бот для теста запускают с BOT_MODE=webhook и WEBHOOK_REGISTER=0, например:
+    python scripts/replay_updates.py updates.json --url http://127.0.0.1:8080/webhook \\
+        --secret "$WEBHOOK_SECRET" --concurrency 20 --repeat 10
+"""
+import argparse
+import asyncio
+import json
+import statistics
+import time
+from pathlib import Path
+
+from aiohttp import ClientSession
+
+
+def load_updates(path: Path) -> list[dict]:
+    text = path.read_text(encoding="utf-8")
+    try:
+        payload = json.loads(text)
+    except json.JSONDecodeError:
+        return [json.loads(line) for line in text.splitlines() if line.strip()]
+    if isinstance(payload, dict):
+        return payload["result"] if "result" in payload else [payload]
+    return payload
+
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("file", type=Path)
+    parser.add_argument("--url", default="http://127.0.0.1:8080/webhook")
+    parser.add_argument("--secret", default="")
+    parser.add_argument("--concurrency", type=int, default=10)
+    parser.add_argument("--repeat", type=int, default=1, help="сколько раз прогнать файл")
+    args = parser.parse_args()
+
+    updates = load_updates(args.file)
+    headers = {"X-Telegram-Bot-Api-Secret-Token": args.secret} if args.secret else {}
+    sem = asyncio.Semaphore(args.concurrency)
+    latencies: list[float] = []
+    statuses: dict[int, int] = {}
+    update_id = max((u.get("update_id", 0) for u in updates), default=0)
+
+    async def post(session: ClientSession, update: dict):
+        async with sem:
+            started = time.perf_counter()
+            async with session.post(args.url, json=update, headers=headers) as response:
+                await response.read()
+            latencies.append((time.perf_counter() - started) * 1000)
+            statuses[response.status] = statuses.get(response.status, 0) + 1
+
+    started = time.perf_counter()
+    async with ClientSession() as session:
+        tasks = []
+        for _ in range(args.repeat):
+            for update in updates:
+                # при повторах даем новые update_id, чтобы апдейты не выглядели дубликатами
+                update_id += 1
+                tasks.append(post(session, {**update, "update_id": update_id}))
+        await asyncio.gather(*tasks)
+    elapsed = time.perf_counter() - started
+
+    latencies.sort()
+    print(f"отправлено {len(latencies)} за {elapsed:.2f} с ({len(latencies) / elapsed:.0f} в секунду)")
+    p99 = latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))]
+    print(f"ответ p50 {statistics.median(latencies):.1f} мс, p99 {p99:.1f} мс")
+    print(f"статусы: {statuses}")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -1,5 +1,9 @@
+import csv
+import html
+import io
 import logging
 import os
+import time
 from datetime import datetime
 from pathlib import Path
 import secrets
@@ -14,36 +18,72 @@ from aiogram.filters import Command
 from aiogram.filters import CommandStart, CommandObject
 
 from database.database import Database
+from database.exports import ExportTooLarge
+from database.stats import StatsService
+from database.instrumentation import DbInstrumentation
+from database.tokens import InvalidTicketToken, verify_ticket_token
+from database.checkin import CheckinIndex
+from database.promo import PromoCache
 from bot.keyboards import buy_more, buy_ticket_kb, kb_mark_ticket_used, feedback_kb
 from bot.utils.messages import get_messages
-from bot.tickets.generator import TICKET_TEMPLATE_PATH, TICKETS_DIR, generate_ticket_image
+from bot.tickets.renderer import TicketRenderer
+from bot.tickets.delivery import deliver_tickets
+from bot.utils.broadcast import BroadcastEngine
+from bot.utils.offline_sync import parse_offline_scans
+from bot.utils.janitor import CacheJanitor, format_size
+from bot.utils.proof_archive import ProofArchiver
 
 ADMINS = [int(el) for el in os.getenv("ADMINS").split(",")]
+# сколько промокодов можно создать одной командой /promo_batch (можно переопределить в .env)
+PROMO_BATCH_MAX = int(os.getenv("PROMO_BATCH_MAX", 10000))
+# сколько раз догенерировать коды, совпавшие с существующими
+PROMO_GENERATE_ATTEMPTS = 5
 
 load_dotenv()
 router = Router()
 
 
-async def _generate_promo(db: Database, admin_id: int, value: float = 750, usage_limit: int = 1) -> str | None:
+async def _generate_promo_codes(db: Database, admin_id: int, count: int, value: float = 750,
+                                usage_limit: int = 1, promo_cache: PromoCache | None = None) -> list[str]:
+    """
+    Генерирует count уникальных промокодов с указанной суммой и количеством доступных использований.
+    Кандидаты создаются в памяти и вставляются одной пачкой (Database.create_promo_codes_bulk);
+    совпавшие с уже существующими пропускаются и догенерируются следующей пачкой.
+    Созданные коды сбрасываются в promo_cache: если такой код уже вводили, там мог остаться промах.
+    """
+    created: list[str] = []
+    for _ in range(PROMO_GENERATE_ATTEMPTS):
+        missing = count - len(created)
+        if missing <= 0:
+            break
+        candidates = set()
+        while len(candidates) < missing:
+            candidates.add(secrets.token_hex(3).upper())  # генерим короткий промокод
+        batch = await db.create_promo_codes_bulk(list(candidates), admin_telegram_id=admin_id, value=value,
+                                                 usage_limit=usage_limit)
+        if promo_cache:
+            for code in batch:
+                promo_cache.invalidate(code)
+        created += batch
+    if len(created) < count:
+        logging.warning(f"Создано {len(created)} промокодов из {count}: слишком много совпадений с существующими.")
+    return created
+
+
+async def _generate_promo(db: Database, admin_id: int, value: float = 750, usage_limit: int = 1,
+                          promo_cache: PromoCache | None = None) -> str | None:
     """Генерирует уникальный промокод с указанной суммой и количеством доступных использований."""
-    import secrets, asyncio, logging
-
-    code = secrets.token_hex(3).upper()  # генерим короткий промокод
     try:
-        success = await db.create_promo_code(code=code, admin_telegram_id=admin_id, value=value,
-                                             usage_limit=usage_limit)
-        if not success:
-            logging.warning(f"Сгенерированный промокод {code} уже существует. Повторная попытка.")
-            return await _generate_promo(db, admin_id, value=value, usage_limit=usage_limit)
-        await asyncio.sleep(0.5)  # небольшая пауза для надежности
-        return code
+        codes = await _generate_promo_codes(db, admin_id, 1, value=value, usage_limit=usage_limit,
+                                            promo_cache=promo_cache)
     except Exception as e:
         logging.exception(f"Ошибка при создании промокода: {e}")
         return None
+    return codes[0] if codes else None
 
 
 @router.message(Command("promo"), F.from_user.id.in_(ADMINS))
-async def promo_command(message: Message, db: Database):
+async def promo_command(message: Message, db: Database, promo_cache: PromoCache):
     """
     Команда для генерации нового промокода.
     Форматы:
@@ -73,7 +113,8 @@ async def promo_command(message: Message, db: Database):
             return
 
     msg = await message.answer(msgs["promo_generating"])
-    promo_code = await _generate_promo(db, message.from_user.id, value=value, usage_limit=usage_limit)
+    promo_code = await _generate_promo(db, message.from_user.id, value=value, usage_limit=usage_limit,
+                                       promo_cache=promo_cache)
 
     if promo_code:
         await msg.edit_text(msgs["promo"].format(promo_code, value, usage_limit))
@@ -81,6 +122,46 @@ async def promo_command(message: Message, db: Database):
         await msg.edit_text(msgs["promo_failed"])
 
 
+@router.message(Command("promo_batch"), F.from_user.id.in_(ADMINS))
+async def promo_batch_command(message: Message, command: CommandObject, db: Database, promo_cache: PromoCache):
+    """
+    Генерирует сразу много промокодов (например, для партнеров) и присылает их CSV-файлом.
+    Формат: /promo_batch <кол-во> <номинал> <лимит использований>
+    Например: /promo_batch 2000 600 1
+    """
+    msgs = get_messages()
+    try:
+        count, value, usage_limit = (command.args or "").split()
+        count, value, usage_limit = int(count), float(value), int(usage_limit)
+        if not 1 <= count <= PROMO_BATCH_MAX or value < 0 or usage_limit < 1:
+            raise ValueError
+    except ValueError:
+        await message.answer(msgs["promo_batch_usage"].format(max=PROMO_BATCH_MAX))
+        return
+
+    msg = await message.answer(msgs["promo_batch_generating"].format(count=count))
+    started = time.perf_counter()
+    try:
+        codes = await _generate_promo_codes(db, message.from_user.id, count, value=value, usage_limit=usage_limit,
+                                            promo_cache=promo_cache)
+    except Exception:
+        logging.exception("Ошибка при пакетном создании промокодов.")
+        await msg.edit_text(msgs["promo_failed"])
+        return
+
+    report = io.StringIO()
+    writer = csv.writer(report)
+    writer.writerow(["code", "value", "usage_limit"])
+    writer.writerows((code, value, usage_limit) for code in codes)
+    await message.answer_document(
+        document=types.BufferedInputFile(report.getvalue().encode("utf-8"),
+                                         filename=f"promo_batch_{datetime.now().strftime('%Y%m%d_%H%M%S')}.csv"),
+        caption=msgs["promo_batch_done"].format(created=len(codes), count=count, value=value,
+                                                usage_limit=usage_limit, seconds=time.perf_counter() - started),
+    )
+    await msg.delete()
+
+
 @router.message(Command("afisha"), F.from_user.id.in_(ADMINS))
 async def afisha_send_command(message: Message):
     channel_id = os.getenv("CHANNEL_ID")
@@ -101,10 +182,12 @@ async def afisha_send_command(message: Message):
 
 
 @router.message(Command("feedback"), F.from_user.id.in_(ADMINS))
-async def feedback_command(message: Message, db: Database):
+async def feedback_command(message: Message, db: Database, broadcast_engine: BroadcastEngine):
     """
     Запускает рассылку с просьбой оставить отзыв всем, кто посетил мероприятие.
     Текст сообщения берется из messages.yaml по ключу 'feedback'.
+    Рассылка идет в фоне через BroadcastEngine: прогресс обновляется в сообщении о старте,
+    по завершении приходит итоговый отчет.
     """
     msgs = get_messages()
 
@@ -115,37 +198,24 @@ async def feedback_command(message: Message, db: Database):
         await message.answer(msgs["feedback_no_users"])
         return
 
-    # 2. Уведомляем админа о начале
+    # 2. Уведомляем админа о начале — это же сообщение потом показывает прогресс
     total_users = len(user_ids)
-    await message.answer(msgs["feedback_started"].format(user_count=total_users))
-
-    # 3. Начинаем рассылку
-    mailing_text = msgs["feedback"]
-    success_count = 0
-    fail_count = 0
-
-    for user_id in user_ids:
-        try:
-            await message.bot.send_message(chat_id=user_id, text=mailing_text, reply_markup=await feedback_kb())
-            success_count += 1
-        except Exception as e:
-            fail_count += 1
-            logging.warning(f"Не удалось отправить фидбек-сообщение пользователю {user_id}. Ошибка: {e}")
-
-        # Задержка для защиты от спам-фильтров Telegram
-        await asyncio.sleep(0.1)
-
-    # 4. Отправляем итоговый отчет администратору
-    await message.answer(
-        msgs["feedback_finished"].format(
-            success_count=success_count,
-            fail_count=fail_count
-        )
+    msg = await message.answer(msgs["feedback_started"].format(user_count=total_users))
+
+    # 3. Запускаем рассылку
+    await broadcast_engine.start(
+        kind="feedback",
+        text=msgs["feedback"],
+        recipient_ids=user_ids,
+        admin_chat_id=message.chat.id,
+        progress_message_id=msg.message_id,
+        reply_markup=await feedback_kb(),
     )
 
 
 @router.callback_query(F.data.startswith("approve:"))
-async def approve(callback: CallbackQuery, db: Database):
+async def approve(callback: CallbackQuery, db: Database, ticket_renderer: TicketRenderer,
+                  proof_archiver: ProofArchiver):
     """
     Обработчик для кнопки 'подтвердить' от модератора.
     Подтверждает транзакцию, генерирует и отправляет билеты пользователю.
@@ -160,6 +230,7 @@ async def approve(callback: CallbackQuery, db: Database):
     try:
         # Подтверждаем транзакцию в БД и получаем токены билетов
         new_tickets = await db.approve_transaction(transaction_id=transaction_id)
+        proof_archiver.forget(transaction_id)
 
         # Редактируем сообщение модератора
         moderator_username = callback.from_user.username
@@ -174,43 +245,23 @@ async def approve(callback: CallbackQuery, db: Database):
         transaction_info = await db.get_transaction(transaction_id)
         user_id = transaction_info.get("user_telegram_id")
 
-        # Отправляем общее сообщение пользователю перед билетами
-        await callback.bot.send_message(
-            chat_id=user_id,
-            text=get_messages()[
+        # Рендерим все билеты параллельно и отправляем альбомом вслед за общим сообщением
+        failed_tokens = await deliver_tickets(
+            bot=callback.bot,
+            user_id=user_id,
+            tokens=new_tickets,
+            renderer=ticket_renderer,
+            intro_text=get_messages()[
                 "ticket_delivered" if len(new_tickets) == 1 else "tickets_delivered"].format('🎟' * len(new_tickets)),
-            reply_markup=None
+            reply_markup=await buy_more(),
         )
 
-        # Генерируем и отправляем каждый билет отдельно
-        for token in new_tickets:
-            try:
-                ticket_path = await generate_ticket_image(
-                    token=token,
-                    bot_username='be_lekker_bot',
-                    template_path=TICKET_TEMPLATE_PATH,
-                    qr_size=(750, 750),
-                    qr_position=(170, 610),
-                    output_dir=TICKETS_DIR
-                )
-
-                await callback.bot.send_document(
-                    chat_id=user_id,
-                    document=types.FSInputFile(ticket_path),
-                    disable_notification=True,
-                    reply_markup=await buy_more()
-                )
-
-                # Удаляем временный файл билета после отправки
-                os.remove(ticket_path)
-            except Exception as e:
-                logging.error(f"Failed to generate or send ticket {token}: {e}")
-                await callback.bot.send_message(
-                    chat_id=user_id,
-                    text=f"Произошла ошибка при отправке одного из ваших билетов. Пожалуйста, обратитесь к администратору.\nТокен билета: `{token}`",
-                    disable_notification=True
-                )
-
+        for token in failed_tokens:
+            await callback.bot.send_message(
+                chat_id=user_id,
+                text=f"Произошла ошибка при отправке одного из ваших билетов. Пожалуйста, обратитесь к администратору.\nТокен билета: `{token}`",
+                disable_notification=True
+            )
 
     except ValueError as e:
         # Обработка ошибок, которые выдает database.py
@@ -220,8 +271,58 @@ async def approve(callback: CallbackQuery, db: Database):
         await callback.message.answer("Произошла непредвиденная ошибка при обработке.")
 
 
+@router.message(Command("comp"), F.from_user.id.in_(ADMINS))
+async def comp_command(message: Message, db: Database, ticket_renderer: TicketRenderer):
+    """
+    Выдает бесплатные билеты сразу нескольким пользователям.
+    Формат:
+      /comp 2 123456789 @username ...   → по 2 билета каждому из перечисленных
+    Пользователи указываются по telegram_id или @username и должны хотя бы раз написать боту.
+    """
+    msgs = get_messages()
+    parts = message.text.split()[1:]
+    try:
+        quantity = int(parts[0])
+        if quantity < 1 or len(parts) < 2:
+            raise ValueError
+    except (ValueError, IndexError):
+        await message.answer(msgs["comp_usage"])
+        return
+
+    telegram_ids = [int(p) for p in parts[1:] if p.isdigit()]
+    usernames = [p.lstrip("@") for p in parts[1:] if not p.isdigit()]
+    try:
+        found = await db.get_telegram_ids_by_usernames(usernames) if usernames else {}
+        unknown = [f"@{u}" for u in usernames if u not in found]
+        telegram_ids.extend(found.values())
+
+        issued = await db.issue_complimentary_tickets(telegram_ids, quantity)
+        unknown.extend(str(tid) for tid in telegram_ids if tid not in issued)
+
+        failed_tokens = []
+        for user_id, tokens in issued.items():
+            failed_tokens += await deliver_tickets(
+                bot=message.bot,
+                user_id=user_id,
+                tokens=tokens,
+                renderer=ticket_renderer,
+                intro_text=msgs["ticket_delivered" if len(tokens) == 1 else "tickets_delivered"].format('🎟' * len(tokens)),
+                reply_markup=await buy_more(),
+            )
+
+        await message.answer(msgs["comp_done"].format(
+            tickets=sum(len(tokens) for tokens in issued.values()),
+            users=len(issued),
+            unknown=", ".join(unknown) or "—",
+            failed=len(failed_tokens),
+        ))
+    except Exception:
+        logging.exception("Ошибка при выдаче бесплатных билетов.")
+        await message.answer(msgs["comp_failed"])
+
+
 @router.callback_query(F.data.startswith("reject:"))
-async def reject(callback: CallbackQuery, db: Database):
+async def reject(callback: CallbackQuery, db: Database, proof_archiver: ProofArchiver):
     """
     Обработчик для кнопки 'Отклонить' от модератора.
     Отклоняет транзакцию и уведомляет пользователя.
@@ -236,6 +337,7 @@ async def reject(callback: CallbackQuery, db: Database):
     try:
         # Отклоняем транзакцию в БД
         await db.reject_transaction(transaction_id=transaction_id)
+        proof_archiver.forget(transaction_id)
 
         # Редактируем сообщение модератора
         moderator_username = callback.from_user.username
@@ -262,29 +364,40 @@ async def reject(callback: CallbackQuery, db: Database):
 
 
 @router.message(Command("stats_info"), F.from_user.id.in_(ADMINS))
-async def stats_info_command(message: Message, db: Database):
+async def stats_info_command(message: Message, stats_service: StatsService, cache_janitor: CacheJanitor):
     """
     Показывает общую статистику по боту с разбивкой билетов по статусам.
+    Цифры берутся из кэшированного снимка (см. StatsService), в ответе видно, насколько он свежий.
+    Место на диске — из последнего прохода уборщика кэша.
     """
     msgs = get_messages()
     try:
-        total_users = await db.count_users()
-        total_sales_amount = await db.get_total_sales_amount()
-        ticket_stats = await db.get_ticket_stats()
+        stats, taken_at = await stats_service.get()
 
-        # Получаем данные из записи. Если таблица билетов пуста, stats может быть None
-        active_tickets = ticket_stats['active_tickets'] if ticket_stats else 0
-        used_tickets = ticket_stats['used_tickets'] if ticket_stats else 0
+        active_tickets = stats['active_tickets']
+        used_tickets = stats['used_tickets']
         total_tickets = active_tickets + used_tickets
 
         # Формируем и отправляем сообщение
         stats_message = msgs["stats_info_message"].format(
-            total_users=total_users,
-            total_sales_amount=total_sales_amount,
+            total_users=stats['total_users'],
+            total_sales_amount=stats['total_sales_amount'],
             total_tickets=total_tickets,
             active_tickets=active_tickets,
-            used_tickets=used_tickets
+            used_tickets=used_tickets,
+            taken_at=taken_at.strftime('%H:%M:%S'),
+            age=int((datetime.now() - taken_at).total_seconds()),
         )
+        if cache_janitor.checked_at:
+            usage = {category: format_size(size) for category, (_, size) in cache_janitor.usage.items()}
+            stats_message += msgs["stats_disk_usage"].format(
+                total=format_size(cache_janitor.total_bytes),
+                budget=format_size(cache_janitor.max_bytes),
+                removed_files=cache_janitor.removed_files,
+                removed_bytes=format_size(cache_janitor.removed_bytes),
+                checked_at=cache_janitor.checked_at.strftime('%H:%M:%S'),
+                **usage,
+            )
 
         await message.answer(stats_message)
 
@@ -293,6 +406,95 @@ async def stats_info_command(message: Message, db: Database):
         await message.answer(msgs["stats_generic_error"])
 
 
+@router.message(Command("checkin_on"), F.from_user.id.in_(ADMINS))
+async def checkin_on_command(message: Message, checkin_index: CheckinIndex):
+    """Включает режим check-in: загружает активные билеты в память и подписывается на их изменения."""
+    msgs = get_messages()
+    started = time.monotonic()
+    try:
+        count = await checkin_index.enable()
+    except Exception:
+        logging.exception("Не удалось включить режим check-in.")
+        await message.answer(msgs["checkin_failed"])
+        return
+    await message.answer(msgs["checkin_enabled"].format(
+        count=count, ms=int((time.monotonic() - started) * 1000)))
+
+
+@router.message(Command("checkin_off"), F.from_user.id.in_(ADMINS))
+async def checkin_off_command(message: Message, checkin_index: CheckinIndex):
+    """Выключает режим check-in; сканы снова идут в БД."""
+    await checkin_index.disable()
+    await message.answer(get_messages()["checkin_disabled"])
+
+
+@router.message(Command("checkin_sync"), F.from_user.id.in_(ADMINS))
+async def checkin_sync_command(message: Message, db: Database, checkin_index: CheckinIndex):
+    """
+    Сверяет офлайн-сканы: админ присылает txt/csv документ с подписью /checkin_sync,
+    по строке на скан (токен или ссылка из QR, время скана). Билеты гасятся пачками,
+    в ответ — сводка и CSV с результатом по каждому токену.
+    """
+    msgs = get_messages()
+    if not message.document:
+        await message.answer(msgs["checkin_sync_usage"])
+        return
+
+    buffer = await message.bot.download(message.document)
+    text = buffer.getvalue().decode("utf-8-sig", errors="replace")
+    scans, invalid = parse_offline_scans(text)
+    if not scans and not invalid:
+        await message.answer(msgs["checkin_sync_usage"])
+        return
+
+    try:
+        results = await db.use_tickets_bulk(scans)
+    except Exception:
+        logging.exception("Ошибка при сверке офлайн-сканов.")
+        await message.answer(msgs["checkin_sync_failed"])
+        return
+
+    for token, result in results.items():
+        if result == 'accepted':
+            checkin_index.mark_used(token)
+    results.update((token, 'invalid') for token in invalid)
+
+    counts = {key: 0 for key in ('accepted', 'used', 'unknown', 'invalid')}
+    report = io.StringIO()
+    writer = csv.writer(report)
+    writer.writerow(["token", "result"])
+    for token, result in results.items():
+        counts[result] += 1
+        writer.writerow([token, result])
+
+    await message.answer_document(
+        document=types.BufferedInputFile(report.getvalue().encode("utf-8"), filename="checkin_sync_report.csv"),
+        caption=msgs["checkin_sync_report"].format(total=len(results), **counts),
+    )
+
+
+@router.message(Command("debug_db"), F.from_user.id.in_(ADMINS))
+async def debug_db_command(message: Message, db_instrumentation: DbInstrumentation | None = None):
+    """Показывает замеры БД: состояние пула, самые тяжелые методы Database и медленные запросы."""
+    if db_instrumentation is None:
+        await message.answer(get_messages()["debug_db_disabled"])
+        return
+    report = db_instrumentation.report()
+    # лимит telegram — 4096 символов
+    await message.answer(f"<pre>{html.escape(report[:3900])}</pre>")
+
+
+async def _send_export(message: Message, paths: list[str], caption: str):
+    """Отправляет выгрузку (одну или несколько частей) документами и удаляет временные файлы."""
+    try:
+        for i, path in enumerate(paths, start=1):
+            part_caption = caption if len(paths) == 1 else f"{caption} Часть {i}/{len(paths)}."
+            await message.answer_document(document=types.FSInputFile(path), caption=part_caption)
+    finally:
+        for path in paths:
+            os.remove(path)  # Удаляем временные файлы
+
+
 @router.message(Command("stats_transactions"), F.from_user.id.in_(ADMINS))
 async def stats_transactions_command(message: Message, db: Database):
     """
@@ -300,15 +502,11 @@ async def stats_transactions_command(message: Message, db: Database):
     """
     try:
         msg = await message.answer("🔄 Генерирую файл со списком транзакций...")
-        csv_file_path = await db.export_transactions_csv()
-
-        await message.answer_document(
-            document=types.FSInputFile(csv_file_path),
-            caption="Отчет по всем транзакциям."
-        )
-
+        csv_file_paths = await db.export_transactions_csv()
+        await _send_export(message, csv_file_paths, "Отчет по всем транзакциям.")
         await msg.delete()
-        os.remove(csv_file_path)  # Удаляем временный файл
+    except ExportTooLarge:
+        await message.answer(get_messages()["stats_export_too_large"])
     except Exception as e:
         logging.exception("Ошибка при экспорте транзакций.")
         await message.answer("Не удалось сгенерировать отчет. Пожалуйста, проверьте логи.")
@@ -321,15 +519,11 @@ async def stats_tickets_command(message: Message, db: Database):
     """
     try:
         msg = await message.answer("🔄 Генерирую файл со списком билетов...")
-        csv_file_path = await db.export_tickets_csv()
-
-        await message.answer_document(
-            document=types.FSInputFile(csv_file_path),
-            caption="Отчет по всем билетам."
-        )
-
+        csv_file_paths = await db.export_tickets_csv()
+        await _send_export(message, csv_file_paths, "Отчет по всем билетам.")
         await msg.delete()
-        os.remove(csv_file_path)  # Удаляем временный файл
+    except ExportTooLarge:
+        await message.answer(get_messages()["stats_export_too_large"])
     except Exception as e:
         logging.exception("Ошибка при экспорте билетов.")
         await message.answer("Не удалось сгенерировать отчет. Пожалуйста, проверьте логи.")
@@ -342,20 +536,58 @@ async def stats_users_command(message: Message, db: Database):
     """
     try:
         msg = await message.answer("🔄 Генерирую файл со списком пользователей...")
-        csv_file_path = await db.export_users_csv()
-
-        await message.answer_document(
-            document=types.FSInputFile(csv_file_path),
-            caption="Отчет по пользователям и активным билетам."
-        )
-
+        csv_file_paths = await db.export_users_csv()
+        await _send_export(message, csv_file_paths, "Отчет по пользователям и активным билетам.")
         await msg.delete()
-        os.remove(csv_file_path)  # Удаляем временный файл
+    except ExportTooLarge:
+        await message.answer(get_messages()["stats_export_too_large"])
     except Exception as e:
         logging.exception("Ошибка при экспорте пользователей.")
         await message.answer("Не удалось сгенерировать отчет. Пожалуйста, проверьте логи.")
 
 
+async def _send_delta_export(message: Message, db: Database, export_type: str, caption: str):
+    """Отправляет админу новые строки с его прошлой выгрузки и сдвигает отметку."""
+    msgs = get_messages()
+    admin_id = message.from_user.id
+    try:
+        msg = await message.answer(msgs["stats_delta_generating"])
+        if export_type == "transactions":
+            paths, watermark = await db.export_transactions_delta(admin_id)
+        else:
+            paths, watermark = await db.export_tickets_delta(admin_id)
+
+        if not paths:
+            await msg.edit_text(msgs["stats_delta_empty"])
+            return
+
+        await _send_export(message, paths, caption)
+        # отметку двигаем только после того, как файл ушел админу
+        await db.set_export_watermark(admin_id, export_type, *watermark)
+        await msg.delete()
+    except ExportTooLarge:
+        await message.answer(msgs["stats_export_too_large"])
+    except Exception:
+        logging.exception(f"Ошибка при инкрементальной выгрузке {export_type}.")
+        await message.answer("Не удалось сгенерировать отчет. Пожалуйста, проверьте логи.")
+
+
+@router.message(Command("delta_transactions"), F.from_user.id.in_(ADMINS))
+async def delta_transactions_command(message: Message, db: Database):
+    """
+    Отправляет CSV только с транзакциями, появившимися после прошлого /delta_transactions этого админа.
+    """
+    await _send_delta_export(message, db, "transactions", "Новые транзакции с прошлой выгрузки.")
+
+
+@router.message(Command("delta_tickets"), F.from_user.id.in_(ADMINS))
+async def delta_tickets_command(message: Message, db: Database):
+    """
+    Отправляет CSV только с билетами, появившимися после прошлого /delta_tickets этого админа.
+    """
+    await _send_delta_export(message, db, "tickets", "Новые билеты с прошлой выгрузки.")
+
+
 @router.message(Command("stats_tickets_users"), F.from_user.id.in_(ADMINS))
 async def stats_tickets_users_command(message: Message, db: Database):
     """
@@ -440,67 +672,101 @@ async def stats_tickets_users_command(message: Message, db: Database):
 #         f"- Не удалось отправить (заблокировали бота и т.д.): {fail_count}"
 #     )
 
+async def _answer_ticket_info(message: Message, token: str, name: str | None, username: str | None, active: bool):
+    """Отвечает админу информацией о владельце; к активному билету добавляет кнопку отметки."""
+    msgs = get_messages()
+    # Формируем информацию о владельце для вывода
+    owner_name = name or "Имя не указано"
+    owner_username = f"@{username}" if username else "Никнейм скрыт"
+
+    if active:
+        # Билет активен, отправляем инфо и кнопку
+        await message.answer(
+            text=msgs["ticket_scan_info"].format(
+                owner_name=owner_name,
+                owner_username=owner_username,
+                token=token
+            ),
+            reply_markup=await kb_mark_ticket_used(token)
+        )
+    else:
+        # Билет уже использован, просто информируем
+        await message.answer(
+            text=msgs["ticket_scan_already_used_info"].format(
+                owner_name=owner_name,
+                owner_username=owner_username,
+                token=token
+            )
+        )
+
+
 @router.message(CommandStart(deep_link=True), F.from_user.id.in_(ADMINS))
-async def handle_ticket_scan(message: Message, command: CommandObject, db: Database):
+async def handle_ticket_scan(message: Message, command: CommandObject, db: Database, checkin_index: CheckinIndex):
     """
     Обрабатывает сканирование QR-кода билета администратором.
     Отправляет информацию о владельце и кнопку для отметки.
+    В режиме check-in ответ берется из индекса в памяти, без запросов в БД.
     """
 
     msgs = get_messages()
     token = command.args
-    print(token)
     if not token:
         await message.answer(msgs["ticket_scan_token_error"])
         return
 
+    # подпись проверяем локально: поддельный или битый QR отсекается без запроса в БД
     try:
-        ticket_info = await db.get_ticket_info_by_token(token)
-
-        if not ticket_info:
-            await message.answer(msgs["ticket_scan_not_found"].format(token=token))
-            return
+        owner_id = verify_ticket_token(token)
+    except InvalidTicketToken:
+        await message.answer(msgs["ticket_scan_invalid"].format(token=html.escape(token)))
+        return
 
-        # Формируем информацию о владельце для вывода
-        owner_name = ticket_info['name'] or "Имя не указано"
-        owner_username = f"@{ticket_info['username']}" if ticket_info['username'] else "Никнейм скрыт"
+    entry = checkin_index.lookup(token) if checkin_index.enabled else None
+    if entry:
+        await _answer_ticket_info(message, token, entry.name, entry.username, not entry.used)
+        return
 
-        # Проверяем статус билета и отправляем соответствующее сообщение
-        if ticket_info['status'] == 'active':
-            # Билет активен, отправляем инфо и кнопку
+    try:
+        # вне индекса статус и владельца знает только БД — и для подписанных билетов, и для старого формата
+        ticket_info = await db.get_ticket_info_by_token(token)
+    except Exception as e:
+        logging.exception("Ошибка при обработке сканирования билета.")
+        if owner_id is not None:
+            # БД недоступна, но подпись верна: показываем владельца из токена, статус проверит use_ticket при отметке
             await message.answer(
-                text=msgs["ticket_scan_info"].format(
-                    owner_name=owner_name,
-                    owner_username=owner_username,
-                    token=token
-                ),
+                text=msgs["ticket_scan_signed_info"].format(owner_id=owner_id, token=token),
                 reply_markup=await kb_mark_ticket_used(token)
             )
         else:
-            # Билет уже использован, просто информируем
-            await message.answer(
-                text=msgs["ticket_scan_already_used_info"].format(
-                    owner_name=owner_name,
-                    owner_username=owner_username,
-                    token=token
-                )
-            )
+            await message.answer(msgs["ticket_scan_unexpected_error"].format(error=e))
+        return
 
-    except Exception as e:
-        logging.exception("Ошибка при обработке сканирования билета.")
-        await message.answer(msgs["ticket_scan_unexpected_error"].format(error=e))
+    if not ticket_info:
+        await message.answer(msgs["ticket_scan_not_found"].format(token=token))
+        return
+
+    await _answer_ticket_info(message, token, ticket_info['name'], ticket_info['username'],
+                              ticket_info['status'] == 'active')
 
 
 @router.callback_query(F.data.startswith("mark_ticket:"), F.from_user.id.in_(ADMINS))
-async def handle_mark_ticket_callback(callback: CallbackQuery, db: Database):
+async def handle_mark_ticket_callback(callback: CallbackQuery, db: Database, checkin_index: CheckinIndex):
     """
     Обрабатывает нажатие кнопки "отметить", гасит билет и редактирует сообщение.
     """
     msgs = get_messages()
     token = callback.data.split(":")[1]
+    try:
+        verify_ticket_token(token)
+    except InvalidTicketToken:
+        await callback.answer(text=msgs["ticket_scan_invalid_callback"], show_alert=True)
+        return
 
     # Пытаемся погасить билет
     success = await db.use_ticket(token)
+    if success:
+        # остальные экземпляры узнают через NOTIFY, свой индекс обновляем сразу
+        checkin_index.mark_used(token)
 
     if success:
         # Билет успешно погашен
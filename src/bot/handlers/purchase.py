@@ -1,10 +1,6 @@
-import os
 import time
-import asyncio
-import json
-import csv
 import logging
-from aiogram import Router, F, types
+from aiogram import Bot, Router, F, types
 from aiogram.fsm.context import FSMContext
 from aiogram.types import Message, CallbackQuery
 
@@ -17,62 +13,48 @@ from bot.keyboards import (
     kb_promo_code,
 )
 from bot.states import PurchaseState
+from bot.utils.albums import AlbumAggregator
 from bot.utils.messages import get_messages
 
 from database.database import Database
+from database.promo import PromoCache
 
 router = Router()
 
-_album_buffers: dict = {}
-_album_meta: dict = {}
-_album_tasks: dict = {}
-
 
 async def forward_to_group_and_log(
-        message: Message,
+        bot: Bot,
+        user: types.User,
         qty: int,
         files: list,
         ts: int,
-        data: dict,
         repost: bool,
         transaction_id: int,
         db: Database,
-):
-    try:
-        # логируем метаданные (для альбома — список файлов через |)
-        meta = {
-            "user_id": message.from_user.id,
-            "username": message.from_user.username,
+        group_chat_id: int | None,
+        audit_log=None,
+) -> types.Message | None:
+    """Пишет журнал оплат и отправляет скрины модераторам. Возвращает сообщение с кнопками."""
+    # логируем метаданные (для альбома — список file_id через |); запись на диск идет в фоне,
+    # sha256 и путь к скачанному файлу — в payment_proofs
+    if audit_log:
+        audit_log.write({
+            "user_id": user.id,
+            "username": user.username,
             "qty": qty,
             "timestamp": ts,
             "repost": repost,
-            "file": "|".join(f["filename"] for f in files),
-        }
-        # jsonl
-        with open("cache/payments_log.jsonl", "a", encoding="utf-8") as jf:
-            jf.write(json.dumps(meta, ensure_ascii=False) + "\n")
-        # csv
-        write_header = not os.path.exists("cache/payments_log.csv")
-        with open("cache/payments_log.csv", "a", newline="", encoding="utf-8") as cf:
-            w = csv.DictWriter(
-                cf,
-                fieldnames=["user_id", "username", "qty", "timestamp", "file"],
-                extrasaction="ignore",
-            )
-            if write_header:
-                w.writeheader()
-            w.writerow(meta)
-    except Exception:
-        logging.exception("Ошибка при логировании")
+            "transaction_id": transaction_id,
+            "file": "|".join(f["file_id"] for f in files),
+        })
 
-    group_chat_id = data.get("group_chat_id") or data.get("admin_chat_id")
     if not group_chat_id:
-        return
+        return None
 
     uname = (
-        ("@" + message.from_user.username)
-        if message.from_user.username
-        else (message.from_user.full_name or get_messages()["default_username"])
+        ("@" + user.username)
+        if user.username
+        else (user.full_name or get_messages()["default_username"])
     )
 
     # сумма: берем прямо из транзакции
@@ -90,14 +72,14 @@ async def forward_to_group_and_log(
         # альбом: отправляем все фото без подписи
         media = [types.InputMediaPhoto(media=f["file_id"]) for f in files]
         try:
-            await message.bot.send_media_group(chat_id=group_chat_id, media=media, disable_notification=True)
+            await bot.send_media_group(chat_id=group_chat_id, media=media, disable_notification=True)
         except Exception:
             logging.exception("Ошибка при отправке альбома")
-            return
+            return None
 
         # следом — инфо-сообщение с подписью и кнопками
         try:
-            await message.bot.send_message(
+            return await bot.send_message(
                 chat_id=group_chat_id,
                 text=caption_text,
                 parse_mode="HTML",
@@ -105,9 +87,10 @@ async def forward_to_group_and_log(
             )
         except Exception:
             logging.exception("Ошибка при отправке сообщения с кнопками")
+            return None
     else:
         # одиночное фото: подпись + кнопки в одном сообщении
-        await message.bot.send_photo(
+        return await bot.send_photo(
             chat_id=group_chat_id,
             photo=files[0]["file_id"],
             caption=caption_text,
@@ -238,17 +221,18 @@ async def back(call: CallbackQuery, state: FSMContext):
 
 
 @router.message(PurchaseState.waiting_promo_code, F.text)
-async def check_promo_code(message: Message, state: FSMContext, db: Database):
+async def check_promo_code(message: Message, state: FSMContext, promo_cache: PromoCache):
     promo_code = message.text.strip()
-    promo_data = await db.get_promo_code(promo_code)
+    # из кэша: ходовой промокод не дергает БД на каждый ввод, а лимит все равно проверит create_transaction
+    promo_data = await promo_cache.get(promo_code)
 
     # Проверка, что promo_data не None и что промокод не использован полностью.
-    if not promo_data or promo_data['used_count'] >= promo_data['usage_limit']:
+    if not promo_data or not promo_data.available:
         await message.answer(get_messages()["promo_code_invalid"])
         return
 
     # Получаем value для этого промокода
-    promo_value = promo_data['value']  # Используем значение из promo_data, чтобы избежать лишнего запроса
+    promo_value = promo_data.value  # Используем значение из promo_data, чтобы избежать лишнего запроса
     if promo_value is None:  # На случай, если каким-то образом value оказалось None (чего быть не должно)
         await message.answer(get_messages()["promo_code_invalid"])
         return
@@ -267,94 +251,63 @@ async def check_promo_code(message: Message, state: FSMContext, db: Database):
     await state.set_state(PurchaseState.waiting_payment_confirm)
 
 
-@router.message(PurchaseState.waiting_payment_proof, F.photo)
-async def got_proof(message: Message, state: FSMContext, **data):
-    # создаем транзакцию в БД
-    sd = await state.get_data()
+async def _submit_proof(
+        bot: Bot,
+        user: types.User,
+        chat_id: int,
+        state: FSMContext,
+        sd: dict,
+        files: list,
+        ts: int,
+        db: Database,
+        group_chat_id: int | None,
+        audit_log=None,
+        proof_archiver=None,
+):
+    """Создает транзакцию по скринам оплаты (одному фото или целому альбому) и отправляет их модераторам."""
     qty = sd.get("qty", 1)
     repost = sd.get("repost", False)
-    total_amount = sd.get("amount")
-    promo_code = sd.get("promo_code", None)
-    db: Database = data.get("db")  # Get the db object from workflow_data
-
-    # Создаем транзакцию в БД ОДИН РАЗ, перед любым асинхронным ожиданием
     try:
         transaction_id = await db.create_transaction(
-            user_telegram_id=message.from_user.id,
+            user_telegram_id=user.id,
             quantity=qty,
-            amount=total_amount,
-            promo_code=promo_code
+            amount=sd.get("amount"),
+            promo_code=sd.get("promo_code", None)
         )
     except ValueError as e:
-        await message.answer(f"Произошла ошибка при создании транзакции: {e}")
+        await bot.send_message(chat_id=chat_id, text=f"Произошла ошибка при создании транзакции: {e}")
         logging.error(f"Error creating transaction: {e}")
         return
 
-    # собираем альбом в буфер и шлем один раз
-    mgid = getattr(message, "media_group_id", None)
-    os.makedirs("cache", exist_ok=True)
-    p = message.photo[-1]
-    file_id = p.file_id
-    file = await message.bot.get_file(file_id)
+    moderation_message = await forward_to_group_and_log(
+        bot, user, qty, files, ts, repost, transaction_id, db, group_chat_id, audit_log)
+    if proof_archiver:
+        # скачивание в архив — в фоне, модераторам скрины уходят по file_id;
+        # похожие скрины других транзакций архив потом отметит в moderation_message
+        proof_archiver.submit(transaction_id, [f["file_id"] for f in files], moderation_message)
+    await bot.send_message(chat_id=chat_id, text=get_messages()["on_review"])
+    await state.set_state(PurchaseState.on_review)
+
+
+@router.message(PurchaseState.waiting_payment_proof, F.photo)
+async def got_proof(message: Message, state: FSMContext, db: Database, album_aggregator: AlbumAggregator, **data):
+    sd = await state.get_data()
     ts = int(time.time())
-    filename = f"cache/pay_{message.from_user.id}_{ts}_{file_id[-8:]}.jpg"
-    try:
-        await message.bot.download(file, destination=filename)
-    except Exception:
-        pass
-
-    if mgid:
-        key = (message.from_user.id, mgid)
-        _album_buffers.setdefault(key, []).append({"file_id": message.photo[-1].file_id, "filename": filename})
-        # обновляем метаданные каждый раз (последние данные победят)
-        _album_meta[key] = {"ts": ts, "qty": qty, "data": data, "chat_id": message.chat.id, "repost": repost}
-
-        # дебаунсим отправку: пересоздаём задачу на каждый новый элемент альбома
-        prev_task = _album_tasks.get(key)
-        if prev_task and not prev_task.done():
-            try:
-                prev_task.cancel()
-            except Exception:
-                pass
-
-        async def _flush(local_key=key, local_transaction_id=transaction_id):
-            try:
-                await asyncio.sleep(1.2)
-            except asyncio.CancelledError:
-                return
-            if _album_tasks.get(local_key) is not asyncio.current_task():
-                return
-            files = _album_buffers.pop(local_key, [])
-            meta = _album_meta.pop(local_key, None) or {}
-            _album_tasks.pop(local_key, None)
-            if files:
-                await forward_to_group_and_log(
-                    message,
-                    meta.get("qty", qty),
-                    files,
-                    meta.get("ts", ts),
-                    meta.get("data", data),
-                    meta.get("repost", repost),
-                    local_transaction_id,
-                    db
-                )
-                await message.answer(get_messages()["on_review"])
-                await state.set_state(PurchaseState.on_review)
-
-        task = asyncio.create_task(_flush())
-        _album_tasks[key] = task
+    proof = {"file_id": message.photo[-1].file_id}
+
+    # в замыкании только то, что нужно для отправки, — не message и не data апдейта
+    bot, user, chat_id = message.bot, message.from_user, message.chat.id
+    group_chat_id, audit_log = data.get("group_chat_id"), data.get("audit_log")
+    proof_archiver = data.get("proof_archiver")
+
+    async def submit(files: list):
+        await _submit_proof(bot, user, chat_id, state, sd, files, ts, db, group_chat_id, audit_log, proof_archiver)
+
+    if message.media_group_id:
+        # фото альбома приходят отдельными апдейтами: транзакция создастся одна, когда альбом соберется
+        if not album_aggregator.add((user.id, message.media_group_id), proof, submit):
+            await message.answer(get_messages()["album_rejected"])
         return
 
     # одиночное фото — шлем сразу
-    await forward_to_group_and_log(
-        message,
-        qty,
-        [{"file_id": message.photo[-1].file_id, "filename": filename}],
-        ts,
-        data,
-        repost,
-        transaction_id,
-        db
-    )
-    await message.answer(get_messages()["on_review"])
-    await state.set_state(PurchaseState.on_review)
+    await submit([proof])
@@ -4,11 +4,26 @@ from dotenv import load_dotenv
 
 from aiogram import Bot, Dispatcher
 from aiogram.client.default import DefaultBotProperties
-from aiogram.fsm.storage.memory import MemoryStorage
 
-from bot.middlewares import AddUserMiddleware
+from bot.middlewares import AddUserMiddleware, FSMScopeMiddleware, OrderingMiddleware
 from bot.handlers import start, purchase, admin
+from bot.tickets.renderer import TicketRenderer
+from bot.utils.broadcast import BroadcastEngine
+from bot.utils.audit_log import AuditLogWriter
+from bot.utils.albums import AlbumAggregator
+from bot.utils.proof_archive import ProofArchiver
+from bot.utils.janitor import CacheJanitor
+from bot.utils.metrics import metrics
+from bot.utils.tracing import TRACE_SAMPLE_RATE, Tracer, TracingMiddleware, TracingSession
+from bot.webhook import BOT_MODE, METRICS_PORT, run_webhook, start_service_server
 from database.database import Database
+from database.fsm_storage import PostgresStorage
+from database.user_buffer import UserWriteBuffer
+from database.stats import StatsService
+from database.checkin import CHECKIN_AUTOSTART, CheckinIndex
+from database.proof_index import ProofHashIndex
+from database.promo import PromoCache
+from database.instrumentation import DB_INSTRUMENTATION, instrument_database
 
 load_dotenv()
 
@@ -20,29 +35,112 @@ async def main():
 
     group_chat_id = os.getenv("CHAT_ID")
 
-    bot = Bot(token=token, default=DefaultBotProperties(parse_mode='HTML'))
-    dp = Dispatcher(storage=MemoryStorage())
+    # пул рендера поднимаем и прогреваем до старта поллинга, а не на первом билете
+    ticket_renderer = TicketRenderer()
+    await ticket_renderer.start()
+
+    # трассировка включается только при TRACE_SAMPLE_RATE > 0, иначе ничего не устанавливаем
+    tracer = Tracer() if TRACE_SAMPLE_RATE > 0 else None
+    if tracer:
+        tracer.start()
+    bot = Bot(token=token, default=DefaultBotProperties(parse_mode='HTML'),
+              session=TracingSession(tracer) if tracer else None)
 
     db = Database()
     await db.connect()
+    # замеры по методам Database: ожидание пула, время запросов, медленный SQL (/debug_db, /metrics)
+    db_instrumentation = instrument_database(db, metrics) if DB_INSTRUMENTATION else None
+    if db_instrumentation:
+        db_instrumentation.tracer = tracer
+
+    # состояние FSM лежит в postgres, чтобы его видели все экземпляры бота и оно переживало рестарт.
+    # встроенный FSM-middleware регистрируем сами, уже внутри scope: он читает состояние для фильтров
+    storage = PostgresStorage(db)
+    dp = Dispatcher(storage=storage, disable_fsm=True)
+    if tracer:
+        # корневой спан — до очереди, чтобы в трассе было видно и ожидание
+        dp.update.outer_middleware(TracingMiddleware(tracer))
+    # апдейты одного пользователя — по очереди, разных — параллельно в пределах UPDATE_CONCURRENCY
+    dp.update.outer_middleware(OrderingMiddleware())
+    dp.update.outer_middleware(FSMScopeMiddleware(storage))
+    dp.update.outer_middleware(dp.fsm)
+
+    db.user_buffer = UserWriteBuffer(db)
+    db.user_buffer.start()
+
+    broadcast_engine = BroadcastEngine(bot, db)
+    audit_log = AuditLogWriter()
+    audit_log.start()
+    checkin_index = CheckinIndex(db)
+    if CHECKIN_AUTOSTART:
+        # на входе все реплики сразу отвечают на сканы из памяти
+        await checkin_index.enable()
+    album_aggregator = AlbumAggregator()
+    proof_index = ProofHashIndex(db)
+    await proof_index.load()
+    proof_archiver = ProofArchiver(bot, db, hash_index=proof_index)
+    proof_archiver.start()
+    cache_janitor = CacheJanitor(db)
+    cache_janitor.start()
 
     dp.workflow_data.update({
         "db": db,
         "group_chat_id": int(group_chat_id) if group_chat_id else None,
+        "ticket_renderer": ticket_renderer,
+        "stats_service": StatsService(db),
+        "promo_cache": PromoCache(db),
+        "broadcast_engine": broadcast_engine,
+        "audit_log": audit_log,
+        "db_instrumentation": db_instrumentation,
+        "checkin_index": checkin_index,
+        "album_aggregator": album_aggregator,
+        "proof_archiver": proof_archiver,
+        "cache_janitor": cache_janitor,
     })
 
-    dp.message.middleware(AddUserMiddleware())
-    dp.callback_query.middleware(AddUserMiddleware())
+    # один экземпляр на оба типа событий, чтобы кэш профилей был общим
+    add_user_middleware = AddUserMiddleware()
+    dp.message.middleware(add_user_middleware)
+    dp.callback_query.middleware(add_user_middleware)
+    if tracer:
+        # последним из inner-middleware, чтобы спан обработчика мерил только сам обработчик
+        tracing_middleware = TracingMiddleware(tracer)
+        dp.message.middleware(tracing_middleware)
+        dp.callback_query.middleware(tracing_middleware)
 
     dp.include_router(admin.router)
     dp.include_router(start.router)
     dp.include_router(purchase.router)
 
+    service_server = None
     try:
-        # await bot.delete_webhook(drop_pending_updates=True)
-        await dp.start_polling(bot)
+        # рассылки, прерванные перезапуском, продолжаем с того же места
+        await broadcast_engine.resume()
+        if BOT_MODE == "webhook":
+            await run_webhook(bot, dp, db)
+        else:
+            if METRICS_PORT:
+                service_server = await start_service_server(db)
+            # await bot.delete_webhook(drop_pending_updates=True)
+            await dp.start_polling(bot)
     finally:
+        if service_server:
+            await service_server.cleanup()
+        await broadcast_engine.close()
+        # недособранные альбомы отдаем модераторам, пока бот и база еще открыты
+        await album_aggregator.close()
+        # после альбомов: они еще могут поставить скрины в очередь архива
+        await proof_archiver.close()
+        await proof_index.close()
+        await cache_janitor.close()
+        await audit_log.close()
+        await checkin_index.disable()
+        # досылаем накопленных пользователей до закрытия пула
+        await db.user_buffer.close()
         await db.close()
+        await ticket_renderer.close()
+        if tracer:
+            await tracer.close()
 
 
 if __name__ == "__main__":
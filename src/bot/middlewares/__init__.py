@@ -1 +1,3 @@
-from .add_user import *
\ No newline at end of file
+from .add_user import *
+from .fsm_scope import *
+from .ordering import *
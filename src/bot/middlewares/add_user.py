@@ -1,15 +1,67 @@
 # src/bot/middlewares/add_user.py
 
 import asyncio
+import logging
+import os
+import time
+from collections import OrderedDict
 from aiogram import BaseMiddleware
 from aiogram.types import TelegramObject
 from typing import Callable, Awaitable, Dict, Any
 
+# размер и время жизни кэша профилей (можно переопределить в .env)
+USER_CACHE_SIZE = int(os.getenv("USER_CACHE_SIZE", 50000))
+USER_CACHE_TTL = float(os.getenv("USER_CACHE_TTL", 3600))
+
 
 class AddUserMiddleware(BaseMiddleware):
-    def __init__(self):
+    """
+    Сохраняет пользователя в БД, но только если он новый или поменял username/имя.
+    Уже виденные профили лежат в LRU-кэше (telegram_id -> username, name) с TTL,
+    так что на большинство апдейтов в БД никто не ходит.
+    Блокировка — на конкретного пользователя, разные пользователи друг друга не ждут.
+    Если у Database подключен user_buffer, запись отдается ему и апдейт вообще не ждет БД.
+    """
+
+    def __init__(self, maxsize: int = USER_CACHE_SIZE, ttl: float = USER_CACHE_TTL):
         super().__init__()
-        self._lock = asyncio.Lock()
+        self.maxsize = maxsize
+        self.ttl = ttl
+        # telegram_id -> (username, name, истекает_в)
+        self._cache: OrderedDict[int, tuple[str, str, float]] = OrderedDict()
+        # telegram_id -> [lock, сколько апдейтов его держат или ждут]
+        self._locks: dict[int, list] = {}
+
+    def _is_known(self, user_id: int, username: str, name: str) -> bool:
+        entry = self._cache.get(user_id)
+        if entry is None:
+            return False
+        cached_username, cached_name, expires_at = entry
+        if expires_at < time.monotonic() or cached_username != username or cached_name != name:
+            return False
+        self._cache.move_to_end(user_id)
+        return True
+
+    def _remember(self, user_id: int, username: str, name: str):
+        self._cache[user_id] = (username, name, time.monotonic() + self.ttl)
+        self._cache.move_to_end(user_id)
+        while len(self._cache) > self.maxsize:
+            self._cache.popitem(last=False)
+
+    async def _save_user(self, db, user_id: int, username: str, name: str):
+        entry = self._locks.setdefault(user_id, [asyncio.Lock(), 0])
+        entry[1] += 1
+        try:
+            async with entry[0]:
+                # пока ждали, другой апдейт этого же пользователя мог уже все записать
+                if self._is_known(user_id, username, name):
+                    return
+                await db.add_user(user_id, username, name)
+                self._remember(user_id, username, name)
+        finally:
+            entry[1] -= 1
+            if entry[1] == 0:
+                self._locks.pop(user_id, None)
 
     async def __call__(
             self,
@@ -22,12 +74,18 @@ class AddUserMiddleware(BaseMiddleware):
         if db and user:
             # формируем полное имя пользователя
             full_name = " ".join(filter(None, [user.first_name, user.last_name]))
+            username = user.username or ""
 
-            async with self._lock:
+            if self._is_known(user.id, username, full_name):
+                pass
+            elif db.user_buffer:
+                # запись отложенная: буфер сбросит пачку сам или по flush_user()
+                db.user_buffer.add(user.id, username, full_name)
+                self._remember(user.id, username, full_name)
+            else:
                 try:
-                    # Передаем все три параметра в метод add_user
-                    await db.add_user(user.id, user.username or "", full_name)
+                    await self._save_user(db, user.id, username, full_name)
                 except Exception:
-                    pass
+                    logging.exception(f"Не удалось сохранить пользователя {user.id}")
 
         return await handler(event, data)
@@ -0,0 +1,26 @@
+# src/bot/middlewares/fsm_scope.py
+
+from aiogram import BaseMiddleware
+from aiogram.types import TelegramObject
+from typing import Callable, Awaitable, Dict, Any
+
+
+class FSMScopeMiddleware(BaseMiddleware):
+    """
+    Оборачивает обработку апдейта в storage.update_scope(): состояние читается из БД один раз,
+    а все изменения пишутся разом после обработчика.
+    Регистрируется на dp.update до FSMContextMiddleware — тот сам читает состояние для фильтров.
+    """
+
+    def __init__(self, storage):
+        super().__init__()
+        self.storage = storage
+
+    async def __call__(
+            self,
+            handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+            event: TelegramObject,
+            data: Dict[str, Any]
+    ) -> Any:
+        async with self.storage.update_scope():
+            return await handler(event, data)
@@ -0,0 +1,99 @@
+# src/bot/middlewares/ordering.py
+
+import asyncio
+import logging
+import os
+from aiogram import BaseMiddleware
+from aiogram.dispatcher.middlewares.user_context import EVENT_CONTEXT_KEY
+from aiogram.types import TelegramObject
+from typing import Callable, Awaitable, Dict, Any
+
+from bot.utils.metrics import metrics
+
+# параллельная обработка апдейтов (можно переопределить в .env)
+UPDATE_CONCURRENCY = int(os.getenv("UPDATE_CONCURRENCY", 64))
+# сколько секунд апдейт может прождать своей очереди, прежде чем его выбросят
+UPDATE_MAX_WAIT = float(os.getenv("UPDATE_MAX_WAIT", 30))
+
+
+class OrderingMiddleware(BaseMiddleware):
+    """
+    Апдейты разных пользователей обрабатываются параллельно, но не больше concurrency одновременно,
+    а апдейты одного пользователя (или чата, если пользователя нет) — строго по очереди.
+    Ключ именно пользователь, а не чат: нажатия разных админов в общей группе друг друга не ждут.
+    Очередь на ключ — это asyncio.Lock: он отдает блокировку ожидающим в порядке прихода,
+    поэтому два нажатия repost: подряд пройдут choose_price друг за другом, а не наперегонки.
+    Сначала апдейт ждет своей очереди по ключу, потом общий слот, так что очередь одного пользователя
+    не занимает слоты, пока стоит. Кто прождал дольше max_wait, не обрабатывается.
+    Регистрируется на dp.update первым из наших middleware, до FSM.
+    """
+
+    def __init__(self, concurrency: int = UPDATE_CONCURRENCY, max_wait: float = UPDATE_MAX_WAIT):
+        super().__init__()
+        self.max_wait = max_wait
+        self._slots = asyncio.Semaphore(concurrency)
+        # ключ -> [lock, сколько апдейтов его держат или ждут]
+        self._queues: dict[int, list] = {}
+        self._waiting = 0
+        self._in_flight = 0
+
+        metrics.describe("updates_waiting", "Апдейты, ждущие своей очереди или свободного слота")
+        metrics.describe("updates_in_flight", "Апдейты в обработке")
+        metrics.describe("updates_queue_keys", "Пользователи, у которых есть апдейты в работе или в очереди")
+        metrics.describe("updates_queue_max_depth", "Самая длинная очередь одного пользователя")
+        metrics.describe("updates_dropped_total", "Апдейты, выброшенные после UPDATE_MAX_WAIT")
+        metrics.describe("updates_queue_wait_seconds", "Сколько апдейт ждал перед обработкой")
+        metrics.gauge_fn("updates_waiting", lambda: self._waiting)
+        metrics.gauge_fn("updates_in_flight", lambda: self._in_flight)
+        metrics.gauge_fn("updates_queue_keys", lambda: len(self._queues))
+        metrics.gauge_fn("updates_queue_max_depth", lambda: max((q[1] for q in self._queues.values()), default=0))
+
+    async def __call__(
+            self,
+            handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+            event: TelegramObject,
+            data: Dict[str, Any]
+    ) -> Any:
+        context = data.get(EVENT_CONTEXT_KEY)
+        key = (context.user_id or context.chat_id) if context else None
+        loop = asyncio.get_running_loop()
+        started = loop.time()
+
+        entry = None
+        if key is not None:
+            entry = self._queues.setdefault(key, [asyncio.Lock(), 0])
+            entry[1] += 1
+        acquired_key = acquired_slot = False
+        try:
+            self._waiting += 1
+            try:
+                # отмена по таймауту безопасна: Lock и Semaphore не считаются захваченными, если ожидание прервано
+                async with asyncio.timeout_at(started + self.max_wait):
+                    if entry is not None:
+                        await entry[0].acquire()
+                        acquired_key = True
+                    await self._slots.acquire()
+                    acquired_slot = True
+            except TimeoutError:
+                metrics.inc("updates_dropped_total")
+                logging.warning(f"Апдейт {getattr(event, 'update_id', None)} от {key} ждал дольше "
+                                f"{self.max_wait} с и не будет обработан.")
+                return None
+            finally:
+                self._waiting -= 1
+
+            metrics.observe("updates_queue_wait_seconds", loop.time() - started)
+            self._in_flight += 1
+            try:
+                return await handler(event, data)
+            finally:
+                self._in_flight -= 1
+        finally:
+            if acquired_slot:
+                self._slots.release()
+            if entry is not None:
+                if acquired_key:
+                    entry[0].release()
+                entry[1] -= 1
+                if entry[1] == 0:
+                    self._queues.pop(key, None)
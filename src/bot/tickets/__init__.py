@@ -1 +1,2 @@
 from .generator import generate_ticket_image, TICKET_TEMPLATE_PATH
+from .renderer import TicketRenderer, RenderQueueFull
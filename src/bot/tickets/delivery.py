@@ -0,0 +1,120 @@
+import asyncio
+import logging
+import os
+
+from aiogram import Bot, types
+from aiogram.exceptions import TelegramBadRequest, TelegramForbiddenError, TelegramRetryAfter
+
+from .renderer import TicketRenderer
+
+# сколько раз пробуем отправить билет или альбом, если telegram отвечает RetryAfter
+DELIVERY_RETRIES = int(os.getenv("TICKET_DELIVERY_RETRIES", 3))
+# telegram принимает в одном альбоме от 2 до 10 документов
+MEDIA_GROUP_MAX = 10
+
+
+def _ticket_file(token: str, data: bytes) -> types.BufferedInputFile:
+    return types.BufferedInputFile(data, filename=f"ticket_{token}.jpg")
+
+
+async def _with_retries(send, what: str):
+    """
+    Вызывает send() до DELIVERY_RETRIES раз, но повторяет только после RetryAfter:
+    это отказ telegram, и сообщение точно не ушло. Сетевые ошибки, таймауты и 5xx не повторяем —
+    запрос мог дойти, и повтор прислал бы пользователю те же билеты второй раз.
+    """
+    for attempt in range(1, DELIVERY_RETRIES + 1):
+        try:
+            return await send()
+        except TelegramRetryAfter as e:
+            if attempt == DELIVERY_RETRIES:
+                raise
+            logging.warning(f"Не удалось отправить {what} (попытка {attempt}): telegram просит подождать "
+                            f"{e.retry_after} с.")
+            await asyncio.sleep(e.retry_after)
+
+
+async def _send_one(bot: Bot, user_id: int, token: str, data: bytes, reply_markup) -> bool:
+    try:
+        await _with_retries(
+            lambda: bot.send_document(
+                chat_id=user_id,
+                document=_ticket_file(token, data),
+                disable_notification=True,
+                reply_markup=reply_markup,
+            ),
+            f"билет {token}",
+        )
+        return True
+    except Exception as e:
+        logging.error(f"Failed to send ticket {token}: {e}")
+        return False
+
+
+async def deliver_tickets(
+        bot: Bot,
+        user_id: int,
+        tokens: list[str],
+        renderer: TicketRenderer,
+        intro_text: str | None = None,
+        reply_markup=None,
+) -> list[str]:
+    """
+    Рендерит все билеты параллельно и отправляет их альбомами документов (по 2–10 штук).
+    Пока билеты рендерятся, пользователю уходит intro_text.
+    Если telegram отказал в альбоме (bad request, forbidden, исчерпаны RetryAfter), он точно не доставлен,
+    и каждый его билет досылается по одному. Если же ответа нет (таймаут, сетевая ошибка, 5xx), альбом мог дойти:
+    его билеты не досылаются, а возвращаются как недоставленные — лучше сообщение с токеном, чем дубли билетов.
+    У альбомов не бывает клавиатуры, поэтому reply_markup вешается на одиночный билет,
+    а при нескольких билетах — на intro_text.
+    Возвращает список токенов, которые доставить не удалось.
+    """
+    # рендер всех билетов стартует сразу, отправка ждет только свою пачку
+    renders = {token: asyncio.create_task(renderer.render(token)) for token in tokens}
+    failed: list[str] = []
+
+    try:
+        if intro_text:
+            await bot.send_message(
+                chat_id=user_id,
+                text=intro_text,
+                reply_markup=reply_markup if len(tokens) > 1 else None,
+            )
+
+        for i in range(0, len(tokens), MEDIA_GROUP_MAX):
+            chunk = tokens[i:i + MEDIA_GROUP_MAX]
+            results = await asyncio.gather(*(renders[t] for t in chunk), return_exceptions=True)
+
+            rendered: dict[str, bytes] = {}
+            for token, result in zip(chunk, results):
+                if isinstance(result, BaseException):
+                    logging.error(f"Failed to render ticket {token}: {result}")
+                    failed.append(token)
+                else:
+                    rendered[token] = result
+
+            if len(rendered) > 1:
+                media = [types.InputMediaDocument(media=_ticket_file(t, d)) for t, d in rendered.items()]
+                try:
+                    await _with_retries(
+                        lambda: bot.send_media_group(chat_id=user_id, media=media, disable_notification=True),
+                        f"альбом из {len(media)} билетов",
+                    )
+                    continue
+                except (TelegramBadRequest, TelegramForbiddenError, TelegramRetryAfter) as e:
+                    logging.warning(f"Альбом билетов для {user_id} не отправлен, досылаем по одному: {e}")
+                except Exception as e:
+                    logging.error(f"Неизвестно, дошел ли альбом билетов до {user_id}, повторно не шлем: {e}")
+                    failed.extend(rendered)
+                    continue
+
+            for token, data in rendered.items():
+                markup = reply_markup if len(tokens) == 1 else None
+                if not await _send_one(bot, user_id, token, data, markup):
+                    failed.append(token)
+    finally:
+        # если отправка упала на полпути, недорендеренные билеты больше никому не нужны
+        for task in renders.values():
+            task.cancel()
+
+    return failed
@@ -1,4 +1,5 @@
 import os
+from io import BytesIO
 from pathlib import Path
 from PIL import Image
 import qrcode
@@ -10,30 +11,73 @@ TICKET_TEMPLATE_PATH = Path("/app/src/bot/tickets/ticket_template.png")
 TICKETS_DIR = Path("/app/src/bot/tickets/tickets")
 TICKET_BOT_USERNAME = 'be_lekker_bot'
 
-async def generate_ticket_image(
+# декодированный шаблон живет в памяти процесса: path -> (mtime, RGBA-картинка)
+_template_cache: dict[Path, tuple[float, Image.Image]] = {}
+
+
+def _load_template(template_path: Path) -> Image.Image:
+    """Возвращает декодированный шаблон; перечитывает файл только если сменился mtime."""
+    try:
+        mtime = template_path.stat().st_mtime
+    except FileNotFoundError:
+        logging.error(f"Template file does not exist: {template_path}")
+        raise FileNotFoundError(f"Template file does not exist: {template_path}")
+
+    cached = _template_cache.get(template_path)
+    if cached and cached[0] == mtime:
+        return cached[1]
+
+    with Image.open(template_path) as img:
+        template = img.convert("RGBA")
+    _template_cache[template_path] = (mtime, template)
+    logging.info(f"Template loaded: {template_path}")
+    return template
+
+
+def render_ticket(
         token: str,
         bot_username: str,
         template_path: Path,
         qr_size: tuple[int, int],
         qr_position: tuple[int, int],
-        output_dir: Path
-) -> str:
-    logging.info(f"Template path: {template_path}")
-    logging.info(f"Output dir: {output_dir}")
-    if not template_path.exists():
-        logging.error(f"Template file does not exist: {template_path}")
-        raise FileNotFoundError(f"Template file does not exist: {template_path}")
-    os.makedirs(output_dir, exist_ok=True)
+        debug_dir: Path | None = None
+) -> bytes:
+    """
+    Синхронно рисует билет: QR-код поверх шаблона, возвращает JPEG в байтах.
+    Чистая CPU-работа — вызывать только из пула процессов или потока, не из event loop.
+    Если передан debug_dir, копия билета дополнительно сохраняется на диск.
+    """
     qr_data = f"https://t.me/{bot_username}?start={token}"
     qr = qrcode.QRCode(version=1, box_size=10, border=4)
     qr.add_data(qr_data)
     qr.make(fit=True)
     qr_img = qr.make_image(fill_color=(70, 70, 70), back_color="transparent")
     qr_img = qr_img.resize(qr_size, Image.Resampling.LANCZOS)
-    ticket_img = Image.open(template_path).convert("RGBA")
+    ticket_img = _load_template(template_path).copy()
     ticket_img.paste(qr_img, qr_position, qr_img)
     ticket_img = ticket_img.convert("RGB")
-    ticket_path = output_dir / f"ticket_{token}.jpg"
-    ticket_img.save(ticket_path)
-    logging.info(f"Ticket saved at: {ticket_path}")
-    return str(ticket_path)
\ No newline at end of file
+
+    buf = BytesIO()
+    ticket_img.save(buf, format="JPEG")
+    data = buf.getvalue()
+
+    if debug_dir:
+        os.makedirs(debug_dir, exist_ok=True)
+        ticket_path = debug_dir / f"ticket_{token}.jpg"
+        ticket_path.write_bytes(data)
+        logging.info(f"Ticket saved at: {ticket_path}")
+    return data
+
+
+async def generate_ticket_image(
+        token: str,
+        bot_username: str,
+        template_path: Path,
+        qr_size: tuple[int, int],
+        qr_position: tuple[int, int],
+        output_dir: Path
+) -> str:
+    # совместимость со старым вызовом: рендерит в поток и сохраняет файл в output_dir.
+    # в боте используется TicketRenderer (пул процессов, байты в памяти), см. renderer.py
+    await asyncio.to_thread(render_ticket, token, bot_username, template_path, qr_size, qr_position, output_dir)
+    return str(output_dir / f"ticket_{token}.jpg")
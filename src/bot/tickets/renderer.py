@@ -0,0 +1,105 @@
+import asyncio
+import logging
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+from .generator import render_ticket, TICKET_TEMPLATE_PATH, TICKETS_DIR, TICKET_BOT_USERNAME
+
+# настройки пула рендера (можно переопределить в .env)
+RENDER_WORKERS = int(os.getenv("TICKET_RENDER_WORKERS", 2))
+RENDER_QUEUE_SIZE = int(os.getenv("TICKET_RENDER_QUEUE", 16))
+RENDER_QUEUE_TIMEOUT = float(os.getenv("TICKET_RENDER_QUEUE_TIMEOUT", 30))
+# отладка: дополнительно сохранять готовые билеты в TICKETS_DIR
+RENDER_DEBUG_SAVE = os.getenv("TICKET_DEBUG_SAVE", "0") == "1"
+
+# параметры раскладки билета на шаблоне
+QR_SIZE = (750, 750)
+QR_POSITION = (170, 610)
+
+
+class RenderQueueFull(RuntimeError):
+    """Очередь рендера переполнена и слот не освободился за отведенное время."""
+
+
+def _warm_up_worker():
+    # выполняется один раз при старте процесса: прогреваем импорты и кодировщики,
+    # чтобы первый настоящий билет не платил за них
+    import qrcode
+    from PIL import Image
+
+    qr = qrcode.QRCode(version=1, box_size=1, border=1)
+    qr.add_data("warmup")
+    qr.make(fit=True)
+    qr.make_image().resize((8, 8), Image.Resampling.LANCZOS)
+
+
+def _ping() -> int:
+    return os.getpid()
+
+
+class TicketRenderer:
+    """
+    Рендер билетов в пуле процессов, чтобы QR, ресайз и JPEG не блокировали event loop.
+    Очередь ограничена: workers задач в работе + queue_size ожидающих. Если мест нет,
+    render() ждет не дольше queue_timeout и бросает RenderQueueFull (back-pressure).
+    """
+
+    def __init__(
+            self,
+            workers: int = RENDER_WORKERS,
+            queue_size: int = RENDER_QUEUE_SIZE,
+            queue_timeout: float = RENDER_QUEUE_TIMEOUT,
+            template_path: Path = TICKET_TEMPLATE_PATH,
+            debug_dir: Path | None = TICKETS_DIR if RENDER_DEBUG_SAVE else None,
+            bot_username: str = TICKET_BOT_USERNAME,
+    ):
+        self.workers = max(1, workers)
+        self.queue_timeout = queue_timeout
+        self.template_path = template_path
+        self.debug_dir = debug_dir
+        self.bot_username = bot_username
+        self._slots = asyncio.Semaphore(self.workers + max(0, queue_size))
+        self._executor: ProcessPoolExecutor | None = None
+
+    async def start(self):
+        """Поднимает пул и прогревает все воркеры заранее, а не на первом билете."""
+        if self._executor:
+            return
+        self._executor = ProcessPoolExecutor(
+            max_workers=self.workers,
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=_warm_up_worker,
+        )
+        loop = asyncio.get_running_loop()
+        pids = await asyncio.gather(*(loop.run_in_executor(self._executor, _ping) for _ in range(self.workers)))
+        logging.info(f"Пул рендера билетов запущен: {len(set(pids))} процессов.")
+
+    async def close(self):
+        if self._executor:
+            executor, self._executor = self._executor, None
+            await asyncio.to_thread(executor.shutdown, wait=True, cancel_futures=True)
+
+    async def render(self, token: str) -> bytes:
+        """Рендерит билет в отдельном процессе и возвращает JPEG в байтах."""
+        if not self._executor:
+            await self.start()
+        try:
+            await asyncio.wait_for(self._slots.acquire(), timeout=self.queue_timeout)
+        except asyncio.TimeoutError:
+            raise RenderQueueFull(f"Очередь рендера билетов переполнена, билет {token} не поставлен в очередь.")
+        try:
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(
+                self._executor,
+                render_ticket,
+                token,
+                self.bot_username,
+                self.template_path,
+                QR_SIZE,
+                QR_POSITION,
+                self.debug_dir,
+            )
+        finally:
+            self._slots.release()
@@ -0,0 +1,101 @@
+import asyncio
+import logging
+import os
+import time
+from typing import Any, Awaitable, Callable, Hashable
+
+from bot.utils.metrics import metrics
+
+# сборка альбомов со скринами оплаты (можно переопределить в .env)
+ALBUM_DEBOUNCE = float(os.getenv("ALBUM_DEBOUNCE", 1.2))  # сколько ждем следующее фото альбома
+ALBUM_TTL = float(os.getenv("ALBUM_TTL", 30))  # дольше этого альбом не копим, даже если фото еще идут
+ALBUM_MAX_IN_FLIGHT = int(os.getenv("ALBUM_MAX_IN_FLIGHT", 500))
+ALBUM_MAX_PHOTOS = 10  # больше telegram в один альбом не кладет
+
+OnComplete = Callable[[list], Awaitable[Any]]
+
+
+class _Album:
+    __slots__ = ("items", "on_complete", "created_at", "timer")
+
+    def __init__(self, on_complete: OnComplete):
+        self.items: list = []
+        self.on_complete = on_complete
+        self.created_at = time.monotonic()
+        self.timer: asyncio.TimerHandle | None = None
+
+
+class AlbumAggregator:
+    """
+    Собирает фото одного альбома (media_group_id приходит отдельными апдейтами) и отдает их
+    одним вызовом on_complete, когда debounce секунд не было новых фото.
+    on_complete берется из первого фото альбома и вызывается ровно один раз — в нем и создается транзакция.
+    Ограничения: не больше max_in_flight альбомов одновременно и max_photos фото в альбоме;
+    альбом старше ttl отдается сразу, не дожидаясь тишины.
+    В буфере лежат только то, что передали в add (file_id и т.п.), а не Message или данные апдейта.
+    """
+
+    def __init__(self, debounce: float = ALBUM_DEBOUNCE, ttl: float = ALBUM_TTL,
+                 max_in_flight: int = ALBUM_MAX_IN_FLIGHT, max_photos: int = ALBUM_MAX_PHOTOS):
+        self.debounce = debounce
+        self.ttl = ttl
+        self.max_in_flight = max_in_flight
+        self.max_photos = max_photos
+        self._albums: dict[Hashable, _Album] = {}
+        self._tasks: set[asyncio.Task] = set()
+
+        metrics.describe("album_buffers_albums", "Альбомы со скринами оплаты, которые еще собираются")
+        metrics.describe("album_buffers_photos", "Фото в собираемых альбомах")
+        metrics.describe("album_rejected_total", "Фото, не принятые из-за лимитов сборки альбомов")
+        metrics.gauge_fn("album_buffers_albums", lambda: len(self._albums))
+        metrics.gauge_fn("album_buffers_photos", lambda: sum(len(a.items) for a in self._albums.values()))
+
+    def __len__(self) -> int:
+        return len(self._albums)
+
+    def add(self, key: Hashable, item, on_complete: OnComplete) -> bool:
+        """
+        Добавляет фото в альбом key. Возвращает False, если фото не принято из-за лимитов
+        (слишком много альбомов сразу или фото в альбоме).
+        """
+        album = self._albums.get(key)
+        if album is None:
+            if len(self._albums) >= self.max_in_flight:
+                metrics.inc("album_rejected_total", reason="albums")
+                return False
+            album = self._albums[key] = _Album(on_complete)
+        if len(album.items) >= self.max_photos:
+            metrics.inc("album_rejected_total", reason="photos")
+            return False
+        album.items.append(item)
+
+        if album.timer:
+            album.timer.cancel()
+        if time.monotonic() - album.created_at >= self.ttl:
+            self._complete(key)
+        else:
+            album.timer = asyncio.get_running_loop().call_later(self.debounce, self._complete, key)
+        return True
+
+    def _complete(self, key: Hashable):
+        album = self._albums.pop(key, None)
+        if album is None:
+            return
+        if album.timer:
+            album.timer.cancel()
+        task = asyncio.create_task(self._run(key, album))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _run(self, key: Hashable, album: _Album):
+        try:
+            await album.on_complete(album.items)
+        except Exception:
+            logging.exception(f"Ошибка при обработке альбома {key}")
+
+    async def close(self):
+        """Отдает недособранные альбомы и дожидается их обработки."""
+        for key in list(self._albums):
+            self._complete(key)
+        if self._tasks:
+            await asyncio.gather(*self._tasks, return_exceptions=True)
@@ -0,0 +1,155 @@
+import asyncio
+import csv
+import json
+import logging
+import os
+import time
+from datetime import date, datetime
+
+# журнал платежных скринов (можно переопределить в .env)
+AUDIT_LOG_DIR = os.getenv("AUDIT_LOG_DIR", "cache")
+AUDIT_LOG_MAX_BYTES = int(os.getenv("AUDIT_LOG_MAX_BYTES", 10 * 1024 * 1024))
+AUDIT_LOG_FSYNC_INTERVAL = float(os.getenv("AUDIT_LOG_FSYNC_INTERVAL", 5))
+AUDIT_LOG_QUEUE_SIZE = 10000
+AUDIT_LOG_BATCH = 200
+
+CSV_FIELDS = ["user_id", "username", "qty", "timestamp", "file"]
+
+
+class AuditLogWriter:
+    """
+    Фоновая запись журнала оплат в payments_log.jsonl и payments_log.csv.
+    Обработчик только кладет запись в очередь (write), а задача сама пишет пачками в отдельном потоке,
+    делает fsync не чаще fsync_interval и ротирует оба файла вместе — при смене даты или
+    когда jsonl дорос до max_bytes. Старые файлы переименовываются в payments_log_<дата_время>.*,
+    новый csv всегда начинается с заголовка.
+    """
+
+    def __init__(self, directory: str = AUDIT_LOG_DIR, base_name: str = "payments_log",
+                 max_bytes: int = AUDIT_LOG_MAX_BYTES, fsync_interval: float = AUDIT_LOG_FSYNC_INTERVAL):
+        self.directory = directory
+        self.base_name = base_name
+        self.max_bytes = max_bytes
+        self.fsync_interval = fsync_interval
+        self._queue: asyncio.Queue[dict | None] = asyncio.Queue(maxsize=AUDIT_LOG_QUEUE_SIZE)
+        self._task: asyncio.Task | None = None
+        self._jsonl = None
+        self._csv = None
+        self._csv_writer = None
+        self._opened_date: date | None = None
+        self._last_fsync = 0.0
+        self._dirty = False
+
+    def write(self, record: dict):
+        """Ставит запись в очередь. Не ждет диск."""
+        try:
+            self._queue.put_nowait(record)
+        except asyncio.QueueFull:
+            logging.error(f"Очередь журнала оплат переполнена, запись потеряна: {record}")
+
+    def start(self):
+        if not self._task:
+            self._task = asyncio.create_task(self._run())
+
+    async def close(self):
+        """Дописывает очередь, делает fsync и закрывает файлы."""
+        if self._task:
+            # задачу не отменяем: поток с _write_batch от отмены не остановится и писал бы в файлы
+            # одновременно с закрытием. None встает в очередь за всеми записями — задача допишет их и выйдет сама
+            await self._queue.put(None)
+            await self._task
+            self._task = None
+            return
+        batch = []
+        while not self._queue.empty():
+            batch.append(self._queue.get_nowait())
+        await asyncio.to_thread(self._write_batch, batch, True)
+        await asyncio.to_thread(self._close_files)
+
+    async def _run(self):
+        while True:
+            try:
+                record = await asyncio.wait_for(self._queue.get(), timeout=self.fsync_interval)
+            except asyncio.TimeoutError:
+                # новых записей нет, но несинхронизированный хвост все равно сбрасываем
+                await self._write([], False)
+                continue
+            stopping = record is None
+            batch = [] if stopping else [record]
+            while not stopping and len(batch) < AUDIT_LOG_BATCH and not self._queue.empty():
+                record = self._queue.get_nowait()
+                if record is None:
+                    stopping = True
+                else:
+                    batch.append(record)
+            await self._write(batch, stopping)
+            if stopping:
+                try:
+                    await asyncio.to_thread(self._close_files)
+                except Exception:
+                    logging.exception("Ошибка при закрытии журнала оплат")
+                return
+
+    async def _write(self, batch: list[dict], force_fsync: bool):
+        try:
+            await asyncio.to_thread(self._write_batch, batch, force_fsync)
+        except Exception:
+            logging.exception(f"Ошибка при записи журнала оплат, потеряно записей: {len(batch)}")
+
+    # --- блокирующая часть, выполняется в потоке ---
+
+    def _path(self, ext: str) -> str:
+        return os.path.join(self.directory, f"{self.base_name}.{ext}")
+
+    def _open_files(self):
+        os.makedirs(self.directory, exist_ok=True)
+        jsonl_path = self._path("jsonl")
+        self._opened_date = datetime.fromtimestamp(os.path.getmtime(jsonl_path)).date() \
+            if os.path.exists(jsonl_path) else date.today()
+        self._jsonl = open(jsonl_path, "a", encoding="utf-8")
+        self._csv = open(self._path("csv"), "a", newline="", encoding="utf-8")
+        self._csv_writer = csv.DictWriter(self._csv, fieldnames=CSV_FIELDS, extrasaction="ignore")
+        # заголовок пишем в любой пустой csv — и в самый первый, и после ротации
+        if self._csv.tell() == 0:
+            self._csv_writer.writeheader()
+
+    def _close_files(self):
+        if self._jsonl:
+            self._fsync()
+            self._jsonl.close()
+            self._csv.close()
+            self._jsonl = self._csv = self._csv_writer = None
+
+    def _rotate_if_needed(self):
+        if self._opened_date == date.today() and self._jsonl.tell() < self.max_bytes:
+            return
+        self._close_files()
+        suffix = datetime.now().strftime("%Y%m%d_%H%M%S")
+        n = 1
+        while os.path.exists(os.path.join(self.directory, f"{self.base_name}_{suffix}.jsonl")):
+            n += 1
+            suffix = f"{datetime.now().strftime('%Y%m%d_%H%M%S')}_{n}"
+        for ext in ("jsonl", "csv"):
+            if os.path.exists(self._path(ext)):
+                os.replace(self._path(ext), os.path.join(self.directory, f"{self.base_name}_{suffix}.{ext}"))
+        self._open_files()
+
+    def _fsync(self):
+        for f in (self._jsonl, self._csv):
+            f.flush()
+            os.fsync(f.fileno())
+        self._last_fsync = time.monotonic()
+        self._dirty = False
+
+    def _write_batch(self, batch: list[dict], force_fsync: bool):
+        if not batch and self._jsonl is None:
+            return
+        if self._jsonl is None:
+            self._open_files()
+        if batch:
+            self._rotate_if_needed()
+            self._jsonl.write("".join(json.dumps(r, ensure_ascii=False) + "\n" for r in batch))
+            self._csv_writer.writerows(batch)
+            self._dirty = True
+        if self._dirty and (force_fsync or time.monotonic() - self._last_fsync >= self.fsync_interval):
+            self._fsync()
@@ -0,0 +1,252 @@
+import asyncio
+import logging
+import os
+import secrets
+import socket
+import time
+
+from aiogram import Bot, types
+from aiogram.exceptions import TelegramBadRequest, TelegramForbiddenError, TelegramRetryAfter
+
+from bot.utils.messages import get_messages
+
+# лимиты рассылки (можно переопределить в .env); telegram пускает около 30 сообщений в секунду на бота
+BROADCAST_RATE = float(os.getenv("BROADCAST_RATE", 25))
+BROADCAST_BURST = int(os.getenv("BROADCAST_BURST", 5))
+BROADCAST_WORKERS = int(os.getenv("BROADCAST_WORKERS", 8))
+# как часто обновляем сообщение с прогрессом у админа (в один чат telegram пускает ~1 сообщение в секунду)
+BROADCAST_PROGRESS_INTERVAL = float(os.getenv("BROADCAST_PROGRESS_INTERVAL", 3))
+# сколько результатов копим перед записью в БД
+BROADCAST_FLUSH_ROWS = 50
+# аренда рассылки экземпляром бота: продлевается, пока он шлет; истекла — рассылку забирает другой экземпляр
+BROADCAST_LEASE_SECONDS = float(os.getenv("BROADCAST_LEASE_SECONDS", 60))
+
+
+class TokenBucket:
+    """
+    Ведро токенов: в среднем rate отправок в секунду, всплеск не больше burst.
+    pause() останавливает всех на указанное время — так обрабатывается RetryAfter,
+    потому что flood-limit telegram действует на весь бот, а не на один чат.
+    """
+
+    def __init__(self, rate: float, burst: int = 1):
+        self.rate = rate
+        self.burst = max(1, burst)
+        self._tokens = float(self.burst)
+        self._updated = time.monotonic()
+        self._paused_until = 0.0
+        self._lock = asyncio.Lock()
+
+    def pause(self, seconds: float):
+        self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+        self._tokens = 0.0
+
+    async def acquire(self):
+        # под блокировкой, чтобы ожидающие получали токены по очереди
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                if now < self._paused_until:
+                    await asyncio.sleep(self._paused_until - now)
+                    continue
+                self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                await asyncio.sleep((1 - self._tokens) / self.rate)
+
+
+class BroadcastEngine:
+    """
+    Рассылки с ограничением скорости и сохранением прогресса.
+    Получатели и их статусы лежат в broadcast_recipients, поэтому перезапущенный бот
+    продолжает рассылку с неотправленных (resume), а не шлет всем заново.
+    Сообщение уходит каждому получателю один раз, так что отдельный лимит на чат
+    нужен только для сообщения с прогрессом — его обновляем не чаще BROADCAST_PROGRESS_INTERVAL.
+    Заблокировавшие бота помечаются в users.blocked_at и в следующие рассылки не попадают.
+    При нескольких экземплярах бота рассылку шлет только тот, кто ее арендовал (broadcasts.owner):
+    аренда продлевается во время отправки, а брошенные рассылки (экземпляр упал) забираются
+    не раньше, чем истечет lease_seconds.
+    """
+
+    def __init__(self, bot: Bot, db, rate: float = BROADCAST_RATE, burst: int = BROADCAST_BURST,
+                 workers: int = BROADCAST_WORKERS, lease_seconds: float = BROADCAST_LEASE_SECONDS):
+        self.bot = bot
+        self.db = db
+        self.workers = workers
+        self.lease_seconds = lease_seconds
+        self.bucket = TokenBucket(rate, burst)
+        # уникален для процесса: в контейнерах pid и hostname после перезапуска могут совпасть
+        self.owner = f"{socket.gethostname()}:{os.getpid()}:{secrets.token_hex(4)}"
+        self._tasks: dict[int, asyncio.Task] = {}
+        self._claimer: asyncio.Task | None = None
+
+    async def start(self, kind: str, text: str, recipient_ids: list[int], admin_chat_id: int,
+                    progress_message_id: int | None = None,
+                    reply_markup: types.InlineKeyboardMarkup | None = None) -> tuple[int, int]:
+        """Сохраняет рассылку в БД и запускает ее в фоне. Возвращает (id рассылки, количество получателей)."""
+        broadcast_id, total = await self.db.create_broadcast(
+            kind=kind,
+            text=text,
+            reply_markup=reply_markup.model_dump_json(exclude_none=True) if reply_markup else None,
+            admin_chat_id=admin_chat_id,
+            progress_message_id=progress_message_id,
+            recipient_ids=recipient_ids,
+            owner=self.owner,
+            lease_seconds=self.lease_seconds,
+        )
+        self._spawn(broadcast_id, text, reply_markup, admin_chat_id, progress_message_id)
+        return broadcast_id, total
+
+    async def resume(self):
+        """
+        Забирает рассылки, которые не завершились до остановки бота или брошены другим экземпляром,
+        и дальше проверяет такие раз в половину аренды.
+        """
+        await self._claim()
+        if not self._claimer:
+            self._claimer = asyncio.create_task(self._claim_loop())
+
+    async def close(self):
+        """Останавливает рассылки; уже полученные результаты записываются в БД, аренда снимается."""
+        if self._claimer:
+            self._claimer.cancel()
+            await asyncio.gather(self._claimer, return_exceptions=True)
+            self._claimer = None
+        tasks = list(self._tasks.values())
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        if tasks:
+            try:
+                await self.db.release_broadcasts(self.owner)
+            except Exception:
+                logging.exception("Не удалось снять аренду рассылок, другие экземпляры заберут их по истечении.")
+
+    async def _claim(self):
+        for row in await self.db.claim_broadcasts(self.owner, self.lease_seconds):
+            markup = types.InlineKeyboardMarkup.model_validate_json(row['reply_markup']) \
+                if row['reply_markup'] else None
+            logging.info(f"Продолжаю рассылку #{row['id']}.")
+            self._spawn(row['id'], row['text'], markup, row['admin_chat_id'], row['progress_message_id'])
+
+    async def _claim_loop(self):
+        while True:
+            await asyncio.sleep(self.lease_seconds / 2)
+            try:
+                await self._claim()
+            except Exception:
+                logging.exception("Не удалось проверить брошенные рассылки.")
+
+    def _spawn(self, broadcast_id: int, text: str, markup, admin_chat_id: int, progress_message_id: int | None):
+        if broadcast_id in self._tasks:
+            return
+        task = asyncio.create_task(self._run(broadcast_id, text, markup, admin_chat_id, progress_message_id))
+        self._tasks[broadcast_id] = task
+        task.add_done_callback(lambda _: self._tasks.pop(broadcast_id, None))
+
+    async def _send(self, user_id: int, text: str, markup) -> str:
+        while True:
+            await self.bucket.acquire()
+            try:
+                await self.bot.send_message(chat_id=user_id, text=text, reply_markup=markup)
+                return 'sent'
+            except TelegramRetryAfter as e:
+                logging.warning(f"Рассылка: telegram просит подождать {e.retry_after} с.")
+                self.bucket.pause(e.retry_after)
+            except TelegramForbiddenError:
+                return 'blocked'
+            except Exception as e:
+                logging.warning(f"Не удалось отправить сообщение рассылки пользователю {user_id}. Ошибка: {e}")
+                return 'failed'
+
+    async def _update_progress(self, broadcast_id: int, admin_chat_id: int, progress_message_id: int | None):
+        """Обновляет сообщение с прогрессом. Это косметика, поэтому ошибки только логируются."""
+        if not progress_message_id:
+            return
+        try:
+            counts = await self.db.get_broadcast_counts(broadcast_id)
+            total = sum(counts.values())
+            await self.bot.edit_message_text(
+                chat_id=admin_chat_id,
+                message_id=progress_message_id,
+                text=get_messages()["broadcast_progress"].format(
+                    broadcast_id=broadcast_id, done=total - counts['pending'], total=total, **counts),
+            )
+        except TelegramBadRequest:
+            pass  # текст не изменился или сообщение удалили — не страшно
+        except Exception:
+            logging.exception(f"Не удалось обновить прогресс рассылки #{broadcast_id}.")
+
+    async def _run(self, broadcast_id: int, text: str, markup, admin_chat_id: int, progress_message_id: int | None):
+        queue: asyncio.Queue[int] = asyncio.Queue()
+        for user_id in await self.db.get_pending_broadcast_recipients(broadcast_id):
+            queue.put_nowait(user_id)
+        results: list[tuple[int, str]] = []
+
+        async def flush():
+            batch = results[:]
+            results.clear()
+            try:
+                # shield: даже если задачу отменят посреди записи, пачка все равно дойдет до БД
+                await asyncio.shield(self.db.save_broadcast_results(broadcast_id, batch))
+            except Exception:
+                # не записанные получатели останутся pending и после перезапуска получат сообщение повторно
+                logging.exception(f"Не удалось сохранить прогресс рассылки #{broadcast_id}.")
+
+        async def worker():
+            while not queue.empty():
+                user_id = queue.get_nowait()
+                results.append((user_id, await self._send(user_id, text, markup)))
+                if len(results) >= BROADCAST_FLUSH_ROWS:
+                    await flush()
+
+        workers = asyncio.gather(*(worker() for _ in range(self.workers)))
+        lease_lost = False
+
+        async def report():
+            while True:
+                await asyncio.sleep(BROADCAST_PROGRESS_INTERVAL)
+                await flush()
+                await self._update_progress(broadcast_id, admin_chat_id, progress_message_id)
+
+        async def keep_lease():
+            # отдельно от прогресса: ошибка в косметике не должна остановить продление аренды
+            nonlocal lease_lost
+            while True:
+                await asyncio.sleep(self.lease_seconds / 3)
+                try:
+                    if not await self.db.renew_broadcast_lease(broadcast_id, self.owner, self.lease_seconds):
+                        # аренда истекла и рассылку забрал другой экземпляр — дальше шлет он
+                        lease_lost = True
+                        workers.cancel()
+                        return
+                except Exception:
+                    logging.exception(f"Не удалось продлить аренду рассылки #{broadcast_id}.")
+
+        helpers = [asyncio.create_task(report()), asyncio.create_task(keep_lease())]
+        try:
+            await workers
+        except asyncio.CancelledError:
+            if not lease_lost:
+                raise
+        finally:
+            for task in helpers:
+                task.cancel()
+            await flush()
+        if lease_lost:
+            logging.warning(f"Рассылку #{broadcast_id} забрал другой экземпляр бота, останавливаюсь.")
+            return
+
+        await self.db.finish_broadcast(broadcast_id)
+        await self._update_progress(broadcast_id, admin_chat_id, progress_message_id)
+        counts = await self.db.get_broadcast_counts(broadcast_id)
+        await self.bot.send_message(
+            chat_id=admin_chat_id,
+            text=get_messages()["broadcast_finished"].format(
+                success_count=counts['sent'],
+                fail_count=counts['failed'],
+                blocked_count=counts['blocked'],
+            ),
+        )
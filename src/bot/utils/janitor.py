@@ -0,0 +1,200 @@
+import asyncio
+import logging
+import os
+import re
+import time
+from datetime import datetime
+
+from PIL import Image
+
+from bot.tickets.generator import TICKETS_DIR
+from bot.utils.audit_log import AUDIT_LOG_DIR
+from bot.utils.metrics import metrics
+from bot.utils.proof_archive import PROOF_DIR
+from database.config import CACHE_DIR
+
+# бюджет кэша на диске (можно переопределить в .env)
+CACHE_MAX_MB = int(os.getenv("CACHE_MAX_MB", 2048))
+CACHE_MAX_AGE_DAYS = float(os.getenv("CACHE_MAX_AGE_DAYS", 30))
+CACHE_JANITOR_INTERVAL = float(os.getenv("CACHE_JANITOR_INTERVAL", 600))
+# до какого размера (по длинной стороне) пережимаются скрины обработанных транзакций
+PROOF_THUMB_SIZE = int(os.getenv("PROOF_THUMB_SIZE", 1024))
+PROOF_THUMB_QUALITY = 70
+# файлы, которые трогали недавно, не удаляем и не пережимаем: их могут как раз писать
+CACHE_GRACE_SECONDS = 3600
+
+CATEGORIES = ("proofs", "legacy_proofs", "logs", "tickets")
+# скрины до архива по хэшу: cache/pay_<user_id>_<ts>_<file_id>.jpg
+_LEGACY_PROOF_RE = re.compile(r"pay_(\d+)_\d+_.+\.jpg")
+_ROTATED_LOG_RE = re.compile(r"payments_log_.+\.(jsonl|csv)")
+
+
+def format_size(size: float) -> str:
+    for unit in ("Б", "КБ", "МБ"):
+        if size < 1024:
+            return f"{size:.0f} {unit}"
+        size /= 1024
+    return f"{size:.1f} ГБ"
+
+
+class CacheJanitor:
+    """
+    Фоновая уборка файлов бота: архив скринов (PROOF_DIR), старые скрины cache/pay_*.jpg,
+    ротированные журналы оплат payments_log_* и отладочные билеты TICKETS_DIR.
+    Раз в interval секунд:
+      - скрины обработанных транзакций пережимаются до PROOF_THUMB_SIZE (дата использования сохраняется);
+      - удаляется все, что не использовалось дольше max_age;
+      - если кэш все еще больше max_bytes, удаляются давно не использованные файлы (LRU), пока не влезет.
+    Скрины транзакций на проверке (on_check) не трогаются никогда: ни удаление, ни пережатие.
+    Текущие payments_log.* и скрины без записи в payment_proofs тоже не трогаются.
+    Занятое место по категориям — в usage, его показывает /stats_info.
+    """
+
+    def __init__(self, db, max_bytes: int = CACHE_MAX_MB * 1024 * 1024, max_age: float = CACHE_MAX_AGE_DAYS * 86400,
+                 interval: float = CACHE_JANITOR_INTERVAL, thumb_size: int = PROOF_THUMB_SIZE):
+        self.db = db
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self.interval = interval
+        self.thumb_size = thumb_size
+        self.usage: dict[str, list[int]] = {}  # категория -> [файлов, байт]
+        self.checked_at: datetime | None = None
+        self.removed_files = 0
+        self.removed_bytes = 0
+        self._task: asyncio.Task | None = None
+
+        metrics.describe("cache_disk_bytes", "Место на диске под файлы бота по категориям")
+        metrics.describe("cache_removed_total", "Файлы, удаленные уборщиком кэша")
+        metrics.describe("cache_thumbnailed_total", "Скрины оплаты, пережатые уборщиком кэша")
+
+    @property
+    def total_bytes(self) -> int:
+        return sum(size for _, size in self.usage.values())
+
+    def start(self):
+        if not self._task:
+            self._task = asyncio.create_task(self._run())
+
+    async def close(self):
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _run(self):
+        while True:
+            try:
+                await self.run_once()
+            except Exception:
+                logging.exception("Ошибка при уборке кэша")
+            await asyncio.sleep(self.interval)
+
+    async def run_once(self):
+        """Один проход уборки. Статусы транзакций берутся из БД, вся работа с диском — в потоке."""
+        proof_states = await self.db.get_proof_states()
+        pending_users = await self.db.get_users_with_pending_transactions()
+        removed, freed, thumbnailed = await asyncio.to_thread(self._sweep, proof_states, pending_users)
+        self.checked_at = datetime.now()
+        self.removed_files += removed
+        self.removed_bytes += freed
+        metrics.inc("cache_removed_total", removed)
+        metrics.inc("cache_thumbnailed_total", thumbnailed)
+        for category, (_, size) in self.usage.items():
+            metrics.set("cache_disk_bytes", size, category=category)
+        if removed or thumbnailed:
+            logging.info(f"Уборка кэша: удалено {removed} файлов ({format_size(freed)}), пережато {thumbnailed}, "
+                         f"занято {format_size(self.total_bytes)}.")
+
+    # --- блокирующая часть, выполняется в потоке ---
+
+    def _files(self):
+        """(категория, путь) всех файлов, за которыми следит уборщик."""
+        for root, _, names in os.walk(PROOF_DIR):
+            for name in names:
+                if name.endswith(".jpg"):
+                    yield "proofs", os.path.join(root, name)
+        for directory, category, pattern in ((CACHE_DIR, "legacy_proofs", _LEGACY_PROOF_RE),
+                                             (AUDIT_LOG_DIR, "logs", _ROTATED_LOG_RE)):
+            if os.path.isdir(directory):
+                for name in os.listdir(directory):
+                    if pattern.fullmatch(name):
+                        yield category, os.path.join(directory, name)
+        if TICKETS_DIR.is_dir():
+            for path in TICKETS_DIR.iterdir():
+                if path.is_file():
+                    yield "tickets", str(path)
+
+    def _evictable(self, category: str, path: str, proof_states: dict[str, bool], pending_users: set[int]) -> bool:
+        name = os.path.basename(path)
+        if category == "proofs":
+            # None — скрина еще (или уже) нет в payment_proofs, True — есть транзакция на проверке
+            return proof_states.get(name[:-len(".jpg")]) is False
+        if category == "legacy_proofs":
+            # старые скрины к транзакциям не привязаны — бережем все, пока у пользователя что-то на проверке
+            return int(_LEGACY_PROOF_RE.fullmatch(name).group(1)) not in pending_users
+        return True
+
+    def _thumbnail(self, path: str, stat: os.stat_result) -> int:
+        """Пережимает скрин, если он больше thumb_size. Возвращает новый размер файла."""
+        with Image.open(path) as image:
+            if max(image.size) <= self.thumb_size:
+                return stat.st_size
+            image = image.convert("RGB")
+        image.thumbnail((self.thumb_size, self.thumb_size), Image.Resampling.LANCZOS)
+        tmp_path = f"{path}.{os.getpid()}.thumb.tmp"
+        image.save(tmp_path, "JPEG", quality=PROOF_THUMB_QUALITY, optimize=True)
+        os.replace(tmp_path, path)
+        # пережатие — не использование: дата остается прежней, чтобы не сбить LRU
+        os.utime(path, (stat.st_atime, stat.st_mtime))
+        return os.path.getsize(path)
+
+    def _sweep(self, proof_states: dict[str, bool], pending_users: set[int]) -> tuple[int, int, int]:
+        now = time.time()
+        usage = {category: [0, 0] for category in CATEGORIES}
+        candidates = []  # (когда использовался, размер, путь, категория)
+        thumbnailed = 0
+        for category, path in self._files():
+            try:
+                stat = os.stat(path)
+                size = stat.st_size
+                # atime ненадежен (noatime, да и сам уборщик читает файлы), поэтому «использование» — это mtime:
+                # его обновляет архив скринов, когда тот же скрин приходит снова
+                last_used = stat.st_mtime
+                if now - last_used >= CACHE_GRACE_SECONDS and self._evictable(category, path, proof_states,
+                                                                              pending_users):
+                    if category == "proofs":
+                        new_size = self._thumbnail(path, stat)
+                        thumbnailed += new_size != size
+                        size = new_size
+                    candidates.append((last_used, size, path, category))
+            except FileNotFoundError:
+                continue
+            except Exception:
+                logging.exception(f"Уборка кэша: не удалось обработать {path}")
+                size = os.path.getsize(path) if os.path.exists(path) else 0
+            usage[category][0] += 1
+            usage[category][1] += size
+
+        total = sum(size for _, size in usage.values())
+        removed = freed = 0
+        candidates.sort()
+        for last_used, size, path, category in candidates:
+            if now - last_used < self.max_age and total <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            total -= size
+            usage[category][0] -= 1
+            usage[category][1] -= size
+            removed += 1
+            freed += size
+        if total > self.max_bytes:
+            logging.warning(f"Кэш больше бюджета ({format_size(total)}), но остальное удалять нельзя: "
+                            f"скрины транзакций на проверке или недавние файлы.")
+        self.usage = usage
+        return removed, freed, thumbnailed
@@ -0,0 +1,112 @@
+import bisect
+from typing import Callable
+
+# границы гистограмм по умолчанию, в секундах
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+
+def _labels_key(labels: dict) -> tuple:
+    return tuple(sorted(labels.items()))
+
+
+def _format_labels(key: tuple, extra: str = "") -> str:
+    parts = [f'{name}="{str(value)}"' for name, value in key]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+class _Histogram:
+    __slots__ = ("buckets", "counts", "sum", "count")
+
+    def __init__(self, buckets: tuple):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+class Metrics:
+    """
+    Минимальный реестр метрик в памяти процесса: счетчики, гейджи и гистограммы с метками.
+    render() отдает все в текстовом формате Prometheus. Все операции — обычные словари без блокировок,
+    так что метрики можно обновлять на каждом апдейте.
+    """
+
+    def __init__(self):
+        self._counters: dict[str, dict[tuple, float]] = {}
+        self._gauges: dict[str, dict[tuple, float]] = {}
+        self._gauge_fns: dict[str, Callable[[], float]] = {}
+        self._histograms: dict[str, dict[tuple, _Histogram]] = {}
+        self._help: dict[str, str] = {}
+
+    def describe(self, name: str, text: str):
+        self._help[name] = text
+
+    def inc(self, name: str, value: float = 1, **labels):
+        series = self._counters.setdefault(name, {})
+        key = _labels_key(labels)
+        series[key] = series.get(key, 0) + value
+
+    def set(self, name: str, value: float, **labels):
+        self._gauges.setdefault(name, {})[_labels_key(labels)] = value
+
+    def gauge_fn(self, name: str, fn: Callable[[], float]):
+        """Гейдж, который считается только в момент render()."""
+        self._gauge_fns[name] = fn
+
+    def observe(self, name: str, value: float, buckets: tuple = DEFAULT_BUCKETS, **labels):
+        series = self._histograms.setdefault(name, {})
+        key = _labels_key(labels)
+        histogram = series.get(key)
+        if histogram is None:
+            histogram = series[key] = _Histogram(buckets)
+        histogram.observe(value)
+
+    def get(self, name: str, **labels) -> float:
+        key = _labels_key(labels)
+        for store in (self._counters, self._gauges):
+            if name in store and key in store[name]:
+                return store[name][key]
+        if name in self._gauge_fns:
+            return self._gauge_fns[name]()
+        return 0
+
+    def _header(self, lines: list[str], name: str, kind: str):
+        if name in self._help:
+            lines.append(f"# HELP {name} {self._help[name]}")
+        lines.append(f"# TYPE {name} {kind}")
+
+    def render(self) -> str:
+        lines: list[str] = []
+        for name, series in sorted(self._counters.items()):
+            self._header(lines, name, "counter")
+            lines.extend(f"{name}{_format_labels(key)} {value}" for key, value in series.items())
+        for name, series in sorted(self._gauges.items()):
+            self._header(lines, name, "gauge")
+            lines.extend(f"{name}{_format_labels(key)} {value}" for key, value in series.items())
+        for name, fn in sorted(self._gauge_fns.items()):
+            self._header(lines, name, "gauge")
+            lines.append(f"{name} {fn()}")
+        for name, series in sorted(self._histograms.items()):
+            self._header(lines, name, "histogram")
+            for key, histogram in series.items():
+                cumulative = 0
+                for bound, count in zip(histogram.buckets, histogram.counts):
+                    cumulative += count
+                    le = f'le="{bound}"'
+                    lines.append(f"{name}_bucket{_format_labels(key, le)} {cumulative}")
+                le = 'le="+Inf"'
+                lines.append(f"{name}_bucket{_format_labels(key, le)} {histogram.count}")
+                lines.append(f"{name}_sum{_format_labels(key)} {histogram.sum}")
+                lines.append(f"{name}_count{_format_labels(key)} {histogram.count}")
+        return "\n".join(lines) + "\n"
+
+
+# общий реестр процесса
+metrics = Metrics()
@@ -0,0 +1,61 @@
+import csv
+import io
+from datetime import datetime, timezone
+
+from database.tokens import InvalidTicketToken, verify_ticket_token
+
+
+def _parse_time(value: str) -> datetime | None:
+    value = value.strip()
+    if not value:
+        return None
+    try:
+        return datetime.fromtimestamp(float(value), tz=timezone.utc)
+    except ValueError:
+        pass
+    try:
+        parsed = datetime.fromisoformat(value)
+    except ValueError:
+        return None
+    # время со сканера без зоны считаем локальным временем сервера
+    return parsed if parsed.tzinfo else parsed.astimezone()
+
+
+def _extract_token(cell: str) -> str:
+    cell = cell.strip()
+    # сканер мог сохранить всю ссылку из QR: https://t.me/<bot>?start=<token>
+    if "start=" in cell:
+        cell = cell.split("start=", 1)[1].split("&", 1)[0]
+    return cell
+
+
+def parse_offline_scans(text: str) -> tuple[dict[str, datetime | None], list[str]]:
+    """
+    Разбирает выгрузку офлайн-сканов: по строке на скан, токен (или ссылка из QR) и, через запятую,
+    точку с запятой или табуляцию, время скана (ISO или unix). Строка-заголовок пропускается.
+    Возвращает (токен -> самое раннее время скана, токены с неверной подписью или форматом).
+    Повторные сканы одного билета схлопываются.
+    """
+    try:
+        dialect = csv.Sniffer().sniff(text[:4096], delimiters=",;\t")
+    except csv.Error:
+        dialect = csv.excel
+    scans: dict[str, datetime | None] = {}
+    invalid: list[str] = []
+    for row in csv.reader(io.StringIO(text), dialect):
+        if not row or not row[0].strip():
+            continue
+        token = _extract_token(row[0])
+        if token.lower() == "token":
+            continue
+        try:
+            verify_ticket_token(token)
+        except InvalidTicketToken:
+            invalid.append(token)
+            continue
+        scanned_at = _parse_time(row[1]) if len(row) > 1 else None
+        if token not in scans:
+            scans[token] = scanned_at
+        elif scanned_at and (scans[token] is None or scanned_at < scans[token]):
+            scans[token] = scanned_at
+    return scans, invalid
@@ -0,0 +1,198 @@
+import asyncio
+import hashlib
+import logging
+import os
+import time
+
+from aiogram import Bot, types
+from aiogram.exceptions import TelegramBadRequest, TelegramRetryAfter
+
+from bot.utils.messages import get_messages
+from bot.utils.metrics import metrics
+from database.config import CACHE_DIR
+from database.proof_index import ProofHashIndex, dhash, to_bigint
+
+# архив скринов оплаты (можно переопределить в .env)
+PROOF_DIR = os.getenv("PROOF_DIR", os.path.join(CACHE_DIR, "proofs"))
+PROOF_DOWNLOAD_WORKERS = int(os.getenv("PROOF_DOWNLOAD_WORKERS", 4))
+PROOF_DOWNLOAD_RETRIES = int(os.getenv("PROOF_DOWNLOAD_RETRIES", 5))
+PROOF_QUEUE_SIZE = 10000
+# сколько при остановке бота ждем, пока докачается очередь
+PROOF_CLOSE_TIMEOUT = 10
+# сколько транзакций с отмеченными похожими скринами помним (решение модератора могло прийти на другой реплике)
+PROOF_SIMILAR_MAX = 10000
+
+
+class ProofArchiver:
+    """
+    Фоновое скачивание скринов оплаты в архив.
+    Обработчик только ставит file_id в очередь (submit) — модераторам скрин пересылается по file_id,
+    а скачивание идет в workers параллельных задачах с повторами при сетевых ошибках и RetryAfter.
+    Файлы лежат по sha256 содержимого: <directory>/ab/abcdef….jpg, поэтому один и тот же скрин,
+    присланный повторно, хранится один раз. Связь с транзакцией — в таблице payment_proofs.
+    Если передан hash_index, для каждого скрина считается перцептивный хэш, и при похожих скринах
+    других транзакций к сообщению модераторам дописывается «похоже на транзакцию #N».
+    """
+
+    def __init__(self, bot: Bot, db, directory: str = PROOF_DIR, workers: int = PROOF_DOWNLOAD_WORKERS,
+                 retries: int = PROOF_DOWNLOAD_RETRIES, hash_index: ProofHashIndex | None = None):
+        self.bot = bot
+        self.db = db
+        self.hash_index = hash_index
+        self.directory = directory
+        self.workers = max(1, workers)
+        self.retries = max(1, retries)
+        # (транзакция, file_id, сообщение модераторам)
+        self._queue: asyncio.Queue[tuple] = asyncio.Queue(maxsize=PROOF_QUEUE_SIZE)
+        self._tasks: list[asyncio.Task] = []
+        self._similar: dict[int, list[int]] = {}  # транзакция -> похожие, уже дописанные модераторам
+
+        metrics.describe("proof_archive_queue", "Скрины оплаты, ожидающие скачивания в архив")
+        metrics.describe("proof_archive_total", "Скрины оплаты, обработанные архивом, по результату")
+        metrics.describe("proof_download_seconds", "Время скачивания скрина оплаты из telegram")
+        metrics.describe("proof_similar_total", "Скрины оплаты, похожие на скрины других транзакций")
+        metrics.describe("proof_index_lookup_seconds", "Время поиска похожих скринов в индексе")
+        metrics.gauge_fn("proof_archive_queue", self._queue.qsize)
+
+    def submit(self, transaction_id: int, file_ids: list[str], moderation_message: types.Message | None = None):
+        """
+        Ставит скрины транзакции в очередь на скачивание. Не ждет ни сеть, ни диск.
+        moderation_message — сообщение с кнопками в группе модераторов, в нем отметятся похожие скрины.
+        """
+        for file_id in file_ids:
+            try:
+                self._queue.put_nowait((transaction_id, file_id, moderation_message))
+            except asyncio.QueueFull:
+                metrics.inc("proof_archive_total", result="dropped")
+                logging.error(f"Очередь архива скринов переполнена: транзакция {transaction_id}, {file_id}")
+
+    def forget(self, transaction_id: int):
+        """Модератор принял решение по транзакции — копить для нее похожие скрины больше не нужно."""
+        self._similar.pop(transaction_id, None)
+
+    def start(self):
+        if not self._tasks:
+            self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+
+    async def close(self):
+        """Дает докачать очередь (не дольше PROOF_CLOSE_TIMEOUT) и останавливает задачи."""
+        if self._tasks:
+            try:
+                await asyncio.wait_for(self._queue.join(), PROOF_CLOSE_TIMEOUT)
+            except asyncio.TimeoutError:
+                logging.warning(f"Архив скринов: не докачано {self._queue.qsize()} файлов.")
+            for task in self._tasks:
+                task.cancel()
+            await asyncio.gather(*self._tasks, return_exceptions=True)
+            self._tasks = []
+
+    async def _worker(self):
+        while True:
+            transaction_id, file_id, moderation_message = await self._queue.get()
+            try:
+                await self._archive(transaction_id, file_id, moderation_message)
+            except Exception:
+                metrics.inc("proof_archive_total", result="failed")
+                logging.exception(f"Не удалось сохранить скрин {file_id} транзакции {transaction_id}")
+            finally:
+                self._queue.task_done()
+
+    async def _archive(self, transaction_id: int, file_id: str, moderation_message: types.Message | None):
+        data = await self._download(file_id)
+        sha256, path, stored, phash = await asyncio.to_thread(self._store, data)
+        await self.db.add_payment_proof(transaction_id, file_id, sha256, path,
+                                        to_bigint(phash) if phash is not None else None)
+        metrics.inc("proof_archive_total", result="stored" if stored else "duplicate")
+
+        if phash is None or self.hash_index is None:
+            return
+        started = time.perf_counter()
+        similar = self.hash_index.find(phash, exclude_transaction=transaction_id)
+        metrics.observe("proof_index_lookup_seconds", time.perf_counter() - started)
+        self.hash_index.add(phash, transaction_id)
+        if similar:
+            metrics.inc("proof_similar_total")
+            await self._flag_similar(transaction_id, similar, moderation_message)
+
+    async def _flag_similar(self, transaction_id: int, similar: list[int], message: types.Message | None):
+        """Дописывает похожие транзакции в сообщение модераторам, пока транзакция не обработана."""
+        if message is None:
+            return
+        # для альбома похожими могут оказаться несколько фото — в сообщении копим все
+        known = self._similar.get(transaction_id)
+        if known is None:
+            if len(self._similar) >= PROOF_SIMILAR_MAX:
+                # самая старая по вставке — первая в словаре
+                self._similar.pop(next(iter(self._similar)))
+            known = self._similar[transaction_id] = []
+        known.extend(t for t in similar if t not in known)
+        flag = get_messages()["proof_similar"].format(", ".join(f"#{t}" for t in known))
+        try:
+            transaction = await self.db.get_transaction(transaction_id)
+            if not transaction or transaction['status'] != 'on_check':
+                # модератор уже нажал кнопку — его отметку не трогаем, пишем ответом
+                self._similar.pop(transaction_id, None)
+                await self.bot.send_message(chat_id=message.chat.id, text=flag,
+                                            reply_to_message_id=message.message_id)
+                return
+            text = f"{message.html_text}\n\n{flag}"
+            if message.photo:
+                await self.bot.edit_message_caption(chat_id=message.chat.id, message_id=message.message_id,
+                                                    caption=text, parse_mode="HTML",
+                                                    reply_markup=message.reply_markup)
+            else:
+                await self.bot.edit_message_text(chat_id=message.chat.id, message_id=message.message_id,
+                                                 text=text, parse_mode="HTML", reply_markup=message.reply_markup)
+        except Exception:
+            logging.exception(f"Не удалось отметить похожие скрины у транзакции {transaction_id}")
+
+    async def _download(self, file_id: str) -> bytes:
+        delay = 1.0
+        for attempt in range(1, self.retries + 1):
+            started = time.perf_counter()
+            try:
+                buffer = await self.bot.download(file_id)
+                metrics.observe("proof_download_seconds", time.perf_counter() - started)
+                return buffer.getvalue()
+            except TelegramRetryAfter as e:
+                if attempt == self.retries:
+                    raise
+                await asyncio.sleep(e.retry_after)
+            except TelegramBadRequest:
+                # файл не найден или слишком большой — повтор не поможет
+                raise
+            except Exception as e:
+                if attempt == self.retries:
+                    raise
+                logging.warning(f"Архив скринов: попытка {attempt} скачать {file_id} не удалась: {e}")
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, 30)
+
+    # --- блокирующая часть, выполняется в потоке ---
+
+    def _store(self, data: bytes) -> tuple[str, str, bool, int | None]:
+        """
+        Кладет файл по хэшу содержимого.
+        Возвращает (sha256, путь, был ли записан новый файл, перцептивный хэш или None).
+        """
+        sha256 = hashlib.sha256(data).hexdigest()
+        path = os.path.join(self.directory, sha256[:2], f"{sha256}.jpg")
+        phash = None
+        if self.hash_index is not None:
+            try:
+                phash = dhash(data)
+            except Exception:
+                logging.warning(f"Архив скринов: не удалось посчитать перцептивный хэш {sha256}")
+        try:
+            # повторный скрин: файл уже есть и снова «в деле» — уборщик кэша удаляет по давности использования
+            os.utime(path)
+            return sha256, path, False, phash
+        except FileNotFoundError:
+            pass
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # через временный файл, чтобы по этому пути никогда не лежал недописанный скрин
+        tmp_path = f"{path}.{os.getpid()}.{id(data)}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+        return sha256, path, True, phash
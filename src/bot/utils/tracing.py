@@ -0,0 +1,264 @@
+import asyncio
+import json
+import logging
+import os
+import random
+import secrets
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Awaitable, Callable, Dict, Optional
+
+from aiogram import BaseMiddleware, Bot
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.methods import TelegramMethod
+from aiogram.types import TelegramObject, Update
+from aiohttp import ClientSession, ClientTimeout
+
+# трассировка апдейтов (можно переопределить в .env); 0 — выключена и ничего не устанавливается
+TRACE_SAMPLE_RATE = float(os.getenv("TRACE_SAMPLE_RATE", 0))
+TRACE_EXPORTER = os.getenv("TRACE_EXPORTER", "jsonl")  # jsonl или otlp
+TRACE_JSONL_PATH = os.getenv("TRACE_JSONL_PATH", "cache/traces.jsonl")
+TRACE_OTLP_ENDPOINT = os.getenv("TRACE_OTLP_ENDPOINT", "http://127.0.0.1:4318/v1/traces")
+TRACE_SERVICE_NAME = os.getenv("TRACE_SERVICE_NAME", "belekker-bot")
+TRACE_QUEUE_SIZE = 10000
+TRACE_BATCH = 512
+TRACE_FLUSH_INTERVAL = 2.0
+
+# текущий спан; None — апдейт не попал в выборку или трассировка выключена
+_current_span: ContextVar[Optional["Span"]] = ContextVar("trace_span", default=None)
+
+
+class Span:
+    __slots__ = ("trace_id", "span_id", "parent_id", "name", "start_ns", "end_ns", "attributes", "error")
+
+    def __init__(self, name: str, trace_id: str, parent_id: Optional[str], attributes: dict):
+        self.trace_id = trace_id
+        self.span_id = secrets.token_hex(8)
+        self.parent_id = parent_id
+        self.name = name
+        self.start_ns = time.time_ns()
+        self.end_ns = 0
+        self.attributes = attributes
+        self.error: Optional[str] = None
+
+    def to_dict(self) -> dict:
+        return {
+            "trace_id": self.trace_id,
+            "span_id": self.span_id,
+            "parent_id": self.parent_id,
+            "name": self.name,
+            "start": self.start_ns / 1e9,
+            "duration_ms": round((self.end_ns - self.start_ns) / 1e6, 3),
+            "attributes": self.attributes,
+            "error": self.error,
+        }
+
+    def to_otlp(self) -> dict:
+        span = {
+            "traceId": self.trace_id,
+            "spanId": self.span_id,
+            "name": self.name,
+            "kind": 1,
+            "startTimeUnixNano": str(self.start_ns),
+            "endTimeUnixNano": str(self.end_ns),
+            "attributes": [{"key": k, "value": {"stringValue": str(v)}} for k, v in self.attributes.items()],
+        }
+        if self.parent_id:
+            span["parentSpanId"] = self.parent_id
+        if self.error:
+            span["status"] = {"code": 2, "message": self.error}
+        return span
+
+
+class Tracer:
+    """
+    Трассировка апдейта целиком: корневой спан на апдейт, вложенные — на обработчик, запросы к БД
+    и вызовы Bot API. Решение о выборке принимается один раз на апдейт (sample_rate);
+    вне выборки span() сводится к чтению contextvar. Готовые спаны копятся в очереди
+    и фоновая задача пачками пишет их в JSONL-файл или отправляет в OTLP/HTTP коллектор.
+    """
+
+    def __init__(self, sample_rate: float = TRACE_SAMPLE_RATE, exporter: str = TRACE_EXPORTER,
+                 jsonl_path: str = TRACE_JSONL_PATH, otlp_endpoint: str = TRACE_OTLP_ENDPOINT):
+        self.sample_rate = sample_rate
+        self.exporter = exporter
+        self.jsonl_path = jsonl_path
+        self.otlp_endpoint = otlp_endpoint
+        self._queue: asyncio.Queue[Optional[Span]] = asyncio.Queue(maxsize=TRACE_QUEUE_SIZE)
+        self._task: Optional[asyncio.Task] = None
+        self._stopping = asyncio.Event()
+        self._http: Optional[ClientSession] = None
+
+    def start(self):
+        if not self._task:
+            self._task = asyncio.create_task(self._run())
+
+    async def close(self):
+        if self._task:
+            # задачу не отменяем: запись в файл идет в потоке, и отмена его не остановит.
+            # None встает в очередь за всеми спанами — задача выгрузит их и выйдет сама
+            self._stopping.set()
+            await self._queue.put(None)
+            await self._task
+            self._task = None
+        else:
+            batch = []
+            while not self._queue.empty():
+                batch.append(self._queue.get_nowait())
+            await self._export(batch)
+        if self._http:
+            await self._http.close()
+
+    def _finish(self, span: Span):
+        span.end_ns = time.time_ns()
+        try:
+            self._queue.put_nowait(span)
+        except asyncio.QueueFull:
+            pass  # трассы — не журнал, при перегрузке их не жалко
+
+    @contextmanager
+    def trace(self, name: str, **attributes):
+        """Корневой спан апдейта; попадает в выборку с вероятностью sample_rate."""
+        if random.random() >= self.sample_rate:
+            yield None
+            return
+        span = Span(name, secrets.token_hex(16), None, attributes)
+        token = _current_span.set(span)
+        try:
+            yield span
+        except BaseException as e:
+            span.error = repr(e)
+            raise
+        finally:
+            _current_span.reset(token)
+            self._finish(span)
+
+    @contextmanager
+    def span(self, name: str, **attributes):
+        """Вложенный спан; если апдейт не в выборке, ничего не делает."""
+        parent = _current_span.get()
+        if parent is None:
+            yield None
+            return
+        span = Span(name, parent.trace_id, parent.span_id, attributes)
+        token = _current_span.set(span)
+        try:
+            yield span
+        except BaseException as e:
+            span.error = repr(e)
+            raise
+        finally:
+            _current_span.reset(token)
+            self._finish(span)
+
+    def add_span(self, name: str, start_ns: int, failed: bool = False, **attributes):
+        """Готовый спан, который закончился только что (например, запрос к БД, замеренный снаружи)."""
+        parent = _current_span.get()
+        if parent is None:
+            return
+        span = Span(name, parent.trace_id, parent.span_id, attributes)
+        span.start_ns = start_ns
+        if failed:
+            span.error = "failed"
+        self._finish(span)
+
+    async def _run(self):
+        while True:
+            span = await self._queue.get()
+            if span is None:
+                return
+            batch = [span]
+            if not self._stopping.is_set():
+                try:
+                    # копим пачку, но при остановке не ждем
+                    await asyncio.wait_for(self._stopping.wait(), TRACE_FLUSH_INTERVAL)
+                except asyncio.TimeoutError:
+                    pass
+            stopping = False
+            while len(batch) < TRACE_BATCH and not self._queue.empty():
+                span = self._queue.get_nowait()
+                if span is None:
+                    stopping = True
+                    break
+                batch.append(span)
+            try:
+                await self._export(batch)
+            except Exception:
+                logging.exception(f"Не удалось выгрузить трассы, потеряно спанов: {len(batch)}")
+            if stopping:
+                return
+
+    async def _export(self, batch: list[Span]):
+        if not batch:
+            return
+        if self.exporter == "otlp":
+            await self._export_otlp(batch)
+        else:
+            lines = "".join(json.dumps(span.to_dict(), ensure_ascii=False, default=str) + "\n" for span in batch)
+            await asyncio.to_thread(self._append_jsonl, lines)
+
+    def _append_jsonl(self, lines: str):
+        os.makedirs(os.path.dirname(self.jsonl_path) or ".", exist_ok=True)
+        with open(self.jsonl_path, "a", encoding="utf-8") as f:
+            f.write(lines)
+
+    async def _export_otlp(self, batch: list[Span]):
+        if self._http is None:
+            self._http = ClientSession(timeout=ClientTimeout(total=10))
+        payload = {"resourceSpans": [{
+            "resource": {"attributes": [{"key": "service.name", "value": {"stringValue": TRACE_SERVICE_NAME}}]},
+            "scopeSpans": [{"scope": {"name": "belekker"}, "spans": [span.to_otlp() for span in batch]}],
+        }]}
+        async with self._http.post(self.otlp_endpoint, json=payload) as response:
+            if response.status >= 400:
+                logging.warning(f"Коллектор трасс ответил {response.status}: {await response.text()}")
+
+
+class TracingMiddleware(BaseMiddleware):
+    """
+    На dp.update — корневой спан апдейта (с update_id и пользователем).
+    На dp.message / dp.callback_query (inner, последним) — спан обработчика с его именем
+    и временем, которое апдейт провел в middleware до обработчика.
+    """
+
+    def __init__(self, tracer: Tracer):
+        super().__init__()
+        self.tracer = tracer
+
+    async def __call__(
+            self,
+            handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+            event: TelegramObject,
+            data: Dict[str, Any]
+    ) -> Any:
+        if isinstance(event, Update):
+            user = data.get("event_from_user")
+            with self.tracer.trace("update", update_id=event.update_id, type=event.event_type,
+                                   user_id=user.id if user else None):
+                return await handler(event, data)
+
+        parent = _current_span.get()
+        if parent is None:
+            return await handler(event, data)
+        handler_object = data.get("handler")
+        callback = handler_object.callback if handler_object else None
+        name = f"{callback.__module__}.{callback.__qualname__}" if callback else "unknown"
+        with self.tracer.span(f"handler {name}", handler=name,
+                              middleware_ms=round((time.time_ns() - parent.start_ns) / 1e6, 3)):
+            return await handler(event, data)
+
+
+class TracingSession(AiohttpSession):
+    """Сессия Bot API, которая пишет спан на каждый вызов (send_photo, send_document и т.д.)."""
+
+    def __init__(self, tracer: Tracer, **kwargs: Any):
+        super().__init__(**kwargs)
+        self.tracer = tracer
+
+    async def make_request(self, bot: Bot, method: TelegramMethod, timeout: Optional[int] = None):
+        if _current_span.get() is None:
+            return await super().make_request(bot, method, timeout)
+        with self.tracer.span(f"bot {method.__api_method__}", method=method.__api_method__,
+                              chat_id=getattr(method, "chat_id", None)):
+            return await super().make_request(bot, method, timeout)
@@ -0,0 +1,132 @@
+import asyncio
+import logging
+import os
+from typing import Any, Dict
+
+from aiogram import Bot, Dispatcher
+from aiogram.webhook.aiohttp_server import SimpleRequestHandler, setup_application
+from aiohttp import web
+
+from bot.utils.metrics import metrics
+
+# режим работы и настройки вебхука (можно переопределить в .env)
+BOT_MODE = os.getenv("BOT_MODE", "polling")
+WEBHOOK_BASE_URL = os.getenv("WEBHOOK_BASE_URL", "")  # публичный адрес, например https://bot.example.com
+WEBHOOK_PATH = os.getenv("WEBHOOK_PATH", "/webhook")
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET", "")
+WEBHOOK_HOST = os.getenv("WEBHOOK_HOST", "0.0.0.0")
+WEBHOOK_PORT = int(os.getenv("WEBHOOK_PORT", 8080))
+# сколько апдейтов обрабатываем одновременно; остальные telegram подождут на своей стороне
+WEBHOOK_MAX_CONCURRENT = int(os.getenv("WEBHOOK_MAX_CONCURRENT", 100))
+# сколько параллельных соединений telegram открывает к вебхуку (1-100)
+WEBHOOK_MAX_CONNECTIONS = int(os.getenv("WEBHOOK_MAX_CONNECTIONS", 40))
+# регистрировать ли вебхук в telegram при старте (выключают у всех реплик, кроме одной, и при локальных тестах)
+WEBHOOK_REGISTER = os.getenv("WEBHOOK_REGISTER", "1") == "1"
+# порт для /metrics и /ready в режиме polling; 0 — не поднимать (в режиме webhook они на порту вебхука)
+METRICS_PORT = int(os.getenv("METRICS_PORT", 0))
+READY_TIMEOUT = 2.0
+
+
+class LimitedRequestHandler(SimpleRequestHandler):
+    """
+    Обработчик вебхука с ограничением параллельности.
+    Telegram получает ответ сразу, а апдейт обрабатывается в фоне, но не больше max_concurrent одновременно:
+    когда все слоты заняты, новый запрос ждет свободного слота и только потом получает ответ.
+    Так очередь остается на стороне telegram, а не копится задачами в памяти.
+    """
+
+    def __init__(self, dispatcher: Dispatcher, bot: Bot, max_concurrent: int = WEBHOOK_MAX_CONCURRENT,
+                 **kwargs: Any):
+        super().__init__(dispatcher=dispatcher, bot=bot, handle_in_background=True, **kwargs)
+        self._slots = asyncio.Semaphore(max_concurrent)
+
+    async def _handle_request_background(self, bot: Bot, request: web.Request) -> web.Response:
+        await self._slots.acquire()
+        try:
+            return await super()._handle_request_background(bot=bot, request=request)
+        except BaseException:
+            # задача не создана (битый json, обрыв соединения) — слот освобождаем сами
+            self._slots.release()
+            raise
+
+    async def _background_feed_update(self, bot: Bot, update: Dict[str, Any]) -> None:
+        try:
+            await super()._background_feed_update(bot=bot, update=update)
+        except Exception:
+            logging.exception(f"Ошибка при обработке апдейта {update.get('update_id')}")
+        finally:
+            self._slots.release()
+
+
+def _add_service_routes(app: web.Application, db):
+    """/health, /ready (проверяет пул БД) и /metrics."""
+
+    async def health(request: web.Request) -> web.Response:
+        return web.Response(text="ok")
+
+    async def ready(request: web.Request) -> web.Response:
+        # готовы, только если пул жив и БД отвечает
+        try:
+            await asyncio.wait_for(db.pool.fetchval("SELECT 1"), READY_TIMEOUT)
+        except Exception as e:
+            return web.Response(status=503, text=f"db unavailable: {e}")
+        return web.Response(text="ok")
+
+    async def metrics_handler(request: web.Request) -> web.Response:
+        return web.Response(text=metrics.render())
+
+    app.router.add_get("/health", health)
+    app.router.add_get("/ready", ready)
+    app.router.add_get("/metrics", metrics_handler)
+
+
+def build_app(bot: Bot, dp: Dispatcher, db, max_concurrent: int = WEBHOOK_MAX_CONCURRENT,
+              secret_token: str = WEBHOOK_SECRET, path: str = WEBHOOK_PATH) -> web.Application:
+    """Собирает aiohttp-приложение: вебхук на path, /health, /ready и /metrics."""
+    app = web.Application()
+    LimitedRequestHandler(
+        dispatcher=dp,
+        bot=bot,
+        max_concurrent=max_concurrent,
+        secret_token=secret_token or None,
+    ).register(app, path=path)
+    setup_application(app, dp, bot=bot)
+    _add_service_routes(app, db)
+    return app
+
+
+async def start_service_server(db, host: str = WEBHOOK_HOST, port: int = METRICS_PORT) -> web.AppRunner:
+    """В режиме polling поднимает отдельный сервер только с /health, /ready и /metrics."""
+    app = web.Application()
+    _add_service_routes(app, db)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    logging.info(f"Метрики доступны на {host}:{port}/metrics")
+    return runner
+
+
+async def run_webhook(bot: Bot, dp: Dispatcher, db):
+    """Поднимает сервер вебхука и работает до отмены."""
+    app = build_app(bot, dp, db)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, WEBHOOK_HOST, WEBHOOK_PORT)
+    await site.start()
+    logging.info(f"Вебхук слушает {WEBHOOK_HOST}:{WEBHOOK_PORT}{WEBHOOK_PATH}")
+
+    if WEBHOOK_REGISTER:
+        if not WEBHOOK_BASE_URL:
+            raise ValueError("WEBHOOK_BASE_URL не найден в .env")
+        await bot.set_webhook(
+            url=WEBHOOK_BASE_URL.rstrip("/") + WEBHOOK_PATH,
+            secret_token=WEBHOOK_SECRET or None,
+            allowed_updates=dp.resolve_used_update_types(),
+            max_connections=WEBHOOK_MAX_CONNECTIONS,
+        )
+
+    try:
+        await asyncio.Event().wait()
+    finally:
+        # on_shutdown закроет сессию бота и дождется dispatcher.emit_shutdown
+        await runner.cleanup()
@@ -0,0 +1,152 @@
+import asyncio
+import json
+import logging
+import os
+import time
+from typing import NamedTuple
+
+# включать ли режим check-in сразу при старте бота (можно переопределить в .env)
+CHECKIN_AUTOSTART = os.getenv("CHECKIN_AUTOSTART", "0") == "1"
+NOTIFY_CHANNEL = "ticket_status"
+
+
+class CheckinEntry(NamedTuple):
+    owner_id: int
+    name: str | None
+    username: str | None
+    used: bool
+
+
+class CheckinIndex:
+    """
+    Индекс билетов в памяти для входа на мероприятие.
+    После enable() все активные билеты с владельцами лежат в словарях, и скан отвечает без БД.
+    Синхронизация — через LISTEN ticket_status (триггер notify_ticket_status в init.sql):
+    погашенный любым админом или другим экземпляром бота билет сразу виден как использованный,
+    выпущенный после загрузки — как активный.
+    Билеты, погашенные до загрузки, в индекс не попадают — по ним lookup вернет None и скан пойдет в БД.
+    Если соединение LISTEN оборвалось, индекс выключается, чтобы не отвечать по устаревшим данным.
+    """
+
+    def __init__(self, db):
+        self.db = db
+        self.enabled = False
+        self.loaded_at: float | None = None
+        self._tickets: dict[str, int] = {}  # token -> owner_id
+        self._used: set[str] = set()
+        self._owners: dict[int, tuple[str | None, str | None]] = {}  # owner_id -> (name, username)
+        self._conn = None
+        self._loading = False
+        self._pending: list[dict] = []  # уведомления, пришедшие во время загрузки
+        self._lock = asyncio.Lock()
+        self._owner_tasks: set[asyncio.Task] = set()
+
+    def __len__(self) -> int:
+        return len(self._tickets)
+
+    @property
+    def used_count(self) -> int:
+        return len(self._used)
+
+    async def enable(self) -> int:
+        """Подписывается на уведомления и загружает активные билеты. Возвращает их количество."""
+        async with self._lock:
+            if self.enabled:
+                return len(self._tickets)
+            # сначала LISTEN, потом снимок: так ни одно изменение не проскочит между ними
+            self._loading = True
+            self._conn = await self.db.listen(NOTIFY_CHANNEL, self._on_notify)
+            self._conn.add_termination_listener(self._on_terminated)
+            try:
+                self.load_rows(await self.db.get_active_tickets_with_owners())
+            except Exception:
+                await self._close_conn()
+                self._loading = False
+                raise
+            self._loading = False
+            pending, self._pending = self._pending, []
+            for event in pending:
+                self._apply(event)
+            self.enabled = True
+            self.loaded_at = time.time()
+            logging.info(f"Check-in: загружено {len(self._tickets)} активных билетов.")
+            return len(self._tickets)
+
+    async def disable(self):
+        async with self._lock:
+            self.enabled = False
+            await self._close_conn()
+            self._tickets.clear()
+            self._used.clear()
+            self._owners.clear()
+            self.loaded_at = None
+
+    def load_rows(self, rows):
+        """Заполняет индекс строками (token, owner_telegram_id, username, name)."""
+        self._tickets.clear()
+        self._used.clear()
+        self._owners.clear()
+        for row in rows:
+            owner_id = row['owner_telegram_id']
+            self._tickets[row['token']] = owner_id
+            if owner_id not in self._owners:
+                self._owners[owner_id] = (row['name'], row['username'])
+
+    def lookup(self, token: str) -> CheckinEntry | None:
+        owner_id = self._tickets.get(token)
+        if owner_id is None:
+            return None
+        name, username = self._owners.get(owner_id, (None, None))
+        return CheckinEntry(owner_id, name, username, token in self._used)
+
+    def mark_used(self, token: str):
+        """Отмечает локально сразу после use_ticket, не дожидаясь уведомления."""
+        if token in self._tickets:
+            self._used.add(token)
+
+    async def _close_conn(self):
+        if self._conn is not None:
+            conn, self._conn = self._conn, None
+            try:
+                await conn.close()
+            except Exception:
+                pass
+
+    def _on_terminated(self, conn):
+        if conn is self._conn:
+            logging.error("Check-in: соединение LISTEN оборвалось, индекс выключен.")
+            self.enabled = False
+            self._conn = None
+
+    def _on_notify(self, conn, pid, channel, payload):
+        try:
+            event = json.loads(payload)
+        except ValueError:
+            return
+        if self._loading:
+            self._pending.append(event)
+        elif self.enabled:
+            self._apply(event)
+
+    def _apply(self, event: dict):
+        token, owner_id = event['token'], event['owner']
+        if event['status'] == 'active':
+            self._tickets[token] = owner_id
+            self._used.discard(token)
+            if owner_id not in self._owners:
+                self._spawn_owner_load(owner_id)
+        elif token in self._tickets:
+            self._used.add(token)
+
+    def _spawn_owner_load(self, owner_id: int):
+        task = asyncio.create_task(self._load_owner(owner_id))
+        self._owner_tasks.add(task)
+        task.add_done_callback(self._owner_tasks.discard)
+
+    async def _load_owner(self, owner_id: int):
+        try:
+            user = await self.db.get_user_by_telegram_id(owner_id)
+        except Exception:
+            logging.exception(f"Check-in: не удалось загрузить владельца {owner_id}")
+            return
+        self._owners[owner_id] = (user['name'], user['username']) if user else (None, None)
@@ -1,15 +1,69 @@
+import asyncio
 import asyncpg
-import csv
 import os
-import time
-import uuid
-from datetime import datetime
+from datetime import datetime, timezone
 from .config import DB_HOST, DB_PORT, DB_NAME, DB_USER, DB_PASSWORD
+from .exports import CsvPartWriter, EXPORT_DIR, EXPORT_CHUNK_ROWS, DELTA_SETTLE_SECONDS
+from .tokens import new_ticket_token
+
+# сколько раз довставляем билеты, если сгенерированный токен уже занят
+TICKET_INSERT_ATTEMPTS = 5
+# по сколько офлайн-сканов гасим за один запрос (можно переопределить в .env)
+OFFLINE_SYNC_CHUNK = int(os.getenv("OFFLINE_SYNC_CHUNK", 1000))
+# сколько раз пробовать другой слот промокода, если выбранный перехватила параллельная покупка
+PROMO_REDEEM_ATTEMPTS = 5
+
+
+def _new_ticket_tokens(owner_ids: list[int]) -> list[str]:
+    """Генерирует по токену на каждого владельца, без повторов внутри пачки."""
+    tokens, seen = [], set()
+    for owner_id in owner_ids:
+        token = new_ticket_token(owner_id)
+        while token in seen:
+            token = new_ticket_token(owner_id)
+        seen.add(token)
+        tokens.append(token)
+    return tokens
+
+
+def _format_user_row(row) -> list:
+    return [
+        row['id'],
+        row['telegram_id'],
+        row['username'] if row['username'] else '',
+        row['name'] if row['name'] else '',
+        row['created_at'].strftime('%Y-%m-%d %H:%M:%S') if row['created_at'] else '',
+        row['active_tickets_count']
+    ]
+
+
+def _format_transaction_row(row) -> list:
+    return [
+        row["id"],
+        row["user_telegram_id"],
+        row["quantity"],
+        float(row["amount"]),  # чтобы всегда было число
+        row["status"],
+        row["created_at"].strftime("%Y-%m-%d %H:%M:%S") if row["created_at"] else ""
+    ]
+
+
+def _format_ticket_row(row) -> list:
+    return [
+        row["id"],
+        row["token"],
+        row["owner_telegram_id"],
+        row["transaction_id"],
+        row["status"],
+        row["created_at"].strftime("%Y-%m-%d %H:%M:%S") if row["created_at"] else ""
+    ]
 
 
 class Database:
     def __init__(self):
         self.pool = None
+        # write-behind буфер пользователей (UserWriteBuffer), подключается в main
+        self.user_buffer = None
 
     async def connect(self):
         """
@@ -31,6 +85,21 @@ class Database:
             )
             print("Пул подключений к базе данных успешно создан.")
 
+    async def listen(self, channel: str, callback) -> asyncpg.Connection:
+        """
+        Открывает отдельное от пула соединение и подписывает callback на LISTEN channel.
+        Соединение живет, пока его не закроют, поэтому в пул его не берем.
+        """
+        conn = await asyncpg.connect(
+            host=DB_HOST,
+            port=DB_PORT,
+            database=DB_NAME,
+            user=DB_USER,
+            password=DB_PASSWORD,
+        )
+        await conn.add_listener(channel, callback)
+        return conn
+
     async def close(self):
         """Закрывает пул подключений."""
         if self.pool:
@@ -43,6 +112,7 @@ class Database:
         """
         Добавляет нового пользователя в базу данных.
         Если пользователь существует, обновляет его username и name.
+        Раз пользователь снова пишет боту, отметка о блокировке снимается.
         Возвращает True, если пользователь был добавлен, и False, если обновлен.
         """
         async with self.pool.acquire() as conn:
@@ -53,6 +123,7 @@ class Database:
                 ON CONFLICT (telegram_id) DO UPDATE SET
                     username = EXCLUDED.username,
                     name = EXCLUDED.name,
+                    blocked_at = NULL,
                     created_at = users.created_at;
                 """,
                 telegram_id, username, name
@@ -60,6 +131,35 @@ class Database:
             # INSERT ... возвращает "INSERT 0 1", если была вставка
             return result.startswith("INSERT")
 
+    async def add_users_bulk(self, users: list[tuple[int, str, str]]):
+        """
+        Добавляет или обновляет пачку пользователей одним запросом.
+        users — список (telegram_id, username, name) без повторов telegram_id.
+        """
+        if not users:
+            return
+        telegram_ids, usernames, names = map(list, zip(*users))
+        async with self.pool.acquire() as conn:
+            await conn.execute(
+                """
+                INSERT INTO users (telegram_id, username, name)
+                SELECT * FROM unnest($1::bigint[], $2::text[], $3::text[])
+                ON CONFLICT (telegram_id) DO UPDATE SET
+                    username = EXCLUDED.username,
+                    name = EXCLUDED.name,
+                    blocked_at = NULL;
+                """,
+                telegram_ids, usernames, names
+            )
+
+    async def _flush_pending_users(self, telegram_id: int | None = None):
+        """Дописывает отложенных пользователей из буфера, если запросу нужны их строки."""
+        if self.user_buffer:
+            if telegram_id is None:
+                await self.user_buffer.flush()
+            else:
+                await self.user_buffer.flush_user(telegram_id)
+
     async def get_user_by_telegram_id(self, telegram_id: int):
         """Возвращает данные пользователя по его telegram_id."""
         async with self.pool.acquire() as conn:
@@ -67,6 +167,15 @@ class Database:
                 "SELECT * FROM users WHERE telegram_id = $1", telegram_id
             )
 
+    async def get_telegram_ids_by_usernames(self, usernames: list[str]) -> dict[str, int]:
+        """Возвращает словарь username -> telegram_id для найденных пользователей."""
+        await self._flush_pending_users()
+        async with self.pool.acquire() as conn:
+            records = await conn.fetch(
+                "SELECT username, telegram_id FROM users WHERE username = ANY($1::text[])", usernames
+            )
+            return {record['username']: record['telegram_id'] for record in records}
+
     async def count_users(self) -> int:
         """Возвращает общее количество пользователей."""
         async with self.pool.acquire() as conn:
@@ -81,15 +190,15 @@ class Database:
         Если указан промокод, он будет применен.
         Возвращает ID созданной транзакции.
         """
+        # transactions ссылается на users.telegram_id — строка пользователя должна уже быть в БД
+        await self._flush_pending_users(user_telegram_id)
         async with self.pool.acquire() as conn:
             async with conn.transaction():
-                promo_code_id = None
+                promo = None
                 if promo_code:
-                    # Находим ID промокода. Проверяем, что использований меньше лимита
-                    promo_code_id = await conn.fetchval(
-                        "SELECT id FROM promo_codes WHERE code = $1 AND used_count < usage_limit", promo_code
-                    )
-                    if not promo_code_id:
+                    # строку промокода только читаем: лимит держит promo_redemptions, а не счетчик в promo_codes
+                    promo = await conn.fetchrow("SELECT id, usage_limit FROM promo_codes WHERE code = $1", promo_code)
+                    if not promo:
                         raise ValueError("Промокод не найден или использован полностью.")
 
                 # Вставляем транзакцию
@@ -99,17 +208,44 @@ class Database:
                     VALUES ($1, $2, $3, $4, 'on_check')
                     RETURNING id
                     """,
-                    user_telegram_id, quantity, amount, promo_code_id
+                    user_telegram_id, quantity, amount, promo['id'] if promo else None
                 )
 
-                # Обновляем счетчик использований промокода
-                if promo_code_id:
-                    await conn.execute(
-                        "UPDATE promo_codes SET used_count = used_count + 1 WHERE id = $1", promo_code_id
-                    )
+                if promo:
+                    await self._redeem_promo(conn, promo['id'], promo['usage_limit'], transaction_id)
 
                 return transaction_id
 
+    async def _redeem_promo(self, conn, promo_code_id: int, usage_limit: int, transaction_id: int):
+        """
+        Занимает для транзакции случайный свободный слот промокода (внутри транзакции БД вызывающего).
+        Параллельные покупки по одному промокоду почти всегда берут разные слоты и друг друга не ждут;
+        если слот перехватили, берем другой. Свободных слотов нет — ValueError, транзакция откатится.
+        """
+        for _ in range(PROMO_REDEEM_ATTEMPTS):
+            slot = await conn.fetchval(
+                """
+                INSERT INTO promo_redemptions (promo_code_id, slot, transaction_id)
+                SELECT $1::integer, free.slot, $3::integer
+                FROM (SELECT generate_series(0, $2::integer - 1) AS slot
+                      EXCEPT
+                      SELECT slot FROM promo_redemptions WHERE promo_code_id = $1) free
+                ORDER BY random()
+                LIMIT 1
+                ON CONFLICT DO NOTHING
+                RETURNING slot
+                """,
+                promo_code_id, usage_limit, transaction_id
+            )
+            if slot is not None:
+                return
+            used = await conn.fetchval(
+                "SELECT COUNT(*) FROM promo_redemptions WHERE promo_code_id = $1", promo_code_id
+            )
+            if used >= usage_limit:
+                raise ValueError("Промокод не найден или использован полностью.")
+        raise ValueError("Промокод сейчас применяют слишком многие, попробуйте еще раз.")
+
     async def add_purchase(self, telegram_id: int, qty: int, amount: int, repost: bool,
                            moderator_id: int | None = None):
         """
@@ -141,6 +277,49 @@ class Database:
             return row["amount"]
         return 0
 
+    async def add_payment_proof(self, transaction_id: int, file_id: str, sha256: str, path: str,
+                                phash: int | None = None):
+        """
+        Записывает скачанный в архив скрин оплаты транзакции (повторная запись того же файла игнорируется).
+        phash — перцептивный хэш, уже приведенный к знаковому BIGINT (proof_index.to_bigint).
+        """
+        await self.pool.execute(
+            """
+            INSERT INTO payment_proofs (transaction_id, file_id, sha256, path, phash)
+            VALUES ($1, $2, $3, $4, $5)
+            ON CONFLICT (transaction_id, file_id) DO NOTHING
+            """,
+            transaction_id, file_id, sha256, path, phash
+        )
+
+    async def get_proof_hashes(self) -> list[asyncpg.Record]:
+        """Перцептивные хэши всех скринов оплаты для ProofHashIndex."""
+        return await self.pool.fetch(
+            "SELECT phash, transaction_id FROM payment_proofs WHERE phash IS NOT NULL"
+        )
+
+    async def get_proof_states(self) -> dict[str, bool]:
+        """
+        sha256 каждого скрина в архиве -> есть ли среди его транзакций еще не обработанная (on_check).
+        Нужен уборщику кэша: такие скрины удалять нельзя.
+        """
+        rows = await self.pool.fetch(
+            """
+            SELECT p.sha256, bool_or(t.status = 'on_check') AS pending
+            FROM payment_proofs p
+                     JOIN transactions t ON t.id = p.transaction_id
+            GROUP BY p.sha256
+            """
+        )
+        return {row['sha256']: row['pending'] for row in rows}
+
+    async def get_users_with_pending_transactions(self) -> set[int]:
+        """telegram_id пользователей, у которых есть транзакция на проверке."""
+        rows = await self.pool.fetch(
+            "SELECT DISTINCT user_telegram_id FROM transactions WHERE status = 'on_check'"
+        )
+        return {row['user_telegram_id'] for row in rows}
+
     async def approve_transaction(self, transaction_id: int) -> list[str]:
         """
         Подтверждает транзакцию и создает билеты для пользователя.
@@ -165,32 +344,89 @@ class Database:
                     transaction_id
                 )
 
-                # генерируем и вставляем билеты
+                # генерируем и вставляем все билеты одним запросом
                 owner_id = tx_data['user_telegram_id']
                 quantity = tx_data['quantity']
-                new_tickets = []
-                for _ in range(quantity):
-                    token = token = f"{owner_id:x}aa{int(time.time()):x}{uuid.uuid4().hex[:6]}"
-                    await conn.execute(
-                        """
-                        INSERT INTO tickets (token, owner_telegram_id, transaction_id, status)
-                        VALUES ($1, $2, $3, 'active')
-                        """,
-                        token, owner_id, transaction_id
-                    )
-                    new_tickets.append(token)
+                return await self._issue_tickets(conn, [owner_id] * quantity, [transaction_id] * quantity)
+
+    async def _issue_tickets(self, conn, owner_ids: list[int], transaction_ids: list[int]) -> list[str]:
+        """
+        Вставляет пачку билетов одним INSERT ... SELECT unnest(...).
+        owner_ids и transaction_ids — параллельные массивы, по элементу на билет.
+        Если токен случайно совпал с уже существующим, строка пропускается (ON CONFLICT DO NOTHING),
+        для нее генерируется новый токен и она довставляется — остальная пачка не откатывается.
+        Возвращает токены в том же порядке, что и owner_ids.
+        """
+        tokens = _new_ticket_tokens(owner_ids)
+        pending = list(range(len(owner_ids)))
+
+        for _ in range(TICKET_INSERT_ATTEMPTS):
+            rows = await conn.fetch(
+                """
+                INSERT INTO tickets (token, owner_telegram_id, transaction_id, status)
+                SELECT t.token, t.owner_telegram_id, t.transaction_id, 'active'
+                FROM unnest($1::text[], $2::bigint[], $3::int[]) AS t(token, owner_telegram_id, transaction_id)
+                ON CONFLICT (token) DO NOTHING
+                RETURNING token
+                """,
+                [tokens[i] for i in pending],
+                [owner_ids[i] for i in pending],
+                [transaction_ids[i] for i in pending],
+            )
+            inserted = {row['token'] for row in rows}
+            pending = [i for i in pending if tokens[i] not in inserted]
+            if not pending:
+                return tokens
+
+            for i, token in zip(pending, _new_ticket_tokens([owner_ids[i] for i in pending])):
+                tokens[i] = token
+
+        raise RuntimeError(f"Не удалось подобрать уникальные токены для {len(pending)} билетов.")
 
-                return new_tickets
+    async def issue_complimentary_tickets(self, telegram_ids: list[int], quantity: int) -> dict[int, list[str]]:
+        """
+        Выдает бесплатные билеты сразу многим пользователям.
+        На каждого пользователя создается подтвержденная транзакция с нулевой суммой,
+        все билеты вставляются одним запросом через _issue_tickets.
+        Пользователи, которых нет в базе, пропускаются.
+        Возвращает словарь telegram_id -> список токенов.
+        """
+        await self._flush_pending_users()
+        async with self.pool.acquire() as conn:
+            async with conn.transaction():
+                tx_rows = await conn.fetch(
+                    """
+                    INSERT INTO transactions (user_telegram_id, quantity, amount, status)
+                    SELECT u.telegram_id, $2, 0, 'approved'
+                    FROM users u
+                    WHERE u.telegram_id = ANY($1::bigint[])
+                    RETURNING id, user_telegram_id
+                    """,
+                    list(set(telegram_ids)), quantity
+                )
+                owner_ids, transaction_ids = [], []
+                for row in tx_rows:
+                    owner_ids.extend([row['user_telegram_id']] * quantity)
+                    transaction_ids.extend([row['id']] * quantity)
+
+                tokens = await self._issue_tickets(conn, owner_ids, transaction_ids) if owner_ids else []
+
+        issued: dict[int, list[str]] = {}
+        for owner_id, token in zip(owner_ids, tokens):
+            issued.setdefault(owner_id, []).append(token)
+        return issued
 
     async def reject_transaction(self, transaction_id: int):
-        """Отклоняет транзакцию, меняя ее статус на 'rejected'."""
+        """Отклоняет транзакцию, меняя ее статус на 'rejected'. Использование промокода освобождается."""
         async with self.pool.acquire() as conn:
-            result = await conn.execute(
-                "UPDATE transactions SET status = 'rejected' WHERE id = $1 AND status = 'on_check'",
-                transaction_id
-            )
-            if result == 'UPDATE 0':
-                raise ValueError("Транзакция не найдена или уже обработана.")
+            async with conn.transaction():
+                result = await conn.execute(
+                    "UPDATE transactions SET status = 'rejected' WHERE id = $1 AND status = 'on_check'",
+                    transaction_id
+                )
+                if result == 'UPDATE 0':
+                    raise ValueError("Транзакция не найдена или уже обработана.")
+                await conn.execute("DELETE FROM promo_redemptions WHERE transaction_id = $1", transaction_id)
 
     # --- Методы для работы с билетами ---
 
@@ -222,11 +458,50 @@ class Database:
         """
         async with self.pool.acquire() as conn:
             result = await conn.execute(
-                "UPDATE tickets SET status = 'used' WHERE token = $1 AND status = 'active'",
+                """
+                UPDATE tickets SET status = 'used', used_at = CURRENT_TIMESTAMP
+                WHERE token = $1 AND status = 'active'
+                """,
                 token
             )
             return result == 'UPDATE 1'
 
+    async def use_tickets_bulk(self, scans: dict[str, datetime | None],
+                               chunk_size: int = OFFLINE_SYNC_CHUNK) -> dict[str, str]:
+        """
+        Гасит пачку билетов, отсканированных офлайн: token -> время скана (None — текущее).
+        На чанк два запроса: UPDATE ... RETURNING по всем токенам чанка и SELECT для оставшихся,
+        чтобы отличить уже использованные от несуществующих.
+        Возвращает token -> 'accepted' | 'used' | 'unknown'.
+        """
+        results: dict[str, str] = {}
+        items = list(scans.items())
+        async with self.pool.acquire() as conn:
+            for start in range(0, len(items), chunk_size):
+                chunk = items[start:start + chunk_size]
+                tokens = [token for token, _ in chunk]
+                accepted = await conn.fetch(
+                    """
+                    UPDATE tickets t
+                    SET status  = 'used',
+                        used_at = COALESCE(s.used_at, CURRENT_TIMESTAMP)
+                    FROM unnest($1::text[], $2::timestamptz[]) AS s(token, used_at)
+                    WHERE t.token = s.token
+                      AND t.status = 'active'
+                    RETURNING t.token
+                    """,
+                    tokens, [scanned_at for _, scanned_at in chunk]
+                )
+                for row in accepted:
+                    results[row['token']] = 'accepted'
+                rest = [token for token in tokens if token not in results]
+                if rest:
+                    existing = await conn.fetch("SELECT token FROM tickets WHERE token = ANY($1::text[])", rest)
+                    known = {row['token'] for row in existing}
+                    for token in rest:
+                        results[token] = 'used' if token in known else 'unknown'
+        return results
+
     async def remove_tickets(self, telegram_id: int, count: int):
         """
         Помечает указанное количество билетов пользователя как 'used'.
@@ -287,6 +562,18 @@ class Database:
             """
             return await conn.fetchrow(query, token)
 
+    async def get_active_tickets_with_owners(self) -> list[asyncpg.Record]:
+        """Все активные билеты с именем и username владельца — для индекса check-in."""
+        async with self.pool.acquire() as conn:
+            return await conn.fetch(
+                """
+                SELECT t.token, t.owner_telegram_id, u.username, u.name
+                FROM tickets t
+                LEFT JOIN users u ON t.owner_telegram_id = u.telegram_id
+                WHERE t.status = 'active'
+                """
+            )
+
     async def get_ticket_stats(self) -> asyncpg.Record:
         """
         Возвращает статистику по билетам, сгруппированную по статусам.
@@ -314,26 +601,186 @@ class Database:
             records = await conn.fetch(query)
             return [record['owner_telegram_id'] for record in records]
 
+    # --- Методы для рассылок ---
+
+    async def create_broadcast(self, kind: str, text: str, reply_markup: str | None, admin_chat_id: int,
+                               progress_message_id: int | None, recipient_ids: list[int],
+                               owner: str, lease_seconds: float) -> tuple[int, int]:
+        """
+        Создает рассылку и список получателей одним запросом на каждое.
+        Рассылка сразу закреплена за экземпляром бота owner на lease_seconds.
+        Пользователи, заблокировавшие бота (users.blocked_at), в список не попадают.
+        Возвращает (id рассылки, количество получателей).
+        """
+        async with self.pool.acquire() as conn:
+            async with conn.transaction():
+                broadcast_id = await conn.fetchval(
+                    """
+                    INSERT INTO broadcasts (kind, text, reply_markup, admin_chat_id, progress_message_id,
+                                            owner, lease_expires)
+                    VALUES ($1, $2, $3::jsonb, $4, $5, $6, CURRENT_TIMESTAMP + make_interval(secs => $7))
+                    RETURNING id
+                    """,
+                    kind, text, reply_markup, admin_chat_id, progress_message_id, owner, float(lease_seconds)
+                )
+                result = await conn.execute(
+                    """
+                    INSERT INTO broadcast_recipients (broadcast_id, telegram_id)
+                    SELECT $1, r.telegram_id
+                    FROM unnest($2::bigint[]) AS r(telegram_id)
+                    WHERE NOT EXISTS (
+                        SELECT 1 FROM users u WHERE u.telegram_id = r.telegram_id AND u.blocked_at IS NOT NULL
+                    )
+                    ON CONFLICT DO NOTHING
+                    """,
+                    broadcast_id, list(set(recipient_ids))
+                )
+                return broadcast_id, int(result.split()[-1])
+
+    async def claim_broadcasts(self, owner: str, lease_seconds: float) -> list[asyncpg.Record]:
+        """
+        Забирает незавершенные рассылки, у которых нет владельца или его аренда истекла
+        (экземпляр бота остановился или упал), и возвращает их.
+        Условие WHERE перепроверяется после блокировки строки, поэтому одну рассылку забирает ровно один экземпляр.
+        """
+        async with self.pool.acquire() as conn:
+            return await conn.fetch(
+                """
+                UPDATE broadcasts SET owner = $1, lease_expires = CURRENT_TIMESTAMP + make_interval(secs => $2)
+                WHERE status = 'running' AND (owner IS NULL OR lease_expires < CURRENT_TIMESTAMP)
+                RETURNING *
+                """,
+                owner, float(lease_seconds)
+            )
+
+    async def renew_broadcast_lease(self, broadcast_id: int, owner: str, lease_seconds: float) -> bool:
+        """Продлевает аренду рассылки. False — рассылку уже забрал другой экземпляр или она завершена."""
+        async with self.pool.acquire() as conn:
+            result = await conn.execute(
+                """
+                UPDATE broadcasts SET lease_expires = CURRENT_TIMESTAMP + make_interval(secs => $3)
+                WHERE id = $1 AND owner = $2 AND status = 'running'
+                """,
+                broadcast_id, owner, float(lease_seconds)
+            )
+            return result == 'UPDATE 1'
+
+    async def release_broadcasts(self, owner: str):
+        """Снимает владельца с незавершенных рассылок экземпляра, чтобы их сразу подхватил другой."""
+        async with self.pool.acquire() as conn:
+            await conn.execute(
+                "UPDATE broadcasts SET owner = NULL, lease_expires = NULL WHERE owner = $1 AND status = 'running'",
+                owner
+            )
+
+    async def get_pending_broadcast_recipients(self, broadcast_id: int) -> list[int]:
+        """Возвращает получателей рассылки, которым еще ничего не отправлено."""
+        async with self.pool.acquire() as conn:
+            records = await conn.fetch(
+                "SELECT telegram_id FROM broadcast_recipients WHERE broadcast_id = $1 AND status = 'pending'",
+                broadcast_id
+            )
+            return [record['telegram_id'] for record in records]
+
+    async def save_broadcast_results(self, broadcast_id: int, results: list[tuple[int, str]]):
+        """
+        Пачкой сохраняет статусы получателей (sent / failed / blocked).
+        Заблокировавшим бота дополнительно ставится users.blocked_at.
+        """
+        if not results:
+            return
+        telegram_ids, statuses = map(list, zip(*results))
+        blocked = [tid for tid, status in results if status == 'blocked']
+        # blocked_at ставится UPDATE'ом — строки еще не сброшенных из буфера пользователей он бы не нашел
+        for telegram_id in blocked:
+            await self._flush_pending_users(telegram_id)
+        async with self.pool.acquire() as conn:
+            async with conn.transaction():
+                await conn.execute(
+                    """
+                    UPDATE broadcast_recipients r SET status = s.status
+                    FROM unnest($2::bigint[], $3::text[]) AS s(telegram_id, status)
+                    WHERE r.broadcast_id = $1 AND r.telegram_id = s.telegram_id
+                    """,
+                    broadcast_id, telegram_ids, statuses
+                )
+                if blocked:
+                    await conn.execute(
+                        "UPDATE users SET blocked_at = CURRENT_TIMESTAMP WHERE telegram_id = ANY($1::bigint[])",
+                        blocked
+                    )
+
+    async def get_broadcast_counts(self, broadcast_id: int) -> dict[str, int]:
+        """Возвращает количество получателей рассылки по статусам."""
+        async with self.pool.acquire() as conn:
+            records = await conn.fetch(
+                "SELECT status, COUNT(*) AS cnt FROM broadcast_recipients WHERE broadcast_id = $1 GROUP BY status",
+                broadcast_id
+            )
+            counts = {'pending': 0, 'sent': 0, 'failed': 0, 'blocked': 0}
+            counts.update({record['status']: record['cnt'] for record in records})
+            return counts
+
+    async def finish_broadcast(self, broadcast_id: int):
+        """Помечает рассылку завершенной."""
+        async with self.pool.acquire() as conn:
+            await conn.execute("UPDATE broadcasts SET status = 'done' WHERE id = $1", broadcast_id)
+
     # --- Методы для работы с промокодами ---
 
     async def create_promo_code(self, code: str, admin_telegram_id: int, value: float = 750,
                                 usage_limit: int = 1) -> bool:
         """Создает новый промокод с номиналом (цена билета со скидкой) и лимитом использований."""
+        # promo_codes.admin_telegram_id ссылается на users.telegram_id — строка админа должна уже быть в БД
+        await self._flush_pending_users(admin_telegram_id)
         async with self.pool.acquire() as conn:
             try:
                 await conn.execute(
-                    "INSERT INTO promo_codes (code, admin_telegram_id, value, usage_limit, used_count) "
-                    "VALUES ($1, $2, $3, $4, 0)",
+                    "INSERT INTO promo_codes (code, admin_telegram_id, value, usage_limit) "
+                    "VALUES ($1, $2, $3, $4)",
                     code, admin_telegram_id, value, usage_limit
                 )
                 return True
             except asyncpg.UniqueViolationError:
                 return False  # Такой код уже существует
 
+    async def create_promo_codes_bulk(self, codes: list[str], admin_telegram_id: int, value: float = 750,
+                                      usage_limit: int = 1) -> list[str]:
+        """
+        Создает пачку промокодов одним COPY во временную таблицу и одним INSERT ... SELECT из нее.
+        Коды, которые уже есть в promo_codes (или повторяются в пачке), пропускаются.
+        Возвращает коды, которые реально создались.
+        """
+        # promo_codes.admin_telegram_id ссылается на users.telegram_id — строка админа должна уже быть в БД
+        await self._flush_pending_users(admin_telegram_id)
+        async with self.pool.acquire() as conn:
+            async with conn.transaction():
+                await conn.execute("CREATE TEMP TABLE promo_staging (code VARCHAR(50)) ON COMMIT DROP")
+                await conn.copy_records_to_table("promo_staging", records=[(code,) for code in codes],
+                                                 columns=["code"])
+                rows = await conn.fetch(
+                    """
+                    INSERT INTO promo_codes (code, admin_telegram_id, value, usage_limit)
+                    SELECT DISTINCT code, $1::bigint, $2::numeric, $3::integer
+                    FROM promo_staging
+                    ON CONFLICT (code) DO NOTHING
+                    RETURNING code
+                    """,
+                    admin_telegram_id, value, usage_limit
+                )
+                return [row['code'] for row in rows]
+
     async def get_promo_code(self, code: str):
-        """Возвращает данные о промокоде."""
+        """Возвращает данные о промокоде; used_count — сколько слотов занято в promo_redemptions."""
         async with self.pool.acquire() as conn:
-            return await conn.fetchrow("SELECT * FROM promo_codes WHERE code = $1", code)
+            return await conn.fetchrow(
+                """
+                SELECT p.*, (SELECT COUNT(*) FROM promo_redemptions r WHERE r.promo_code_id = p.id) AS used_count
+                FROM promo_codes p
+                WHERE p.code = $1
+                """,
+                code
+            )
 
     async def get_promo_value(self, code: str) -> float | None:
         """Возвращает номинал (value) для указанного промокода."""
@@ -353,119 +800,176 @@ class Database:
             )
             return amount if amount is not None else 0.0
 
-    async def export_users_csv(self) -> str:
+    async def get_dashboard_stats(self) -> asyncpg.Record:
         """
-        Экспортирует данные по всем пользователям и количеству их активных билетов в CSV файл.
+        Возвращает все цифры для /stats_info одним запросом:
+        total_users, total_sales_amount, active_tickets, used_tickets.
         """
-        filename = f"stats_exports/users_{datetime.now().strftime('%Y%m%d_%H%M%S')}.csv"
-        os.makedirs("stats_exports", exist_ok=True)
-
         async with self.pool.acquire() as conn:
-            data = await conn.fetch("""
+            return await conn.fetchrow("""
                 SELECT
-                    u.id,
-                    u.telegram_id,
-                    u.username,
-                    u.name, 
-                    u.created_at,
-                    COUNT(t.id) FILTER (WHERE t.status = 'active') AS active_tickets_count
-                FROM users u
-                LEFT JOIN tickets t ON u.telegram_id = t.owner_telegram_id
-                GROUP BY u.id, u.telegram_id, u.username, u.name, u.created_at
-                ORDER BY u.id;
+                    (SELECT COUNT(*) FROM users) AS total_users,
+                    (SELECT COALESCE(SUM(amount), 0) FROM transactions WHERE status = 'approved')
+                        AS total_sales_amount,
+                    t.active_tickets,
+                    t.used_tickets
+                FROM (
+                    SELECT
+                        COUNT(*) FILTER (WHERE status = 'active') AS active_tickets,
+                        COUNT(*) FILTER (WHERE status = 'used') AS used_tickets
+                    FROM tickets
+                ) t;
             """)
 
-        # Добавляем 'name' в заголовок
+    async def _export_csv(self, name: str, query: str, headers: list[str], format_row, *args) -> list[str]:
+        """
+        Потоково выгружает результат запроса в CSV.
+        Строки читаются серверным курсором чанками по EXPORT_CHUNK_ROWS, каждый чанк
+        форматируется и пишется на диск в отдельном потоке, так что ни таблица целиком
+        в память не попадает, ни event loop не блокируется. Большие выгрузки режутся на части.
+        Возвращает список путей к файлам (частям выгрузки).
+        """
+        os.makedirs(EXPORT_DIR, exist_ok=True)
+        writer = CsvPartWriter(f"{EXPORT_DIR}/{name}_{datetime.now().strftime('%Y%m%d_%H%M%S')}", headers)
+        try:
+            async with self.pool.acquire() as conn:
+                async with conn.transaction():  # курсоры в asyncpg живут только внутри транзакции
+                    cursor = await conn.cursor(query, *args)
+                    while rows := await cursor.fetch(EXPORT_CHUNK_ROWS):
+                        await asyncio.to_thread(writer.write_rows, [format_row(row) for row in rows])
+            return await asyncio.to_thread(writer.close)
+        except BaseException:
+            await asyncio.to_thread(writer.abort)
+            raise
+
+    async def export_users_csv(self) -> list[str]:
+        """
+        Экспортирует данные по всем пользователям и количеству их активных билетов в CSV.
+        """
+        query = """
+            SELECT
+                u.id,
+                u.telegram_id,
+                u.username,
+                u.name, 
+                u.created_at,
+                COUNT(t.id) FILTER (WHERE t.status = 'active') AS active_tickets_count
+            FROM users u
+            LEFT JOIN tickets t ON u.telegram_id = t.owner_telegram_id
+            GROUP BY u.id, u.telegram_id, u.username, u.name, u.created_at
+            ORDER BY u.id;
+        """
         headers = ["id", "telegram_id", "username", "name", "registration_date", "active_tickets_count"]
+        return await self._export_csv("users", query, headers, _format_user_row)
 
-        with open(filename, "w", newline="", encoding="utf-8") as f:
-            writer = csv.writer(f)
-            writer.writerow(headers)  # заголовки
-            for row in data:
-                writer.writerow([
-                    row['id'],
-                    row['telegram_id'],
-                    row['username'] if row['username'] else '',
-                    row['name'] if row['name'] else '',
-                    row['created_at'].strftime('%Y-%m-%d %H:%M:%S') if row['created_at'] else '',
-                    row['active_tickets_count']
-                ])
-
-        return filename
-
-    async def export_transactions_csv(self) -> str:
+    async def export_transactions_csv(self) -> list[str]:
         """
-        Экспортирует данные по всем транзакциям в CSV-файл.
+        Экспортирует данные по всем транзакциям в CSV.
+        """
+        query = """
+            SELECT
+                id,
+                user_telegram_id,
+                quantity,
+                amount,
+                status,
+                created_at
+            FROM transactions
+            ORDER BY created_at DESC;
         """
-        filename = f"stats_exports/transactions_{datetime.now().strftime('%Y%m%d_%H%M%S')}.csv"
-        os.makedirs("stats_exports", exist_ok=True)
-
-        async with self.pool.acquire() as conn:
-            records = await conn.fetch("""
-                SELECT
-                    id,
-                    user_telegram_id,
-                    quantity,
-                    amount,
-                    status,
-                    created_at
-                FROM transactions
-                ORDER BY created_at DESC;
-            """)
-
         headers = ["id", "user_telegram_id", "quantity", "amount", "status", "created_at"]
+        return await self._export_csv("transactions", query, headers, _format_transaction_row)
 
-        with open(filename, "w", newline="", encoding="utf-8") as f:
-            writer = csv.writer(f)
-            writer.writerow(headers)
-            for row in records:
-                writer.writerow([
-                    row["id"],
-                    row["user_telegram_id"],
-                    row["quantity"],
-                    float(row["amount"]),  # чтобы всегда было число
-                    row["status"],
-                    row["created_at"].strftime("%Y-%m-%d %H:%M:%S") if row["created_at"] else ""
-                ])
-
-        return filename
-
-    async def export_tickets_csv(self) -> str:
+    async def export_tickets_csv(self) -> list[str]:
         """
-        Экспортирует данные по всем билетам в CSV-файл.
+        Экспортирует данные по всем билетам в CSV.
         """
-        filename = f"stats_exports/tickets_{datetime.now().strftime('%Y%m%d_%H%M%S')}.csv"
-        os.makedirs("stats_exports", exist_ok=True)
+        query = """
+            SELECT
+                id,
+                token,
+                owner_telegram_id,
+                transaction_id,
+                status,
+                created_at
+            FROM tickets
+            ORDER BY created_at DESC;
+        """
+        headers = ["id", "token", "owner_telegram_id", "transaction_id", "status", "created_at"]
+        return await self._export_csv("tickets", query, headers, _format_ticket_row)
 
+    # --- Инкрементальные выгрузки ---
+
+    async def get_export_watermark(self, admin_telegram_id: int, export_type: str) -> asyncpg.Record | None:
+        """Возвращает отметку (last_created_at, last_id) последней выгрузки админа или None."""
         async with self.pool.acquire() as conn:
-            records = await conn.fetch("""
-                SELECT
-                    id,
-                    token,
-                    owner_telegram_id,
-                    transaction_id,
-                    status,
-                    created_at
-                FROM tickets
-                ORDER BY created_at DESC;
-            """)
+            return await conn.fetchrow(
+                "SELECT last_created_at, last_id FROM export_watermarks "
+                "WHERE admin_telegram_id = $1 AND export_type = $2",
+                admin_telegram_id, export_type
+            )
 
-        headers = ["id", "token", "owner_telegram_id", "transaction_id", "status", "created_at"]
+    async def set_export_watermark(self, admin_telegram_id: int, export_type: str,
+                                   last_created_at: datetime, last_id: int):
+        """Сохраняет отметку выгрузки. Вызывать только после того, как файл дошел до админа."""
+        async with self.pool.acquire() as conn:
+            await conn.execute(
+                """
+                INSERT INTO export_watermarks (admin_telegram_id, export_type, last_created_at, last_id)
+                VALUES ($1, $2, $3, $4)
+                ON CONFLICT (admin_telegram_id, export_type) DO UPDATE SET
+                    last_created_at = EXCLUDED.last_created_at,
+                    last_id = EXCLUDED.last_id,
+                    updated_at = CURRENT_TIMESTAMP;
+                """,
+                admin_telegram_id, export_type, last_created_at, last_id
+            )
 
-        with open(filename, "w", newline="", encoding="utf-8") as f:
-            writer = csv.writer(f)
-            writer.writerow(headers)
-            for row in records:
-                writer.writerow([
-                    row["id"],
-                    row["token"],
-                    row["owner_telegram_id"],
-                    row["transaction_id"],
-                    row["status"],
-                    row["created_at"].strftime("%Y-%m-%d %H:%M:%S") if row["created_at"] else ""
-                ])
-
-        return filename
+    async def _export_delta(self, table: str, columns: list[str], format_row,
+                            admin_telegram_id: int) -> tuple[list[str], tuple[datetime, int] | None]:
+        """
+        Выгружает только строки, появившиеся после прошлой отметки админа: (created_at, id) > отметки.
+        Фильтр начинается с created_at >= $1, поэтому работает по индексу на created_at.
+        Меняется только состав строк — смена статуса у уже выгруженных строк сюда не попадает.
+        Возвращает пути к файлам и новую отметку; если новых строк нет — ([], None).
+        Отметку сохраняет вызывающий, после успешной отправки (set_export_watermark).
+        """
+        mark = await self.get_export_watermark(admin_telegram_id, table)
+        since_at, since_id = (mark['last_created_at'], mark['last_id']) if mark else (
+            datetime(1970, 1, 1, tzinfo=timezone.utc), 0)
+
+        query = f"""
+            SELECT {", ".join(columns)}
+            FROM {table}
+            WHERE created_at >= $1
+              AND (created_at > $1 OR id > $2)
+              AND created_at < now() - make_interval(secs => $3)
+            ORDER BY created_at, id;
+        """
+        last_row = None
+
+        def track_row(row):
+            nonlocal last_row
+            last_row = row
+            return format_row(row)
+
+        paths = await self._export_csv(f"{table}_delta", query, columns, track_row,
+                                       since_at, since_id, DELTA_SETTLE_SECONDS)
+        if last_row is None:
+            for path in paths:
+                os.remove(path)
+            return [], None
+        return paths, (last_row['created_at'], last_row['id'])
+
+    async def export_transactions_delta(self, admin_telegram_id: int):
+        """Новые транзакции с прошлой инкрементальной выгрузки админа."""
+        columns = ["id", "user_telegram_id", "quantity", "amount", "status", "created_at"]
+        return await self._export_delta("transactions", columns, _format_transaction_row, admin_telegram_id)
+
+    async def export_tickets_delta(self, admin_telegram_id: int):
+        """Новые билеты с прошлой инкрементальной выгрузки админа."""
+        columns = ["id", "token", "owner_telegram_id", "transaction_id", "status", "created_at"]
+        return await self._export_delta("tickets", columns, _format_ticket_row, admin_telegram_id)
 
     async def get_ticket_owners(self) -> list[str]:
         """
@@ -0,0 +1,103 @@
+import csv
+import gzip
+import io
+import os
+import zlib
+
+# настройки выгрузок (можно переопределить в .env)
+EXPORT_DIR = "stats_exports"
+EXPORT_CHUNK_ROWS = int(os.getenv("EXPORT_CHUNK_ROWS", 5000))
+EXPORT_GZIP = os.getenv("EXPORT_GZIP", "0") == "1"
+# telegram не примет от бота документ больше 50 МБ, оставляем запас
+EXPORT_PART_MAX_BYTES = int(os.getenv("EXPORT_PART_MAX_BYTES", 45 * 1024 * 1024))
+# общий потолок на одну выгрузку, чтобы случайно не забить диск
+EXPORT_MAX_BYTES = int(os.getenv("EXPORT_MAX_BYTES", 500 * 1024 * 1024))
+# инкрементальные выгрузки не берут строки моложе этого порога: created_at ставится в начале
+# транзакции, и строка, закоммиченная чуть позже, иначе могла бы оказаться ниже отметки
+DELTA_SETTLE_SECONDS = int(os.getenv("EXPORT_DELTA_SETTLE_SECONDS", 10))
+
+
+class ExportTooLarge(RuntimeError):
+    """Выгрузка превысила EXPORT_MAX_BYTES и была прервана."""
+
+
+class CsvPartWriter:
+    """
+    Синхронный писатель CSV, который сам режет выгрузку на части.
+    Когда текущий файл дорастает до part_max_bytes, следующий чанк пишется в новую часть
+    (со своим заголовком). Размер проверяется после каждого чанка, так что часть может
+    превысить лимит не больше чем на один чанк. Методы блокирующие — вызывать через asyncio.to_thread.
+    """
+
+    def __init__(
+            self,
+            base_path: str,
+            headers: list[str],
+            compress: bool = EXPORT_GZIP,
+            part_max_bytes: int = EXPORT_PART_MAX_BYTES,
+            max_bytes: int = EXPORT_MAX_BYTES,
+    ):
+        self.base_path = base_path
+        self.headers = headers
+        self.compress = compress
+        self.part_max_bytes = part_max_bytes
+        self.max_bytes = max_bytes
+        self.paths: list[str] = []
+        self._written_before = 0  # байты в уже закрытых частях
+        self._raw = None
+        self._gz = None
+        self._text = None
+        self._writer = None
+
+    def _part_path(self, index: int) -> str:
+        suffix = "" if index == 1 else f"_part{index}"
+        return f"{self.base_path}{suffix}.csv" + (".gz" if self.compress else "")
+
+    def _open_part(self):
+        path = self._part_path(len(self.paths) + 1)
+        self._raw = open(path, "wb")
+        self._gz = gzip.GzipFile(fileobj=self._raw, mode="wb") if self.compress else None
+        self._text = io.TextIOWrapper(self._gz or self._raw, encoding="utf-8", newline="")
+        self._writer = csv.writer(self._text)
+        self._writer.writerow(self.headers)
+        self.paths.append(path)
+
+    def _close_part(self):
+        if self._text:
+            self._text.close()
+            self._raw.close()  # GzipFile не закрывает чужой fileobj сам
+            self._written_before += os.path.getsize(self.paths[-1])
+            self._raw = self._gz = self._text = self._writer = None
+
+    def write_rows(self, rows: list[list]):
+        if self._writer is None:
+            self._open_part()
+        self._writer.writerows(rows)
+        self._text.flush()
+        if self._gz:
+            # иначе сжатые данные сидят в буфере компрессора и _raw.tell() занижает размер части
+            self._gz.flush(zlib.Z_SYNC_FLUSH)
+
+        part_size = self._raw.tell()
+        if self._written_before + part_size > self.max_bytes:
+            self.abort()
+            raise ExportTooLarge(f"Выгрузка больше {self.max_bytes} байт, прервана.")
+        if part_size >= self.part_max_bytes:
+            self._close_part()
+
+    def close(self) -> list[str]:
+        """Закрывает текущую часть и возвращает пути ко всем частям."""
+        if not self.paths:
+            self._open_part()  # пустая выгрузка — файл только с заголовком
+        self._close_part()
+        return self.paths
+
+    def abort(self):
+        """Закрывает и удаляет все записанные части."""
+        self._close_part()
+        for path in self.paths:
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+        self.paths = []
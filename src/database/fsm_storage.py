@@ -0,0 +1,134 @@
+import json
+from contextlib import asynccontextmanager
+from contextvars import ContextVar
+from decimal import Decimal
+from typing import Any, Dict, Optional
+
+from aiogram.fsm.state import State
+from aiogram.fsm.storage.base import BaseStorage, DefaultKeyBuilder, KeyBuilder, StateType, StorageKey
+
+
+def _json_default(value):
+    # суммы с промокодом приходят из NUMERIC как Decimal
+    if isinstance(value, Decimal):
+        return float(value)
+    raise TypeError(f"Значение типа {type(value).__name__} нельзя сохранить в FSM")
+
+
+class _Record:
+    __slots__ = ("state", "data")
+
+    def __init__(self, state: Optional[str], data: Dict[str, Any]):
+        self.state = state
+        self.data = data
+
+
+class _UpdateScope:
+    """Записи FSM, прочитанные и измененные за время обработки одного апдейта."""
+
+    def __init__(self):
+        self.records: dict[str, _Record] = {}
+        self.dirty: set[str] = set()
+        self.closed = False
+
+
+_current_scope: ContextVar[Optional[_UpdateScope]] = ContextVar("fsm_update_scope", default=None)
+
+
+class PostgresStorage(BaseStorage):
+    """
+    Хранилище FSM в таблице fsm_states, чтобы состояние покупки переживало перезапуск
+    и было общим для нескольких экземпляров бота.
+    Внутри update_scope() каждая запись читается из БД один раз, повторные get_state/get_data
+    берутся из памяти, а изменения пишутся одним запросом на ключ при выходе из scope.
+    Вне scope (например, в фоновой задаче после ответа) чтение и запись идут сразу в БД.
+    Данные хранятся в jsonb, поэтому в FSM можно класть только то, что сериализуется в JSON.
+    """
+
+    def __init__(self, db, key_builder: Optional[KeyBuilder] = None):
+        self.db = db
+        self.key_builder = key_builder or DefaultKeyBuilder(with_bot_id=True)
+
+    @asynccontextmanager
+    async def update_scope(self):
+        """Кэширует чтения и откладывает запись до конца обработки апдейта."""
+        scope = _UpdateScope()
+        token = _current_scope.set(scope)
+        try:
+            yield
+        finally:
+            # задачи, созданные внутри апдейта, унаследовали scope — дальше они пишут напрямую
+            scope.closed = True
+            _current_scope.reset(token)
+            await self._flush(scope)
+
+    def _scope(self) -> Optional[_UpdateScope]:
+        scope = _current_scope.get()
+        return scope if scope is not None and not scope.closed else None
+
+    async def _load(self, key: str) -> _Record:
+        row = await self.db.pool.fetchrow("SELECT state, data FROM fsm_states WHERE key = $1", key)
+        if row is None:
+            return _Record(None, {})
+        return _Record(row['state'], json.loads(row['data']))
+
+    async def _get_record(self, key: str, scope: Optional[_UpdateScope]) -> _Record:
+        if scope is None:
+            return await self._load(key)
+        record = scope.records.get(key)
+        if record is None:
+            record = scope.records[key] = await self._load(key)
+        return record
+
+    async def _save(self, key: str, record: _Record):
+        # пустое состояние (после state.clear()) не храним
+        if record.state is None and not record.data:
+            await self.db.pool.execute("DELETE FROM fsm_states WHERE key = $1", key)
+            return
+        await self.db.pool.execute(
+            """
+            INSERT INTO fsm_states (key, state, data, updated_at)
+            VALUES ($1, $2, $3::jsonb, CURRENT_TIMESTAMP)
+            ON CONFLICT (key) DO UPDATE
+                SET state      = EXCLUDED.state,
+                    data       = EXCLUDED.data,
+                    updated_at = EXCLUDED.updated_at
+            """,
+            key, record.state, json.dumps(record.data, ensure_ascii=False, default=_json_default),
+        )
+
+    async def _changed(self, key: str, record: _Record, scope: Optional[_UpdateScope]):
+        if scope is None:
+            await self._save(key, record)
+        else:
+            scope.dirty.add(key)
+
+    async def _flush(self, scope: _UpdateScope):
+        for key in scope.dirty:
+            await self._save(key, scope.records[key])
+        scope.dirty.clear()
+
+    async def set_state(self, key: StorageKey, state: StateType = None) -> None:
+        storage_key = self.key_builder.build(key)
+        scope = self._scope()
+        record = await self._get_record(storage_key, scope)
+        record.state = state.state if isinstance(state, State) else state
+        await self._changed(storage_key, record, scope)
+
+    async def get_state(self, key: StorageKey) -> Optional[str]:
+        storage_key = self.key_builder.build(key)
+        return (await self._get_record(storage_key, self._scope())).state
+
+    async def set_data(self, key: StorageKey, data: Dict[str, Any]) -> None:
+        storage_key = self.key_builder.build(key)
+        scope = self._scope()
+        record = await self._get_record(storage_key, scope)
+        record.data = data.copy()
+        await self._changed(storage_key, record, scope)
+
+    async def get_data(self, key: StorageKey) -> Dict[str, Any]:
+        storage_key = self.key_builder.build(key)
+        return (await self._get_record(storage_key, self._scope())).data.copy()
+
+    async def close(self) -> None:
+        pass  # пулом владеет Database
@@ -0,0 +1,254 @@
+import functools
+import inspect
+import os
+import re
+import time
+from contextvars import ContextVar
+
+# запросы дольше этого порога попадают в список медленных (можно переопределить в .env)
+DB_SLOW_QUERY_MS = float(os.getenv("DB_SLOW_QUERY_MS", 200))
+DB_INSTRUMENTATION = os.getenv("DB_INSTRUMENTATION", "1") == "1"
+# сколько разных медленных запросов помним
+SLOW_QUERIES_KEEP = 50
+
+# какой метод Database сейчас выполняется; запросы вне методов (fsm, /ready) попадают в "other"
+_current_method: ContextVar[str] = ContextVar("db_method", default="other")
+
+
+def _normalize_sql(query: str) -> str:
+    return re.sub(r"\s+", " ", query).strip()
+
+
+class MethodStats:
+    __slots__ = ("calls", "errors", "queries", "query_total", "query_max", "wait_total", "wait_max")
+
+    def __init__(self):
+        self.calls = self.errors = self.queries = 0
+        self.query_total = self.query_max = self.wait_total = self.wait_max = 0.0
+
+
+class DbInstrumentation:
+    """
+    Счетчики по методам Database: время ожидания соединения из пула, время запросов, ошибки
+    и медленные запросы с их SQL. Каждое измерение — пара perf_counter и сложение в словаре,
+    так что слой можно держать включенным в проде.
+    Если передан реестр metrics, те же измерения уходят в его гистограммы.
+    """
+
+    def __init__(self, metrics=None, slow_query_ms: float = DB_SLOW_QUERY_MS):
+        self.metrics = metrics
+        self.slow_query_s = slow_query_ms / 1000
+        self.methods: dict[str, MethodStats] = {}
+        # нормализованный SQL -> [сколько раз, суммарно секунд, максимум секунд, метод]
+        self.slow_queries: dict[str, list] = {}
+        self.pool = None
+        # если задан (bot.utils.tracing.Tracer), каждый запрос еще и пишется спаном в трассу апдейта
+        self.tracer = None
+
+    def _stats(self, method: str) -> MethodStats:
+        stats = self.methods.get(method)
+        if stats is None:
+            stats = self.methods[method] = MethodStats()
+        return stats
+
+    def record_wait(self, seconds: float):
+        method = _current_method.get()
+        stats = self._stats(method)
+        stats.wait_total += seconds
+        stats.wait_max = max(stats.wait_max, seconds)
+        if self.metrics:
+            self.metrics.observe("db_pool_acquire_seconds", seconds, method=method)
+
+    def record_query(self, query: str, seconds: float, failed: bool):
+        method = _current_method.get()
+        stats = self._stats(method)
+        stats.queries += 1
+        stats.query_total += seconds
+        stats.query_max = max(stats.query_max, seconds)
+        if failed:
+            stats.errors += 1
+        if self.metrics:
+            self.metrics.observe("db_query_seconds", seconds, method=method)
+            if failed:
+                self.metrics.inc("db_query_errors_total", method=method)
+        if seconds >= self.slow_query_s:
+            self._record_slow(query, seconds, method)
+
+    def _record_slow(self, query: str, seconds: float, method: str):
+        sql = _normalize_sql(query)
+        entry = self.slow_queries.get(sql)
+        if entry is None:
+            if len(self.slow_queries) >= SLOW_QUERIES_KEEP:
+                # вытесняем самый редкий
+                del self.slow_queries[min(self.slow_queries, key=lambda k: self.slow_queries[k][0])]
+            entry = self.slow_queries[sql] = [0, 0.0, 0.0, method]
+        entry[0] += 1
+        entry[1] += seconds
+        entry[2] = max(entry[2], seconds)
+        if self.metrics:
+            self.metrics.inc("db_slow_queries_total", method=method)
+
+    def report(self, top: int = 10) -> str:
+        """Текстовая сводка для /debug_db: пул, самые тяжелые методы и медленные запросы."""
+        pool = self.pool_gauges()
+        lines = [f"pool: size={pool['size']} idle={pool['idle']} in_use={pool['in_use']} max={pool['max']}", ""]
+        lines.append(f"{'метод':28} {'вызовы':>7} {'запросы':>8} {'ошибки':>6} "
+                     f"{'q avg':>7} {'q max':>7} {'wait max':>8}")
+        heaviest = sorted(self.methods.items(), key=lambda item: item[1].query_total, reverse=True)[:top]
+        for name, stats in heaviest:
+            avg = stats.query_total / stats.queries * 1000 if stats.queries else 0
+            lines.append(f"{name[:28]:28} {stats.calls:>7} {stats.queries:>8} {stats.errors:>6} "
+                         f"{avg:>7.1f} {stats.query_max * 1000:>7.1f} {stats.wait_max * 1000:>8.1f}")
+        lines.append("")
+        lines.append(f"медленные запросы (>= {self.slow_query_s * 1000:.0f} мс):")
+        slowest = sorted(self.slow_queries.items(), key=lambda item: item[1][1], reverse=True)[:top]
+        for sql, (count, total, longest, method) in slowest:
+            lines.append(f"{count}x max {longest * 1000:.0f} мс [{method}] {sql[:200]}")
+        if not slowest:
+            lines.append("нет")
+        return "\n".join(lines)
+
+    def pool_gauges(self) -> dict:
+        if self.pool is None:
+            return {"size": 0, "idle": 0, "in_use": 0, "max": 0}
+        size, idle = self.pool.get_size(), self.pool.get_idle_size()
+        return {"size": size, "idle": idle, "in_use": size - idle, "max": self.pool.get_max_size()}
+
+
+class _ConnectionProxy:
+    """Соединение, у которого запросы замеряются; все остальное (transaction, cursor) — как есть."""
+
+    def __init__(self, conn, instrumentation: DbInstrumentation):
+        self._conn = conn
+        self._instrumentation = instrumentation
+
+    def __getattr__(self, name):
+        return getattr(self._conn, name)
+
+    async def _timed(self, method, query, *args, **kwargs):
+        tracer = self._instrumentation.tracer
+        started_ns = time.time_ns() if tracer else 0
+        started = time.perf_counter()
+        failed = True
+        try:
+            result = await method(query, *args, **kwargs)
+            failed = False
+            return result
+        finally:
+            self._instrumentation.record_query(query, time.perf_counter() - started, failed)
+            if tracer:
+                tracer.add_span(f"db {_current_method.get()}", started_ns, failed,
+                                method=_current_method.get(), sql=_normalize_sql(query)[:500])
+
+    async def execute(self, query, *args, **kwargs):
+        return await self._timed(self._conn.execute, query, *args, **kwargs)
+
+    async def executemany(self, query, *args, **kwargs):
+        return await self._timed(self._conn.executemany, query, *args, **kwargs)
+
+    async def fetch(self, query, *args, **kwargs):
+        return await self._timed(self._conn.fetch, query, *args, **kwargs)
+
+    async def fetchrow(self, query, *args, **kwargs):
+        return await self._timed(self._conn.fetchrow, query, *args, **kwargs)
+
+    async def fetchval(self, query, *args, **kwargs):
+        return await self._timed(self._conn.fetchval, query, *args, **kwargs)
+
+    async def copy_records_to_table(self, table_name, **kwargs):
+        return await self._timed(self._conn.copy_records_to_table, table_name, **kwargs)
+
+
+class _AcquireContext:
+    def __init__(self, pool, instrumentation: DbInstrumentation, timeout=None):
+        self._ctx = pool.acquire(timeout=timeout)
+        self._instrumentation = instrumentation
+
+    async def __aenter__(self):
+        started = time.perf_counter()
+        conn = await self._ctx.__aenter__()
+        self._instrumentation.record_wait(time.perf_counter() - started)
+        return _ConnectionProxy(conn, self._instrumentation)
+
+    async def __aexit__(self, *exc):
+        return await self._ctx.__aexit__(*exc)
+
+    def __await__(self):
+        return self.__aenter__().__await__()
+
+
+class InstrumentedPool:
+    """Обертка над asyncpg.Pool: замеряет ожидание соединения и запросы, остальное проксирует."""
+
+    def __init__(self, pool, instrumentation: DbInstrumentation):
+        self._pool = pool
+        self._instrumentation = instrumentation
+
+    def __getattr__(self, name):
+        return getattr(self._pool, name)
+
+    def acquire(self, *, timeout=None):
+        return _AcquireContext(self._pool, self._instrumentation, timeout)
+
+    async def release(self, connection, *, timeout=None):
+        if isinstance(connection, _ConnectionProxy):
+            connection = connection._conn
+        return await self._pool.release(connection, timeout=timeout)
+
+    async def execute(self, query, *args, timeout=None):
+        async with self.acquire() as conn:
+            return await conn.execute(query, *args, timeout=timeout)
+
+    async def executemany(self, query, args, *, timeout=None):
+        async with self.acquire() as conn:
+            return await conn.executemany(query, args, timeout=timeout)
+
+    async def fetch(self, query, *args, timeout=None, record_class=None):
+        async with self.acquire() as conn:
+            return await conn.fetch(query, *args, timeout=timeout, record_class=record_class)
+
+    async def fetchrow(self, query, *args, timeout=None, record_class=None):
+        async with self.acquire() as conn:
+            return await conn.fetchrow(query, *args, timeout=timeout, record_class=record_class)
+
+    async def fetchval(self, query, *args, column=0, timeout=None):
+        async with self.acquire() as conn:
+            return await conn.fetchval(query, *args, column=column, timeout=timeout)
+
+
+def _wrap_method(name: str, method, instrumentation: DbInstrumentation):
+    @functools.wraps(method)
+    async def wrapper(*args, **kwargs):
+        # вложенные вызовы (create_transaction -> _flush_pending_users) считаем за внешний метод
+        if _current_method.get() != "other":
+            return await method(*args, **kwargs)
+        token = _current_method.set(name)
+        instrumentation._stats(name).calls += 1
+        try:
+            return await method(*args, **kwargs)
+        finally:
+            _current_method.reset(token)
+
+    return wrapper
+
+
+def instrument_database(db, metrics=None) -> DbInstrumentation:
+    """
+    Подключает замеры к уже подключенному Database: подменяет db.pool и оборачивает
+    его корутины, чтобы запросы подписывались именем метода. Возвращает собранную статистику.
+    """
+    instrumentation = DbInstrumentation(metrics)
+    instrumentation.pool = db.pool
+    db.pool = InstrumentedPool(db.pool, instrumentation)
+    for name, method in inspect.getmembers(db, inspect.iscoroutinefunction):
+        if name in ("connect", "close"):
+            continue
+        setattr(db, name, _wrap_method(name.lstrip("_"), method, instrumentation))
+    if metrics:
+        metrics.describe("db_pool_acquire_seconds", "Ожидание соединения из пула по методам Database")
+        metrics.describe("db_query_seconds", "Время запросов по методам Database")
+        metrics.describe("db_query_errors_total", "Запросы, завершившиеся ошибкой")
+        metrics.describe("db_slow_queries_total", f"Запросы дольше {DB_SLOW_QUERY_MS} мс")
+        for key in ("size", "idle", "in_use", "max"):
+            metrics.gauge_fn(f"db_pool_{key}", lambda key=key: instrumentation.pool_gauges()[key])
+    return instrumentation
@@ -0,0 +1,66 @@
+import asyncio
+import os
+import time
+from decimal import Decimal
+from typing import NamedTuple
+
+# сколько секунд отдаем один и тот же ответ по промокоду (можно переопределить в .env)
+PROMO_CACHE_TTL = float(os.getenv("PROMO_CACHE_TTL", 5))
+PROMO_CACHE_SIZE = 10000
+
+
+class PromoInfo(NamedTuple):
+    id: int
+    value: Decimal  # NUMERIC из asyncpg
+    usage_limit: int
+    used_count: int
+
+    @property
+    def available(self) -> bool:
+        return self.used_count < self.usage_limit
+
+
+class PromoCache:
+    """
+    Кэш промокодов для проверки при вводе (check_promo_code).
+    Когда на старте продаж сотни людей вводят один и тот же партнерский промокод, в БД уходит
+    один запрос на код раз в ttl секунд: остальные получают тот же ответ, а параллельные промахи
+    по одному коду ждут блокировку и берут результат первого.
+    Несуществующие коды тоже кэшируются (None), чтобы перебор не шел в БД; создающие промокоды команды
+    сбрасывают их через invalidate (на других экземплярах бота промах живет не дольше ttl).
+    Остаток здесь приблизительный — лимит строго соблюдается при создании транзакции (promo_redemptions).
+    """
+
+    def __init__(self, db, ttl: float = PROMO_CACHE_TTL, max_size: int = PROMO_CACHE_SIZE):
+        self.db = db
+        self.ttl = ttl
+        self.max_size = max_size
+        self._entries: dict[str, tuple[float, PromoInfo | None]] = {}  # код -> (когда протухнет, данные)
+        self._locks: dict[str, asyncio.Lock] = {}
+
+    async def get(self, code: str) -> PromoInfo | None:
+        entry = self._entries.get(code)
+        if entry and time.monotonic() < entry[0]:
+            return entry[1]
+
+        lock = self._locks.setdefault(code, asyncio.Lock())
+        try:
+            async with lock:
+                # пока ждали блокировку, код мог загрузить другой запрос
+                entry = self._entries.get(code)
+                if entry and time.monotonic() < entry[0]:
+                    return entry[1]
+                row = await self.db.get_promo_code(code)
+                info = PromoInfo(row['id'], row['value'], row['usage_limit'], row['used_count']) if row else None
+                self._entries.pop(code, None)
+                if len(self._entries) >= self.max_size:
+                    # самый старый по вставке — первый в словаре
+                    self._entries.pop(next(iter(self._entries)))
+                self._entries[code] = (time.monotonic() + self.ttl, info)
+                return info
+        finally:
+            if not lock.locked():
+                self._locks.pop(code, None)
+
+    def invalidate(self, code: str):
+        self._entries.pop(code, None)
@@ -0,0 +1,193 @@
+import asyncio
+import io
+import json
+import logging
+import os
+
+from PIL import Image
+
+# сколько различающихся бит из 64 еще считаем тем же скрином (можно переопределить в .env)
+PROOF_PHASH_DISTANCE = int(os.getenv("PROOF_PHASH_DISTANCE", 6))
+NOTIFY_CHANNEL = "proof_hash"
+# через сколько секунд переподключаться, если соединение LISTEN оборвалось
+PROOF_INDEX_RECONNECT = 5
+
+_SIGN_BIT = 1 << 63
+
+
+def dhash(data: bytes) -> int:
+    """
+    Перцептивный хэш картинки (difference hash, 64 бита): переживает пересжатие, смену размера
+    и мелкие правки, но не обрезку. Блокирующая функция — вызывать в потоке.
+    """
+    with Image.open(io.BytesIO(data)) as image:
+        image.draft("L", (64, 64))  # для jpeg декодируем сразу в уменьшенном виде
+        pixels = list(image.convert("L").resize((9, 8), Image.Resampling.LANCZOS).getdata())
+    value = 0
+    for row in range(8):
+        for col in range(8):
+            value = (value << 1) | (pixels[row * 9 + col] > pixels[row * 9 + col + 1])
+    return value
+
+
+def to_bigint(value: int) -> int:
+    """64-битный хэш -> знаковое число для колонки BIGINT."""
+    return value - (1 << 64) if value & _SIGN_BIT else value
+
+
+def from_bigint(value: int) -> int:
+    return value + (1 << 64) if value < 0 else value
+
+
+class HammingIndex:
+    """
+    Поиск 64-битных хэшей на расстоянии Хэмминга не больше max_distance (multi-index hashing).
+    Хэш режется на max_distance + 1 кусков: у двух хэшей с расстоянием <= max_distance хотя бы один кусок
+    совпадает целиком (принцип Дирихле). Поэтому кандидаты берутся из словарей по кускам,
+    а bit_count считается только для них, а не для всех хэшей.
+    """
+
+    def __init__(self, max_distance: int):
+        self.max_distance = max_distance
+        parts = max_distance + 1
+        widths = [64 // parts + (i < 64 % parts) for i in range(parts)]
+        self._slices = []  # (сдвиг, маска)
+        shift = 0
+        for width in widths:
+            self._slices.append((shift, (1 << width) - 1))
+            shift += width
+        self._tables: list[dict[int, list[int]]] = [{} for _ in widths]
+        self._keys: list[int] = []
+        self._values: list = []
+
+    def __len__(self) -> int:
+        return len(self._keys)
+
+    def add(self, key: int, value):
+        position = len(self._keys)
+        self._keys.append(key)
+        self._values.append(value)
+        for table, (shift, mask) in zip(self._tables, self._slices):
+            table.setdefault((key >> shift) & mask, []).append(position)
+
+    def search(self, key: int) -> list[tuple[int, object]]:
+        """Все (расстояние, значение) с расстоянием до key не больше max_distance, ближайшие первыми."""
+        candidates = set()
+        for table, (shift, mask) in zip(self._tables, self._slices):
+            candidates.update(table.get((key >> shift) & mask, ()))
+        found = []
+        for position in candidates:
+            distance = (key ^ self._keys[position]).bit_count()
+            if distance <= self.max_distance:
+                found.append((distance, self._values[position]))
+        found.sort(key=lambda item: item[0])
+        return found
+
+
+class ProofHashIndex:
+    """
+    Перцептивные хэши всех скринов оплаты в памяти (HammingIndex), чтобы при новом скрине
+    за миллисекунды найти транзакции с похожими. Загружается из payment_proofs при старте.
+    Скрины, которые архивируют другие экземпляры бота, приходят через LISTEN proof_hash
+    (триггер notify_proof_hash в init.sql); свои архив добавляет сразу, повторы пропускаются.
+    Если соединение LISTEN оборвалось, индекс переподключается и загружается заново.
+    """
+
+    def __init__(self, db, max_distance: int = PROOF_PHASH_DISTANCE):
+        self.db = db
+        self.max_distance = max_distance
+        self._index = HammingIndex(max_distance)
+        self._seen: set[tuple[int, int]] = set()  # (хэш, транзакция), уже лежащие в индексе
+        self._conn = None
+        self._loading = False
+        self._pending: list[tuple[int, int]] = []  # уведомления, пришедшие во время загрузки
+        self._closed = False
+        self._reconnect_task: asyncio.Task | None = None
+
+    def __len__(self) -> int:
+        return len(self._index)
+
+    async def load(self) -> int:
+        """Подписывается на уведомления и загружает все хэши. Возвращает их количество."""
+        # сначала LISTEN, потом снимок: так ни один скрин не проскочит между ними
+        self._loading = True
+        self._pending = []
+        try:
+            self._conn = await self.db.listen(NOTIFY_CHANNEL, self._on_notify)
+            self._conn.add_termination_listener(self._on_terminated)
+            rows = await self.db.get_proof_hashes()
+        except Exception:
+            await self._close_conn()
+            self._loading = False
+            raise
+        index, seen = HammingIndex(self.max_distance), set()
+        for row in rows:
+            key = (from_bigint(row['phash']), row['transaction_id'])
+            if key not in seen:
+                seen.add(key)
+                index.add(*key)
+        self._index, self._seen = index, seen
+        self._loading = False
+        pending, self._pending = self._pending, []
+        for phash, transaction_id in pending:
+            self.add(phash, transaction_id)
+        logging.info(f"Индекс скринов оплаты: загружено {len(self._index)} хэшей.")
+        return len(self._index)
+
+    async def close(self):
+        self._closed = True
+        if self._reconnect_task:
+            self._reconnect_task.cancel()
+            await asyncio.gather(self._reconnect_task, return_exceptions=True)
+            self._reconnect_task = None
+        await self._close_conn()
+
+    def add(self, phash: int, transaction_id: int):
+        key = (phash, transaction_id)
+        if key not in self._seen:
+            self._seen.add(key)
+            self._index.add(phash, transaction_id)
+
+    def find(self, phash: int, exclude_transaction: int | None = None) -> list[int]:
+        """Транзакции с похожими скринами, ближайшие первыми, без повторов."""
+        result = []
+        for _, transaction_id in self._index.search(phash):
+            if transaction_id != exclude_transaction and transaction_id not in result:
+                result.append(transaction_id)
+        return result
+
+    async def _close_conn(self):
+        if self._conn is not None:
+            conn, self._conn = self._conn, None
+            try:
+                await conn.close()
+            except Exception:
+                pass
+
+    def _on_notify(self, conn, pid, channel, payload):
+        try:
+            event = json.loads(payload)
+            item = (from_bigint(int(event['phash'])), int(event['transaction_id']))
+        except (ValueError, KeyError, TypeError):
+            return
+        if self._loading:
+            self._pending.append(item)
+        else:
+            self.add(*item)
+
+    def _on_terminated(self, conn):
+        if conn is self._conn and not self._closed:
+            logging.error("Индекс скринов оплаты: соединение LISTEN оборвалось, переподключаюсь.")
+            self._conn = None
+            if not self._reconnect_task or self._reconnect_task.done():
+                self._reconnect_task = asyncio.create_task(self._reconnect())
+
+    async def _reconnect(self):
+        while not self._closed:
+            await asyncio.sleep(PROOF_INDEX_RECONNECT)
+            try:
+                # пока соединения не было, уведомления терялись — перечитываем все
+                await self.load()
+                return
+            except Exception:
+                logging.exception("Индекс скринов оплаты: не удалось переподключиться.")
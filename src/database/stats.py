@@ -0,0 +1,37 @@
+import asyncio
+import os
+import time
+from datetime import datetime
+
+# сколько секунд отдаем один и тот же снимок статистики (можно переопределить в .env)
+STATS_TTL = float(os.getenv("STATS_TTL", 30))
+
+
+class StatsService:
+    """
+    Кэш для дашборда /stats_info.
+    Все цифры считаются одним запросом (Database.get_dashboard_stats) и живут в памяти ttl секунд.
+    Если снимок протух, его пересчитывает только один запрос — остальные админы ждут тот же результат,
+    а не идут в БД параллельно.
+    """
+
+    def __init__(self, db, ttl: float = STATS_TTL):
+        self.db = db
+        self.ttl = ttl
+        self._snapshot: dict | None = None
+        self._taken_at: datetime | None = None
+        self._expires_at = 0.0
+        self._lock = asyncio.Lock()
+
+    async def get(self) -> tuple[dict, datetime]:
+        """Возвращает (статистика, когда снимок был сделан)."""
+        if self._snapshot is not None and time.monotonic() < self._expires_at:
+            return self._snapshot, self._taken_at
+
+        async with self._lock:
+            # пока ждали блокировку, снимок мог обновить другой запрос
+            if self._snapshot is None or time.monotonic() >= self._expires_at:
+                self._snapshot = dict(await self.db.get_dashboard_stats())
+                self._taken_at = datetime.now()
+                self._expires_at = time.monotonic() + self.ttl
+        return self._snapshot, self._taken_at
@@ -0,0 +1,67 @@
+import base64
+import hashlib
+import hmac
+import logging
+import os
+import re
+import secrets
+import struct
+import time
+import uuid
+
+# ключ подписи билетов; без него выпускаются старые неподписанные токены
+TICKET_SECRET = os.getenv("TICKET_SECRET", "")
+
+SIGNED_PREFIX = "s1"
+_NONCE_BYTES = 6  # 48-битный случайный номер билета
+_MAC_BYTES = 10
+_PAYLOAD = struct.Struct(">Q6s")  # owner_id + номер билета
+_SIGNED_LENGTH = len(SIGNED_PREFIX) + len(base64.urlsafe_b64encode(b"\0" * (_PAYLOAD.size + _MAC_BYTES)))
+# старый формат: f"{owner_id:x}aa{int(time.time()):x}{uuid4().hex[:6]}"
+_LEGACY_RE = re.compile(r"[0-9a-f]+aa[0-9a-f]{8}[0-9a-f]{6}")
+
+if not TICKET_SECRET:
+    logging.warning("TICKET_SECRET не задан: билеты выпускаются без подписи и проверяются только по БД.")
+
+
+class InvalidTicketToken(ValueError):
+    """Токен поддельный или поврежден — в БД за ним идти не нужно."""
+
+
+def _mac(payload: bytes, secret: str) -> bytes:
+    return hmac.new(secret.encode(), payload, hashlib.sha256).digest()[:_MAC_BYTES]
+
+
+def new_ticket_token(owner_id: int, secret: str = TICKET_SECRET) -> str:
+    """
+    Подписанный токен: "s1" + base64url(owner_id, случайный номер билета, HMAC-SHA256 от них).
+    34 символа — влезает и в deep link (?start=), и в callback_data кнопки отметки.
+    Без секрета — токен старого формата.
+    """
+    if not secret:
+        return f"{owner_id:x}aa{int(time.time()):x}{uuid.uuid4().hex[:6]}"
+    payload = _PAYLOAD.pack(owner_id, secrets.token_bytes(_NONCE_BYTES))
+    return SIGNED_PREFIX + base64.urlsafe_b64encode(payload + _mac(payload, secret)).decode()
+
+
+def verify_ticket_token(token: str, secret: str = TICKET_SECRET) -> int | None:
+    """
+    Проверяет токен без обращения к БД.
+    Для подписанного возвращает owner_id, для старого формата — None (его подлинность знает только БД).
+    Поддельный, битый или просто чужой текст — InvalidTicketToken.
+    """
+    if token.startswith(SIGNED_PREFIX) and len(token) == _SIGNED_LENGTH:
+        if not secret:
+            raise InvalidTicketToken("подписанный билет, но TICKET_SECRET не задан")
+        try:
+            raw = base64.urlsafe_b64decode(token[len(SIGNED_PREFIX):])
+        except ValueError:
+            raise InvalidTicketToken("токен не декодируется")
+        payload, mac = raw[:_PAYLOAD.size], raw[_PAYLOAD.size:]
+        if not hmac.compare_digest(mac, _mac(payload, secret)):
+            raise InvalidTicketToken("подпись не сходится")
+        owner_id, _ = _PAYLOAD.unpack(payload)
+        return owner_id
+    if _LEGACY_RE.fullmatch(token):
+        return None
+    raise InvalidTicketToken("неизвестный формат токена")
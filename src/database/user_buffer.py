@@ -0,0 +1,83 @@
+import asyncio
+import logging
+import os
+
+# как часто и какими пачками сбрасываем пользователей в БД (можно переопределить в .env)
+USER_FLUSH_INTERVAL_MS = int(os.getenv("USER_FLUSH_INTERVAL_MS", 200))
+USER_FLUSH_MAX_ROWS = int(os.getenv("USER_FLUSH_MAX_ROWS", 500))
+
+
+class UserWriteBuffer:
+    """
+    Write-behind буфер для upsert'ов в users.
+    Новые и изменившиеся пользователи копятся в памяти и раз в interval_ms
+    (или как только набралось max_rows) уходят в БД одним запросом через Database.add_users_bulk.
+    Если строка нужна в БД прямо сейчас (например, из-за внешнего ключа), есть flush_user().
+    """
+
+    def __init__(self, db, interval_ms: int = USER_FLUSH_INTERVAL_MS, max_rows: int = USER_FLUSH_MAX_ROWS):
+        self.db = db
+        self.interval = interval_ms / 1000
+        self.max_rows = max_rows
+        # telegram_id -> (username, name); последняя версия профиля побеждает
+        self._pending: dict[int, tuple[str, str]] = {}
+        self._in_flight: set[int] = set()
+        self._flush_lock = asyncio.Lock()
+        self._wakeup = asyncio.Event()
+        self._task: asyncio.Task | None = None
+        self._closing = False
+
+    def add(self, telegram_id: int, username: str, name: str):
+        """Ставит пользователя в очередь на запись. Ничего не ждет."""
+        self._pending[telegram_id] = (username, name)
+        if len(self._pending) >= self.max_rows:
+            self._wakeup.set()
+
+    async def flush(self):
+        """Синхронно пишет все накопленное. При ошибке строки возвращаются в очередь, а ошибка пробрасывается."""
+        async with self._flush_lock:
+            if not self._pending:
+                return
+            batch, self._pending = self._pending, {}
+            self._in_flight = set(batch)
+            try:
+                await self.db.add_users_bulk([(tid, username, name) for tid, (username, name) in batch.items()])
+            except Exception:
+                # более свежие версии, пришедшие во время записи, не затираем
+                for tid, profile in batch.items():
+                    self._pending.setdefault(tid, profile)
+                raise
+            finally:
+                self._in_flight = set()
+
+    async def flush_user(self, telegram_id: int):
+        """Гарантирует, что строка пользователя уже в БД (если он вообще проходил через буфер)."""
+        if telegram_id in self._pending or telegram_id in self._in_flight:
+            await self.flush()
+
+    async def _run(self):
+        while not self._closing:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            try:
+                await self.flush()
+            except Exception:
+                logging.exception(f"Не удалось записать {len(self._pending)} пользователей, повторим позже.")
+
+    def start(self):
+        if not self._task:
+            self._task = asyncio.create_task(self._run())
+
+    async def close(self):
+        """Останавливает фоновую запись и сбрасывает остаток в БД."""
+        if self._task:
+            # задачу не отменяем: отмена посреди flush() потеряла бы уже вынутую из _pending пачку.
+            # Будим цикл — он допишет текущую пачку и выйдет сам
+            self._closing = True
+            self._wakeup.set()
+            await self._task
+            self._task = None
+        await self.flush()